@@ -0,0 +1,34 @@
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.http import HttpResponseForbidden
+from django.shortcuts import render
+
+from medical_records.pagination import keyset_paginate, get_page_size
+from .models import PATIENT, DOCTOR, ADMIN
+
+
+@login_required
+def user_directory(request):
+    if not request.user.profile.is_admin():
+        return HttpResponseForbidden()
+    
+    query = request.GET.get('q', '').strip()
+    role = request.GET.get('role', '')
+    users = User.objects.select_related('profile')
+    if role in (PATIENT, DOCTOR, ADMIN):
+        users = users.filter(profile__role=role)
+    if query:
+        users = users.filter(
+            Q(username__istartswith=query) | Q(first_name__istartswith=query)
+            | Q(last_name__istartswith=query) | Q(email__istartswith=query)
+        )
+    # Newest accounts first, paged on the primary key
+    page = keyset_paginate(users, request.GET.get('cursor'), get_page_size(request), fields=('id',))
+    
+    return render(request, 'accounts/user_directory.html', {
+        'members': page,
+        'page': page,
+        'query': query,
+        'role': role,
+    })
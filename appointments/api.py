@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET, require_POST
+
+from . import availability, catalog
+from .booking import SlotTaken
+from .forms import AppointmentForm
+
+
+@login_required
+@require_GET
+def free_slots(request):
+    """
+    Open slots for one doctor (``?doctor=<id>``) or every doctor of a
+    specialization (``?specialization=<name>``), over ``days`` days from
+    ``from`` (default today).
+    """
+    try:
+        days = max(1, min(int(request.GET.get('days', availability.SEARCH_DAYS)), availability.MAX_SEARCH_DAYS))
+        first_day = date.fromisoformat(request.GET['from']) if request.GET.get('from') else timezone.localdate()
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        return JsonResponse({'error': 'days, from and limit must be a number, a date and a number.'}, status=400)
+    if limit is not None and limit < 1:
+        return JsonResponse({'error': 'limit must be at least 1.'}, status=400)
+
+    doctors = User.objects.filter(profile__role='doctor')
+    if request.GET.get('doctor'):
+        try:
+            doctors = doctors.filter(pk=int(request.GET['doctor']))
+        except ValueError:
+            return JsonResponse({'error': 'doctor must be a user id.'}, status=400)
+    elif request.GET.get('specialization'):
+        doctors = availability.doctors_for_specialization(request.GET['specialization'])
+    else:
+        return JsonResponse({'error': 'Pass a doctor or a specialization.'}, status=400)
+
+    doctors = list(doctors.order_by('pk').values_list('pk', 'username', 'first_name', 'last_name'))
+    slots = availability.free_slots([pk for pk, *_ in doctors], first_day, days, limit=limit)
+
+    return JsonResponse({
+        'from': first_day.isoformat(),
+        'to': (first_day + timedelta(days=days - 1)).isoformat(),
+        'doctors': [
+            {
+                'id': pk,
+                'name': f'{first_name} {last_name}'.strip() or username,
+                'slot_minutes': availability.get_schedule(pk).slot_minutes,
+                'slots': [start.isoformat(timespec='minutes') for start in slots[pk]],
+            }
+            for pk, username, first_name, last_name in doctors
+        ],
+    })
+
+
+@login_required
+@require_GET
+def doctors(request):
+    """
+    Doctors (id, name, specialization) for ``?specialization=<name>``.
+
+    With the catalog version in the ETag a revalidating browser gets a 304
+    from a single read of the shared cache.
+    """
+    specialization = request.GET.get('specialization', '').strip()
+    if not specialization:
+        return JsonResponse({'error': 'Pass a specialization.'}, status=400)
+
+    version = catalog.current_version()
+    etag = catalog.roster_etag(version, specialization)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({
+            'specialization': specialization,
+            'doctors': catalog.get_roster(specialization, version),
+        })
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required
+@require_POST
+def book(request):
+    """
+    Book an appointment from ``AppointmentForm`` fields. A slot lost to a
+    concurrent booking answers 409 with the nearest open alternatives.
+    """
+    if not request.user.profile.is_patient():
+        return JsonResponse({'error': 'Only patients can book appointments.'}, status=403)
+
+    form = AppointmentForm(request.POST, patient=request.user)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        appointment = form.save()
+    except SlotTaken as taken:
+        return JsonResponse({
+            'error': str(taken),
+            'alternatives': [start.isoformat(timespec='minutes') for start in taken.alternatives],
+        }, status=409)
+    return JsonResponse({
+        'id': appointment.pk,
+        'doctor': appointment.doctor_id,
+        'date': appointment.appointment_date.isoformat(),
+        'time': appointment.appointment_time.isoformat(timespec='minutes'),
+        'status': appointment.status,
+    }, status=201)
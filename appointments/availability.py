@@ -0,0 +1,174 @@
+"""
+Doctor availability: free-slot search and booking conflict detection.
+
+A doctor's day is cut into fixed-length slots inside their working hours
+(``APPOINTMENT_WORKING_HOURS`` / ``APPOINTMENT_SLOT_MINUTES``, overridable
+per doctor through ``APPOINTMENT_DOCTOR_SCHEDULES``). Every appointment that
+is not cancelled occupies one slot length from its start time.
+
+Booked appointments for the window being searched are loaded in a single
+range query over ``appointment_doctor_slot_idx`` and kept per doctor in an
+``IntervalIndex``, so each candidate slot is checked with a binary search
+however many bookings a doctor has.
+"""
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import datetime, time, timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Appointment
+from . import catalog
+
+SEARCH_DAYS = 14
+MAX_SEARCH_DAYS = 62
+# Statuses that no longer hold on to their slot
+FREE_STATUSES = ('cancelled',)
+
+DEFAULT_WORKING_HOURS = {weekday: [('09:00', '17:00')] for weekday in range(5)}
+DEFAULT_SLOT_MINUTES = 30
+
+Schedule = namedtuple('Schedule', 'hours slot_minutes')
+
+
+class IntervalIndex:
+    """
+    Half-open ``[start, end)`` intervals sorted by start.
+
+    ``max_end[i]`` is the latest end among the first ``i + 1`` intervals, so
+    an overlap test is one bisect even when stored intervals overlap each
+    other (double bookings made before conflicts were checked).
+    """
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals)
+        self.starts = [start for start, end in intervals]
+        self.ends = [end for start, end in intervals]
+        self.max_end = list(accumulate(self.ends, max))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        # Only intervals starting before ``end`` can overlap; of those, one
+        # does if the latest of their ends is after ``start``
+        i = bisect_left(self.starts, end)
+        return i > 0 and self.max_end[i - 1] > start
+
+    def add(self, start, end):
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.max_end = list(accumulate(self.ends, max))
+
+
+def _parse_time(value):
+    return value if isinstance(value, time) else time.fromisoformat(value)
+
+
+def get_schedule(doctor_id):
+    """Working hours (weekday -> ``[(start, end), ...]``) and slot length for a doctor."""
+    overrides = getattr(settings, 'APPOINTMENT_DOCTOR_SCHEDULES', {}).get(doctor_id, {})
+    hours = overrides.get('hours', getattr(settings, 'APPOINTMENT_WORKING_HOURS', DEFAULT_WORKING_HOURS))
+    slot_minutes = overrides.get('slot_minutes', getattr(settings, 'APPOINTMENT_SLOT_MINUTES', DEFAULT_SLOT_MINUTES))
+    return Schedule(
+        {int(day): [(_parse_time(start), _parse_time(end)) for start, end in spans] for day, spans in hours.items()},
+        slot_minutes,
+    )
+
+
+def booked_intervals(doctors, first_day, last_day, exclude=None):
+    """
+    ``{doctor_id: IntervalIndex}`` of the bookings between two dates.
+
+    ``doctors`` is a list of ids or a queryset of users; passing a queryset
+    keeps a specialization with hundreds of doctors to one query.
+    """
+    bookings = Appointment.objects.filter(
+        doctor__in=doctors,
+        appointment_date__gte=first_day,
+        appointment_date__lte=last_day,
+    ).exclude(status__in=FREE_STATUSES)
+    if exclude is not None:
+        bookings = bookings.exclude(pk=exclude)
+
+    intervals = defaultdict(list)
+    lengths = {}
+    for doctor_id, day, start_time in bookings.values_list('doctor_id', 'appointment_date', 'appointment_time'):
+        if doctor_id not in lengths:
+            lengths[doctor_id] = timedelta(minutes=get_schedule(doctor_id).slot_minutes)
+        start = datetime.combine(day, start_time)
+        intervals[doctor_id].append((start, start + lengths[doctor_id]))
+    return defaultdict(IntervalIndex, {
+        doctor_id: IntervalIndex(spans) for doctor_id, spans in intervals.items()
+    })
+
+
+def slot_grid(schedule, first_day, days):
+    """Every slot start inside working hours, in order, as naive local datetimes."""
+    length = timedelta(minutes=schedule.slot_minutes)
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        for start_time, end_time in schedule.hours.get(day.weekday(), ()):
+            start = datetime.combine(day, start_time)
+            end = datetime.combine(day, end_time)
+            while start + length <= end:
+                yield start
+                start += length
+
+
+def free_slots(doctors, first_day=None, days=SEARCH_DAYS, now=None, limit=None, exclude=None):
+    """
+    ``{doctor_id: [slot start, ...]}`` of open slots from ``first_day`` for
+    ``days`` days, skipping slots that have already started.
+    """
+    now = timezone.localtime(now) if now else timezone.localtime()
+    now = now.replace(tzinfo=None)
+    first_day = first_day or now.date()
+    last_day = first_day + timedelta(days=days - 1)
+
+    doctor_ids = list(doctors.values_list('pk', flat=True)) if hasattr(doctors, 'values_list') else list(doctors)
+    booked = booked_intervals(doctor_ids, first_day, last_day, exclude=exclude)
+
+    result = {}
+    for doctor_id in doctor_ids:
+        schedule = get_schedule(doctor_id)
+        length = timedelta(minutes=schedule.slot_minutes)
+        index = booked[doctor_id]
+        slots = []
+        for start in slot_grid(schedule, first_day, days):
+            if start <= now or index.overlaps(start, start + length):
+                continue
+            slots.append(start)
+            if limit and len(slots) >= limit:
+                break
+        result[doctor_id] = slots
+    return result
+
+
+def doctors_for_specialization(specialization):
+    return User.objects.filter(
+        profile__role='doctor',
+        doctor_profile__specialization__in=catalog.get_catalog().spellings(specialization),
+    )
+
+
+def has_conflict(doctor_id, day, start_time, exclude=None):
+    """Whether a booking for ``doctor_id`` at ``day``/``start_time`` overlaps an existing one."""
+    length = timedelta(minutes=get_schedule(doctor_id).slot_minutes)
+    start = datetime.combine(day, start_time)
+    # A slot can only collide with bookings on its own day or, for slots
+    # running past midnight, the day before
+    index = booked_intervals([doctor_id], day - timedelta(days=1), day, exclude=exclude)[doctor_id]
+    return index.overlaps(start, start + length)
+
+
+def nearest_free_slots(doctor_id, day, start_time, count=5, days=SEARCH_DAYS, now=None):
+    """The ``count`` open slots closest to ``day``/``start_time``, in time order."""
+    wanted = datetime.combine(day, start_time)
+    first_day = max(day - timedelta(days=days // 2), timezone.localdate(now))
+    slots = free_slots([doctor_id], first_day, days, now=now)[doctor_id]
+    return sorted(sorted(slots, key=lambda slot: abs(slot - wanted))[:count])
@@ -0,0 +1,98 @@
+"""
+Contention-safe appointment booking.
+
+A booking is a short transaction that re-checks the doctor's slot and
+inserts the row. ``appointment_active_slot_uniq`` (a partial unique index on
+doctor, date and time for appointments that are not cancelled) is the final
+word when two requests race for the same slot; the loser gets ``SlotTaken``
+with the nearest open alternatives.
+
+With the production database profile every transaction starts with
+``BEGIN IMMEDIATE``, so the write lock is taken before the re-check and
+concurrent bookers queue on the busy timeout instead of failing on a lock
+upgrade. Anything still reported as locked is retried a few times with
+jittered exponential backoff.
+"""
+import random
+import time
+
+from django.db import IntegrityError, OperationalError, transaction
+
+from . import availability
+
+BOOKING_ATTEMPTS = 5
+BACKOFF_BASE = 0.01
+BACKOFF_MAX = 0.25
+ALTERNATIVE_COUNT = 5
+
+SLOT_INDEX = 'appointment_active_slot_uniq'
+# SQLite names the columns of a violated unique index rather than the index
+SLOT_COLUMNS = ', '.join(
+    f'appointments_appointment.{column}' for column in ('doctor_id', 'appointment_date', 'appointment_time')
+)
+
+
+class SlotTaken(Exception):
+    def __init__(self, alternatives=()):
+        super().__init__('This time slot has just been taken.')
+        self.alternatives = list(alternatives)
+
+
+def _is_lock_error(error):
+    return 'locked' in str(error)
+
+
+def _is_slot_taken(error):
+    message = str(error)
+    return SLOT_INDEX in message or SLOT_COLUMNS in message
+
+
+def _backoff(attempt):
+    # Full jitter keeps retrying writers from waking up in lockstep
+    time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+
+
+def reserve(appointment, attempts=BOOKING_ATTEMPTS):
+    """
+    Save ``appointment`` if its slot is still free, raising ``SlotTaken``
+    (with alternatives) if another booking holds it.
+    """
+    adding = appointment._state.adding
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                if availability.has_conflict(
+                    appointment.doctor_id, appointment.appointment_date,
+                    appointment.appointment_time, exclude=appointment.pk,
+                ):
+                    break
+                appointment.save()
+            return appointment
+        except IntegrityError as error:
+            # Lost the race for the slot; any other constraint is a real error
+            if not _is_slot_taken(error):
+                raise
+            break
+        except OperationalError as error:
+            if not _is_lock_error(error) or attempt == attempts - 1:
+                raise
+            if adding:
+                # The insert was rolled back; try it again as an insert
+                appointment.pk = None
+                appointment._state.adding = True
+            _backoff(attempt)
+
+    raise SlotTaken(alternatives(appointment, attempts))
+
+
+def alternatives(appointment, attempts=BOOKING_ATTEMPTS):
+    for attempt in range(attempts):
+        try:
+            return availability.nearest_free_slots(
+                appointment.doctor_id, appointment.appointment_date,
+                appointment.appointment_time, count=ALTERNATIVE_COUNT,
+            )
+        except OperationalError as error:
+            if not _is_lock_error(error) or attempt == attempts - 1:
+                raise
+            _backoff(attempt)
@@ -0,0 +1,152 @@
+"""
+Catalog of doctor specializations for the booking form.
+
+The distinct, normalized list of specializations is built once per process
+and reused until a ``DoctorProfile`` is saved or deleted, which bumps a
+version token in the cache; each process notices the new token on its
+next lookup and rebuilds (``CACHES`` has to be a shared backend for that to
+reach every worker). Building the form therefore costs one cache read and
+no queries.
+
+Doctor rosters per specialization are cached under the same version, so
+they are replaced together with the catalog; renaming a user bumps the
+version as well.
+
+"Did you mean" suggestions come from a trigram index over the catalog: a
+misspelling is scored only against the entries that share at least one
+trigram with it instead of being compared with every doctor's profile.
+"""
+import hashlib
+import re
+import threading
+import uuid
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from accounts.models import DoctorProfile
+
+VERSION_KEY = 'appointments:specializations:version'
+SUGGESTION_CUTOFF = 0.4
+ROSTER_TIMEOUT = 24 * 60 * 60
+
+_local = {'version': None, 'catalog': None}
+_lock = threading.Lock()
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize(name):
+    return WHITESPACE_RE.sub(' ', name or '').strip().casefold()
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Catalog:
+    def __init__(self, raw_names):
+        # normalized key -> every stored spelling, the first one for display
+        self.variants = {}
+        for raw in raw_names:
+            key = normalize(raw)
+            if key:
+                self.variants.setdefault(key, []).append(raw)
+        self.names = sorted((spellings[0] for spellings in self.variants.values()), key=str.casefold)
+
+        self.grams = {}
+        self.postings = defaultdict(list)
+        for key in self.variants:
+            self.grams[key] = trigrams(key)
+            for gram in self.grams[key]:
+                self.postings[gram].append(key)
+
+    def __contains__(self, name):
+        return normalize(name) in self.variants
+
+    def display_name(self, name):
+        spellings = self.variants.get(normalize(name))
+        return spellings[0] if spellings else None
+
+    def spellings(self, name):
+        """Every stored spelling of ``name``, for filtering doctor profiles."""
+        return self.variants.get(normalize(name)) or [name]
+
+    def choices(self):
+        return [(name, name) for name in self.names]
+
+    def suggest(self, name, n=3, cutoff=SUGGESTION_CUTOFF):
+        """Closest catalog entries to ``name`` by trigram (Dice) similarity."""
+        key = normalize(name)
+        if not key:
+            return []
+        grams = trigrams(key)
+        shared = Counter(entry for gram in grams for entry in self.postings.get(gram, ()))
+        scored = []
+        for entry, count in shared.items():
+            score = 2 * count / (len(grams) + len(self.grams[entry]))
+            if score >= cutoff:
+                scored.append((-score, entry))
+        return [self.variants[entry][0] for _, entry in sorted(scored)[:n]]
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_catalog():
+    version = current_version()
+    with _lock:
+        if _local['version'] == version and _local['catalog'] is not None:
+            return _local['catalog']
+    catalog = Catalog(DoctorProfile.objects.values_list('specialization', flat=True).distinct())
+    with _lock:
+        _local['version'] = version
+        _local['catalog'] = catalog
+    return catalog
+
+
+def invalidate():
+    """Make every process rebuild the catalog on its next lookup."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _digest(specialization):
+    return hashlib.sha1(normalize(specialization).encode()).hexdigest()[:16]
+
+
+def roster_etag(version, specialization):
+    return f'"{version[:16]}-{_digest(specialization)}"'
+
+
+def get_roster(specialization, version=None):
+    """
+    ``[{'id', 'name', 'specialization'}, ...]`` for the doctors of a
+    specialization, from the cache while the catalog version holds.
+    """
+    version = version or current_version()
+    key = f'appointments:roster:{version}:{_digest(specialization)}'
+    roster = cache.get(key)
+    if roster is None:
+        doctors = User.objects.filter(
+            profile__role='doctor',
+            doctor_profile__specialization__in=get_catalog().spellings(specialization),
+        ).order_by('first_name', 'last_name', 'username')
+        roster = [
+            {
+                'id': pk,
+                'name': f'{first_name} {last_name}'.strip() or username,
+                'specialization': stored,
+            }
+            for pk, username, first_name, last_name, stored in doctors.values_list(
+                'pk', 'username', 'first_name', 'last_name', 'doctor_profile__specialization',
+            )
+        ]
+        cache.set(key, roster, ROSTER_TIMEOUT)
+    return roster
@@ -3,8 +3,7 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import datetime
 from .models import Appointment, STATUS_CHOICES
-from accounts.models import DoctorProfile
-from difflib import get_close_matches
+from . import availability, booking, catalog
 
 class AppointmentForm(forms.ModelForm):
     specialization = forms.ChoiceField(
@@ -28,20 +27,18 @@ class AppointmentForm(forms.ModelForm):
         self.patient = kwargs.pop('patient', None)
         super().__init__(*args, **kwargs)
 
-        # Populate specializations
-        specializations = DoctorProfile.objects.values_list(
-            'specialization', flat=True
-        ).distinct()
+        # Populate specializations from the cached catalog
+        self.catalog = catalog.get_catalog()
         self.fields['specialization'].choices = [
             ('', '---Select Specialization---')
-        ] + [(spec, spec) for spec in specializations]
+        ] + self.catalog.choices()
 
         # Set doctor queryset based on selected specialization
         specialization = self.data.get('specialization') or self.initial.get('specialization')
         if specialization:
             self.fields['doctor'].queryset = User.objects.filter(
                 profile__role='doctor',
-                doctor_profile__specialization=specialization
+                doctor_profile__specialization__in=self.catalog.spellings(specialization)
             )
         else:
             self.fields['doctor'].queryset = User.objects.none()
@@ -49,9 +46,8 @@ class AppointmentForm(forms.ModelForm):
 
     def clean_specialization(self):
         specialization = self.cleaned_data['specialization']
-        if not DoctorProfile.objects.filter(specialization=specialization).exists():
-            all_specs = DoctorProfile.objects.values_list('specialization', flat=True)
-            suggestions = get_close_matches(specialization, all_specs, n=3, cutoff=0.6)
+        if specialization not in self.catalog:
+            suggestions = self.catalog.suggest(specialization)
             if suggestions:
                 raise forms.ValidationError(
                     f"Invalid specialization. Did you mean: {', '.join(suggestions)}?"
@@ -69,7 +65,7 @@ class AppointmentForm(forms.ModelForm):
 
         # Validate doctor matches specialization
         if doctor and specialization:
-            if not hasattr(doctor, 'doctor_profile') or doctor.doctor_profile.specialization != specialization:
+            if not hasattr(doctor, 'doctor_profile') or catalog.normalize(doctor.doctor_profile.specialization) != catalog.normalize(specialization):
                 self.add_error('doctor', 'Selected doctor does not match the specialization.')
 
         # Validate appointment datetime
@@ -80,6 +76,10 @@ class AppointmentForm(forms.ModelForm):
             if appointment_datetime <= timezone.now():
                 raise forms.ValidationError('Appointment must be scheduled in the future.')
 
+        if doctor and appointment_date and appointment_time:
+            if availability.has_conflict(doctor.pk, appointment_date, appointment_time, exclude=self.instance.pk):
+                self.add_error('appointment_time', 'The doctor already has an appointment at this time.')
+
         return cleaned_data
 
     def save(self, commit=True):
@@ -88,7 +88,8 @@ class AppointmentForm(forms.ModelForm):
             appointment.patient = self.patient
             appointment.status = 'pending'  # Set initial status
         if commit:
-            appointment.save()
+            # Raises booking.SlotTaken if another request got the slot first
+            booking.reserve(appointment)
         return appointment
 
 class AppointmentUpdateForm(forms.ModelForm):
@@ -101,6 +102,19 @@ class AppointmentUpdateForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'rows': 3}),
         }
 
+    def clean(self):
+        cleaned_data = super().clean()
+        appointment_date = cleaned_data.get('appointment_date')
+        appointment_time = cleaned_data.get('appointment_time')
+        status = cleaned_data.get('status')
+
+        # Moving an appointment must not land on another booking
+        if appointment_date and appointment_time and status not in availability.FREE_STATUSES:
+            if availability.has_conflict(self.instance.doctor_id, appointment_date, appointment_time, exclude=self.instance.pk):
+                self.add_error('appointment_time', 'The doctor already has an appointment at this time.')
+
+        return cleaned_data
+
 class AppointmentStatusForm(forms.ModelForm):
     class Meta:
         model = Appointment
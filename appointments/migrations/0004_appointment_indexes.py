@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 11:20
+
+from django.db import migrations
+
+# Created with SQL rather than Meta.indexes so the model state is untouched;
+# IF NOT EXISTS keeps the migration safe to re-run against a restored dump.
+INDEXES = [
+    # Doctor schedules and conflict checks
+    ('appointment_doctor_slot_idx', '"doctor_id", "appointment_date", "appointment_time", "status"'),
+    # Patient lists, newest first
+    ('appointment_patient_date_idx', '"patient_id", "appointment_date" DESC, "appointment_time" DESC'),
+    # Default model ordering (-appointment_date, -appointment_time)
+    ('appointment_date_time_idx', '"appointment_date" DESC, "appointment_time" DESC'),
+    ('appointment_status_date_idx', '"status", "appointment_date"'),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_appointment_specialization_alter_appointment_id'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f'CREATE INDEX IF NOT EXISTS "{name}" ON "appointments_appointment" ({columns});',
+            reverse_sql=f'DROP INDEX IF EXISTS "{name}";',
+        )
+        for name, columns in INDEXES
+    ]
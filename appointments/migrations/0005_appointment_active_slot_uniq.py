@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 12:40
+
+from django.db import migrations
+from django.db.models import Count
+
+# One live booking per doctor and start time; cancelled appointments free
+# their slot. Created with SQL for the same reason as 0004_appointment_indexes.
+
+# Which of several bookings for one slot survives, best first
+KEEP_ORDER = ['completed', 'approved', 'rescheduled', 'pending']
+
+
+def cancel_double_bookings(apps, schema_editor):
+    """
+    Keep one live booking per slot (the furthest along, then the oldest)
+    and cancel the rest, so the unique index can be created.
+    """
+    Appointment = apps.get_model('appointments', 'Appointment')
+    active = Appointment.objects.exclude(status='cancelled')
+    slots = (
+        active.order_by().values('doctor_id', 'appointment_date', 'appointment_time')
+        .annotate(bookings=Count('pk')).filter(bookings__gt=1)
+    )
+    for slot in slots:
+        bookings = sorted(
+            active.filter(
+                doctor_id=slot['doctor_id'], appointment_date=slot['appointment_date'],
+                appointment_time=slot['appointment_time'],
+            ),
+            key=lambda booking: (
+                KEEP_ORDER.index(booking.status) if booking.status in KEEP_ORDER else len(KEEP_ORDER),
+                booking.date_created, booking.pk,
+            ),
+        )
+        for booking in bookings[1:]:
+            booking.status = 'cancelled'
+            booking.notes = '\n'.join(filter(None, [
+                booking.notes, f'Cancelled automatically: slot double-booked with appointment {bookings[0].pk}.',
+            ]))
+            booking.save(update_fields=['status', 'notes', 'date_updated'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_appointment_indexes'),
+    ]
+
+    operations = [
+        # Migrations skip the dashboard counter signals; run rebuild_stats
+        # afterwards if this cancelled anything
+        migrations.RunPython(cancel_double_bookings, migrations.RunPython.noop),
+        migrations.RunSQL(
+            sql=(
+                'CREATE UNIQUE INDEX IF NOT EXISTS "appointment_active_slot_uniq" '
+                'ON "appointments_appointment" ("doctor_id", "appointment_date", "appointment_time") '
+                "WHERE \"status\" <> 'cancelled';"
+            ),
+            reverse_sql='DROP INDEX IF EXISTS "appointment_active_slot_uniq";',
+        ),
+    ]
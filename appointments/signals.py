@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog
+
+
+@receiver(post_save, sender='accounts.DoctorProfile')
+@receiver(post_delete, sender='accounts.DoctorProfile')
+def invalidate_specialization_catalog(sender, raw=False, **kwargs):
+    # After commit, so no process can rebuild from the old rows under the
+    # new version
+    transaction.on_commit(catalog.invalidate)
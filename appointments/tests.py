@@ -0,0 +1,309 @@
+import datetime
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from medical_records.tests import QueryBudgetMixin, build_history, create_user
+# Needs accounts and appointments.models; see medical_records.tests
+from accounts.models import PATIENT, DOCTOR
+from .models import Appointment
+from . import availability, booking, catalog
+from .forms import AppointmentForm
+
+
+class BookingContentionTests(TransactionTestCase):
+    """Hundreds of concurrent bookings for a handful of slots."""
+
+    BOOKINGS = 300
+    WORKERS = 16
+    # Lenient (about a quarter of what a laptop manages) so slow CI machines
+    # pass, yet a regression to serialized bookings still fails
+    MIN_BOOKINGS_PER_SECOND = 50
+
+    def setUp(self):
+        self.doctors = [create_user(f'doctor{i}', DOCTOR, 'Cardiology') for i in range(3)]
+        self.patients = [create_user(f'patient{i}', PATIENT) for i in range(20)]
+        self.day = datetime.date.today() + datetime.timedelta(days=1)
+        while self.day.weekday() > 4:
+            self.day += datetime.timedelta(days=1)
+        self.times = [datetime.time(9, 0), datetime.time(9, 30), datetime.time(10, 0), datetime.time(10, 30)]
+
+    def attempt(self, n):
+        appointment = Appointment(
+            patient=self.patients[n % len(self.patients)],
+            doctor=self.doctors[n % len(self.doctors)],
+            appointment_date=self.day,
+            appointment_time=self.times[n % len(self.times)],
+            reason='Check-up',
+        )
+        try:
+            booking.reserve(appointment, attempts=20)
+            return 'booked'
+        except booking.SlotTaken as taken:
+            return 'taken' if taken.alternatives else 'taken without alternatives'
+        finally:
+            connection.close()
+
+    def test_no_double_booking_under_contention(self):
+        started = time.monotonic()
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            outcomes = Counter(pool.map(self.attempt, range(self.BOOKINGS)))
+        elapsed = time.monotonic() - started
+
+        slots = Counter(
+            Appointment.objects.exclude(status__in=availability.FREE_STATUSES)
+            .values_list('doctor_id', 'appointment_date', 'appointment_time')
+        )
+        self.assertTrue(slots)
+        self.assertEqual(max(slots.values()), 1, 'A slot was booked twice')
+        # 3 doctors x 4 times, and every slot ends up with exactly one booking
+        self.assertEqual(outcomes['booked'], len(self.doctors) * len(self.times))
+        self.assertEqual(outcomes['taken'], self.BOOKINGS - outcomes['booked'])
+        self.assertGreaterEqual(
+            self.BOOKINGS / elapsed, self.MIN_BOOKINGS_PER_SECOND,
+            f'{self.BOOKINGS} bookings took {elapsed:.2f}s',
+        )
+
+    def test_conflicting_booking_offers_alternatives(self):
+        first = Appointment(patient=self.patients[0], doctor=self.doctors[0],
+                            appointment_date=self.day, appointment_time=datetime.time(9), reason='Check-up')
+        booking.reserve(first)
+        second = Appointment(patient=self.patients[1], doctor=self.doctors[0],
+                             appointment_date=self.day, appointment_time=datetime.time(9, 15), reason='Check-up')
+        with self.assertRaises(booking.SlotTaken) as taken:
+            booking.reserve(second)
+        alternatives = taken.exception.alternatives
+        self.assertEqual(len(alternatives), booking.ALTERNATIVE_COUNT)
+        self.assertNotIn(datetime.datetime.combine(self.day, datetime.time(9)), alternatives)
+        self.assertIn(datetime.datetime.combine(self.day, datetime.time(9, 30)), alternatives)
+
+
+class BookingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.day = datetime.date.today() + datetime.timedelta(days=1)
+        while cls.day.weekday() > 4:
+            cls.day += datetime.timedelta(days=1)
+
+    def appointment(self, patient=None, time=datetime.time(9, 0), **fields):
+        return Appointment(
+            patient=patient or self.patient, doctor=self.doctor, appointment_date=self.day,
+            appointment_time=time, **{'reason': 'Check-up', **fields},
+        )
+
+    def test_losing_the_race_at_the_index_is_slot_taken(self):
+        booking.reserve(self.appointment())
+        # As if the other booking committed between the re-check and the insert
+        with mock.patch.object(availability, 'has_conflict', return_value=False):
+            with self.assertRaises(booking.SlotTaken) as taken:
+                booking.reserve(self.appointment(self.other_patient))
+        self.assertTrue(taken.exception.alternatives)
+
+    def test_other_integrity_errors_are_raised(self):
+        with self.assertRaises(IntegrityError):
+            booking.reserve(self.appointment(reason=None))
+
+    def test_migration_cancels_double_bookings(self):
+        migration = import_module('appointments.migrations.0005_appointment_active_slot_uniq')
+        with connection.cursor() as cursor:
+            # Rolled back with the test's transaction
+            cursor.execute('DROP INDEX appointment_active_slot_uniq')
+        pending = self.appointment()
+        pending.save()
+        approved = self.appointment(self.other_patient, status='approved')
+        approved.save()
+        older = self.appointment(time=datetime.time(10, 0))
+        older.save()
+        newer = self.appointment(self.other_patient, time=datetime.time(10, 0))
+        newer.save()
+
+        migration.cancel_double_bookings(apps, None)
+        statuses = dict(Appointment.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {
+            pending.pk: 'cancelled', approved.pk: 'approved', older.pk: 'pending', newer.pk: 'cancelled',
+        })
+        self.assertIn(f'appointment {older.pk}', Appointment.objects.get(pk=newer.pk).notes)
+
+
+class FreeSlotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Cardiology')
+        cls.day = datetime.date.today() + datetime.timedelta(days=1)
+        while cls.day.weekday() > 4:
+            cls.day += datetime.timedelta(days=1)
+        cls.booked = Appointment.objects.create(
+            patient=cls.patient, doctor=cls.doctor, appointment_date=cls.day,
+            appointment_time=datetime.time(9, 0), reason='Check-up',
+        )
+        Appointment.objects.create(
+            patient=cls.patient, doctor=cls.doctor, appointment_date=cls.day,
+            appointment_time=datetime.time(10, 0), reason='Check-up', status='cancelled',
+        )
+
+    def setUp(self):
+        catalog.invalidate()
+        self.client.force_login(self.patient)
+
+    def get(self, **params):
+        return self.client.get(reverse('appointment_free_slots'), {'from': self.day.isoformat(), 'days': 1, **params})
+
+    def test_interval_index(self):
+        index = availability.IntervalIndex([(1, 5), (2, 3), (10, 12)])
+        self.assertTrue(index.overlaps(4, 6))
+        self.assertFalse(index.overlaps(5, 10))
+        self.assertTrue(index.overlaps(11, 20))
+        self.assertFalse(index.overlaps(0, 1))
+
+    def test_booked_slots_are_taken_and_cancelled_ones_free(self):
+        slots = [start.time() for start in availability.free_slots([self.doctor.pk], self.day, 1)[self.doctor.pk]]
+        self.assertNotIn(datetime.time(9, 0), slots)
+        self.assertIn(datetime.time(9, 30), slots)
+        self.assertIn(datetime.time(10, 0), slots)
+        # The lunch break in APPOINTMENT_WORKING_HOURS
+        self.assertNotIn(datetime.time(13, 0), slots)
+        self.assertTrue(availability.has_conflict(self.doctor.pk, self.day, datetime.time(8, 45)))
+        self.assertFalse(availability.has_conflict(self.doctor.pk, self.day, datetime.time(9, 30)))
+        self.assertFalse(availability.has_conflict(self.doctor.pk, self.day, datetime.time(9, 0), exclude=self.booked.pk))
+
+    def test_endpoint_by_doctor_and_specialization(self):
+        response = self.get(doctor=self.doctor.pk)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['from'], data['to']), (self.day.isoformat(), self.day.isoformat()))
+        [doctor] = data['doctors']
+        self.assertEqual(doctor['id'], self.doctor.pk)
+        self.assertEqual(doctor['slot_minutes'], 30)
+        self.assertNotIn(f'{self.day.isoformat()}T09:00', doctor['slots'])
+        self.assertEqual(len(doctor['slots']), 13)
+
+        data = self.get(specialization='cardiology').json()
+        self.assertEqual([doctor['id'] for doctor in data['doctors']], [self.doctor.pk, self.other_doctor.pk])
+        self.assertEqual(len(data['doctors'][1]['slots']), 14)
+
+        data = self.get(specialization='Cardiology', limit=2).json()
+        self.assertEqual([len(doctor['slots']) for doctor in data['doctors']], [2, 2])
+
+    def test_endpoint_rejects_bad_parameters(self):
+        for params in ({}, {'doctor': 'me'}, {'doctor': self.doctor.pk, 'days': 'many'},
+                       {'doctor': self.doctor.pk, 'from': 'tomorrow'}, {'doctor': self.doctor.pk, 'limit': 0},
+                       {'doctor': self.doctor.pk, 'limit': -3}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.get(doctor=self.doctor.pk).status_code, 302)
+
+
+class SpecializationCatalogTests(TestCase):
+
+    def setUp(self):
+        catalog.invalidate()
+        create_user('cardiologist', DOCTOR, 'Cardiology')
+        create_user('cardiologist2', DOCTOR, ' cardiology ')
+        create_user('neurologist', DOCTOR, 'Neurology')
+        create_user('dermatologist', DOCTOR, 'Dermatology')
+
+    def test_catalog_is_normalized_and_cached(self):
+        self.assertEqual(catalog.get_catalog().names, ['Cardiology', 'Dermatology', 'Neurology'])
+        with self.assertNumQueries(0):
+            form = AppointmentForm()
+            self.assertEqual(len(form.fields['specialization'].choices), 4)
+
+    def test_suggestions(self):
+        self.assertEqual(catalog.get_catalog().suggest('Nuerology')[:1], ['Neurology'])
+        self.assertEqual(catalog.get_catalog().suggest('Radiology', cutoff=0.9), [])
+
+    def test_doctor_profile_changes_rebuild_the_catalog(self):
+        catalog.get_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user('oncologist', DOCTOR, 'Oncology')
+        self.assertIn('Oncology', catalog.get_catalog())
+
+    def test_roster_endpoint_revalidates_from_cache(self):
+        url = reverse('appointment_doctors')
+        self.client.force_login(create_user('roster_patient', PATIENT))
+        response = self.client.get(url, {'specialization': 'Cardiology'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(len(response.json()['doctors']), 2)
+        # Only the session and the user
+        with self.assertNumQueries(2):
+            again = self.client.get(url, {'specialization': 'cardiology'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_user('cardiologist3', DOCTOR, 'Cardiology')
+        changed = self.client.get(url, {'specialization': 'Cardiology'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()['doctors']), 3)
+
+    def test_roster_endpoint_needs_a_login(self):
+        response = self.client.get(reverse('appointment_doctors'), {'specialization': 'Cardiology'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_renaming_a_doctor_refreshes_the_roster(self):
+        self.client.force_login(create_user('roster_patient', PATIENT))
+        url = reverse('appointment_doctors')
+        response = self.client.get(url, {'specialization': 'Neurology'})
+        self.assertEqual([doctor['name'] for doctor in response.json()['doctors']], ['neurologist'])
+
+        doctor = User.objects.get(username='neurologist')
+        with self.captureOnCommitCallbacks(execute=True):
+            doctor.first_name = 'Ada'
+            doctor.save()
+        changed = self.client.get(url, {'specialization': 'Neurology'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([doctor['name'] for doctor in changed.json()['doctors']], ['Ada'])
+
+    def test_logging_in_keeps_the_roster(self):
+        version = catalog.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(User.objects.get(username='neurologist'))
+        self.assertEqual(catalog.current_version(), version)
+
+
+class AppointmentQueryBudgetTests(QueryBudgetMixin, TestCase):
+    budgets = {
+        'appointment_list': 6,
+        'appointment_detail': 5,
+        'appointment_create': 6,
+        'appointment_update': 6,
+        'appointment_free_slots': 4,
+        'appointment_doctors': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+
+    def setUp(self):
+        # The catalog and rosters are cached across tests
+        catalog.invalidate()
+
+    def grow(self, count, start):
+        build_history(self.patient, self.doctor, count, start)
+
+    def request_for(self, name):
+        appointment = Appointment.objects.filter(patient=self.patient).order_by('pk').first()
+        return {
+            'appointment_list': (self.patient, reverse('appointment_list')),
+            'appointment_detail': (self.patient, reverse('appointment_detail', args=[appointment.pk])),
+            'appointment_create': (self.patient, reverse('appointment_create')),
+            'appointment_update': (self.doctor, reverse('appointment_update', args=[appointment.pk])),
+            'appointment_free_slots': (self.patient, reverse('appointment_free_slots') + f'?doctor={self.doctor.pk}'),
+            'appointment_doctors': (self.patient, reverse('appointment_doctors') + '?specialization=Cardiology'),
+        }[name]
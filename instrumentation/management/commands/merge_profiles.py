@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from instrumentation import profiling
+
+
+class Command(BaseCommand):
+    help = 'Merge sampled request profiles into one collapsed-stack file for flamegraph.pl or speedscope'
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', help='URL names to merge (default: all)')
+        parser.add_argument('--directory', help='Profile directory (default: PROFILE_DIR)')
+        parser.add_argument('--output', help='Write the merged stacks here instead of stdout')
+        parser.add_argument('--separate', action='store_true',
+                            help='Keep views apart: root every stack at its URL name')
+        parser.add_argument('--top', type=int, default=0, help='Also list the N frames with the most samples')
+
+    def handle(self, *args, **options):
+        files = profiling.profile_files(set(options['views']), options['directory'])
+        if not any(files.values()):
+            raise CommandError('No profiles found.')
+
+        stacks = {}
+        for view, paths in files.items():
+            for stack, count in profiling.merge(paths, view if options['separate'] else None).items():
+                stacks[stack] = stacks.get(stack, 0) + count
+        lines = [f'{stack} {count}\n' for stack, count in sorted(stacks.items())]
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as out:
+                out.writelines(lines)
+        else:
+            self.stdout.write(''.join(lines), ending='')
+
+        # Summaries go to stderr so stdout stays a valid collapsed-stack file
+        total = sum(stacks.values())
+        profiles = sum(len(paths) for paths in files.values())
+        self.stderr.write(f'{total} samples from {profiles} requests across {len(files)} views.')
+        for frame, count in profiling.self_time(stacks)[:options['top']]:
+            self.stderr.write(f'{count:8} {count / total:6.1%}  {frame}')
+        if options['output']:
+            self.stderr.write(f'Merged stacks written to {options["output"]}.')
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from instrumentation import slowlog
+
+
+class Command(BaseCommand):
+    help = 'Rank the statements in the slow-query log by cumulative time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help='Log files to read (default: SLOW_QUERY_LOG and its backups)')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--view', help='Only statements run by this URL name')
+        parser.add_argument('--since', help='Only entries at or after this ISO date or time')
+        parser.add_argument('--plans', action='store_true', help='Print the query plan of each statement')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = datetime.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f'Invalid --since: {options["since"]}')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        paths = options['paths'] or slowlog.log_files()
+        if not paths:
+            raise CommandError('The slow-query log is empty.')
+
+        ranked = slowlog.rank(slowlog.read_entries(paths), view=options['view'], since=since)
+        self.stdout.write(f'{"total ms":>12} {"count":>7} {"mean ms":>9} {"max ms":>9}  fingerprint       top view')
+        for summary in ranked[:options['limit']]:
+            view, _ = summary['views'].most_common(1)[0]
+            site, _ = summary['sites'].most_common(1)[0]
+            self.stdout.write(
+                f'{summary["total_ms"]:12.1f} {summary["count"]:7} {summary["mean_ms"]:9.1f} '
+                f'{summary["max_ms"]:9.1f}  {summary["fingerprint"]}  {view}'
+            )
+            self.stdout.write(f'    {summary["sql"][:300]}')
+            self.stdout.write(f'    at {site}')
+            if options['plans'] and summary['plan']:
+                for line in summary['plan']:
+                    self.stdout.write(f'      {line}')
+        self.stdout.write(f'{len(ranked)} distinct statements.')
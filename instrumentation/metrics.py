@@ -0,0 +1,295 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+``MetricsMiddleware`` times every request and, through a database execute
+wrapper and the ``InstrumentedTemplates`` backend, how many queries it ran,
+how long they took and how long its templates took to render. Results are
+kept per URL name and method: a latency histogram, a queries-per-request
+histogram and counters for requests by status, SQL time, template time and
+response bytes.
+
+Each thread records into its own shard, so the request path takes no lock
+(only a thread's first request registers its shard); a scrape merges the
+shards, folding those of threads that have exited into one. Counters live
+in the process, so with several workers each one reports its own totals,
+tagged with its ``pid``.
+"""
+import hmac
+import os
+import threading
+from bisect import bisect_left
+from contextlib import ExitStack
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+UNMATCHED = '<unmatched>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestStats:
+    """What the request being handled has spent so far."""
+    __slots__ = ('request', 'queries', 'db_seconds', 'template_seconds')
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class Series:
+    """Totals for one (view, method); only ever written by its shard's thread."""
+    __slots__ = ('latency', 'latency_sum', 'query_counts', 'queries', 'db_seconds',
+                 'template_seconds', 'bytes', 'statuses')
+
+    def __init__(self):
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.query_counts = [0] * (len(QUERY_BUCKETS) + 1)
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.bytes = 0
+        self.statuses = {}
+
+    def merge(self, other):
+        self.latency = [a + b for a, b in zip(self.latency, other.latency)]
+        self.latency_sum += other.latency_sum
+        self.query_counts = [a + b for a, b in zip(self.query_counts, other.query_counts)]
+        self.queries += other.queries
+        self.db_seconds += other.db_seconds
+        self.template_seconds += other.template_seconds
+        self.bytes += other.bytes
+        for status, count in list(other.statuses.items()):
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+class Registry:
+    def __init__(self):
+        self._local = threading.local()
+        # (thread, shard) for every thread that has recorded
+        self._shards = []
+        # Totals of threads that have exited
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _series(self, key):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        series = shard.get(key)
+        if series is None:
+            series = shard[key] = Series()
+        return series
+
+    def observe(self, view, method, status, seconds, stats, size):
+        series = self._series((view, method))
+        series.latency[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        series.latency_sum += seconds
+        series.query_counts[bisect_left(QUERY_BUCKETS, stats.queries)] += 1
+        series.queries += stats.queries
+        series.db_seconds += stats.db_seconds
+        series.template_seconds += stats.template_seconds
+        series.bytes += size
+        series.statuses[status] = series.statuses.get(status, 0) + 1
+
+    def add_bytes(self, view, method, size):
+        self._series((view, method)).bytes += size
+
+    def collect(self):
+        """``{(view, method): Series}`` summed over every thread."""
+        totals = {}
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # Nothing writes to it any more; keep its counts only
+                    for key, series in shard.items():
+                        self._retired.setdefault(key, Series()).merge(series)
+            self._shards = live
+            for key, series in self._retired.items():
+                totals.setdefault(key, Series()).merge(series)
+        for _, shard in live:
+            for key, series in list(shard.items()):
+                totals.setdefault(key, Series()).merge(series)
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._retired.clear()
+            for _, shard in self._shards:
+                shard.clear()
+
+
+registry = Registry()
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_seconds += perf_counter() - started
+        stats.queries += 1
+
+
+class _TimedTemplate:
+    """Backend template whose top-level renders are added to the request's template time."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        started = perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += perf_counter() - started
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """The Django template backend, timing each render for ``MetricsMiddleware``."""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None and match.view_name else UNMATCHED
+
+
+def current_view():
+    """URL name (or path, before resolution) of the request being handled, if any."""
+    stats = _current.get()
+    if stats is None or stats.request is None:
+        return None
+    view = _view_name(stats.request)
+    return stats.request.path if view == UNMATCHED else view
+
+
+def _counted(content, view, method):
+    for chunk in content:
+        registry.add_bytes(view, method, len(chunk))
+        yield chunk
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats(request)
+        token = _current.set(stats)
+        started = perf_counter()
+        try:
+            with ExitStack() as wrappers:
+                for connection in connections.all():
+                    wrappers.enter_context(connection.execute_wrapper(_record_query))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        seconds = perf_counter() - started
+
+        view, method = _view_name(request), request.method
+        if not response.streaming:
+            size = len(response.content)
+        elif response.has_header('Content-Length'):
+            size = int(response['Content-Length'])
+        else:
+            # Counted as the body is sent; the latency is the time to the first byte
+            size = 0
+            response.streaming_content = _counted(response.streaming_content, view, method)
+        registry.observe(view, method, response.status_code, seconds, stats, size)
+        return response
+
+
+def scrape_allowed(request):
+    """Admins, or a scraper presenting ``METRICS_TOKEN`` as a bearer token."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    if token and authorization.startswith('Bearer '):
+        return hmac.compare_digest(authorization[len('Bearer '):].encode(), token.encode())
+    user = request.user
+    # Superusers made with createsuperuser may have no profile
+    profile = getattr(user, 'profile', None) if user.is_authenticated else None
+    return profile is not None and profile.is_admin()
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram(lines, name, buckets, counts, total, labels):
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {sum(counts)}')
+    lines.append(f'{name}_sum{_labels(**labels)} {total}')
+    lines.append(f'{name}_count{_labels(**labels)} {sum(counts)}')
+
+
+def render(totals=None):
+    """The Prometheus text exposition of ``totals`` (the registry's by default)."""
+    totals = registry.collect() if totals is None else totals
+    pid = os.getpid()
+    families = {
+        'http_requests_total': ('counter', 'Requests handled, by view, method and status.', []),
+        'http_request_duration_seconds': ('histogram', 'Time to the response (first byte when streamed).', []),
+        'http_request_db_queries': ('histogram', 'Database queries per request.', []),
+        'http_request_db_seconds_total': ('counter', 'Time spent in database queries.', []),
+        'http_request_template_seconds_total': ('counter', 'Time spent rendering templates.', []),
+        'http_response_bytes_total': ('counter', 'Response body bytes.', []),
+    }
+
+    def lines(name):
+        return families[name][2]
+
+    for (view, method), series in sorted(totals.items()):
+        labels = {'view': view, 'method': method, 'pid': pid}
+        for status, count in sorted(series.statuses.items()):
+            lines('http_requests_total').append(f'http_requests_total{_labels(**labels, status=status)} {count}')
+        _histogram(lines('http_request_duration_seconds'), 'http_request_duration_seconds',
+                   LATENCY_BUCKETS, series.latency, series.latency_sum, labels)
+        _histogram(lines('http_request_db_queries'), 'http_request_db_queries',
+                   QUERY_BUCKETS, series.query_counts, series.queries, labels)
+        lines('http_request_db_seconds_total').append(
+            f'http_request_db_seconds_total{_labels(**labels)} {series.db_seconds}')
+        lines('http_request_template_seconds_total').append(
+            f'http_request_template_seconds_total{_labels(**labels)} {series.template_seconds}')
+        lines('http_response_bytes_total').append(f'http_response_bytes_total{_labels(**labels)} {series.bytes}')
+
+    output = []
+    for name, (kind, description, samples) in families.items():
+        output.append(f'# HELP {name} {description}')
+        output.append(f'# TYPE {name} {kind}')
+        output.extend(samples)
+    return '\n'.join(output) + '\n'
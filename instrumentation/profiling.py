@@ -0,0 +1,287 @@
+"""
+Opt-in sampling profiler for production requests.
+
+``profiled_wsgi`` and ``profiled_asgi`` wrap the entry points in
+``medical_project.wsgi`` / ``.asgi``. With ``PROFILE_REQUESTS`` off they
+return the application unchanged, so there is no cost at all. With it on,
+a request is profiled when it is one in ``PROFILE_SAMPLE_RATE``, when its
+URL name is in ``PROFILE_URL_NAMES``, or when it carries
+``PROFILE_TOKEN`` in an ``X-Profile-Token`` header; everything else only
+pays for that check.
+
+A profiled request is sampled every ``PROFILE_INTERVAL_MS`` by one
+background thread that reads the stacks of the threads serving it (the
+WSGI worker, or under ASGI the thread Django runs the request's sync code
+on, which joins at ``request_started``). Samples are wall-clock, so time
+spent waiting on the database or a lock shows up as well; a thread stops
+being sampled at ``request_finished``, before it serves anything else.
+Frames rendering a template are labelled with the template's name. When
+the response is closed (or, for a ``wsgi.file_wrapper`` response handed
+back to the server as it is, once the application returns), the samples are written in collapsed-stack form (``frame;frame;frame count``)
+to ``PROFILE_DIR/<url name>/``; ``merge_profiles`` sums those files into
+one input for flamegraph.pl or speedscope.
+"""
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.base import Template
+from django.urls import Resolver404, resolve
+
+TOKEN_HEADER = 'X-Profile-Token'
+UNMATCHED = 'unmatched'
+
+_current = ContextVar('request_profile', default=None)
+_labels = {}
+_requests = itertools.count(1)
+
+
+def _short_filename(filename):
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base) and 'site-packages' not in filename:
+        return os.path.relpath(filename, base)
+    _, marker, rest = filename.rpartition('site-packages' + os.sep)
+    return rest if marker else os.path.basename(filename)
+
+
+def _label(frame):
+    code = frame.f_code
+    if code.co_name == 'render':
+        template = frame.f_locals.get('self')
+        if isinstance(template, Template):
+            return f'template {template.origin.template_name or template.origin.name}'
+    label = _labels.get(code)
+    if label is None:
+        # ';' separates frames in the collapsed format
+        label = _labels[code] = f'{code.co_name} ({_short_filename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+    return label
+
+
+def collapse(frame):
+    """``frame``'s stack as ``root;...;leaf``."""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Profile:
+    def __init__(self, path):
+        self.path = path
+        self.threads = set()
+        self.stacks = Counter()
+        self.started = time.time()
+
+    def add_current_thread(self):
+        self.threads.add(threading.get_ident())
+
+    def remove_current_thread(self):
+        self.threads.discard(threading.get_ident())
+
+
+class Sampler:
+    """One thread sampling the stacks of every profile in progress."""
+
+    def __init__(self):
+        self.active = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self, profile):
+        with self.lock:
+            self.active.add(profile)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='request-profiler', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def stop(self, profile):
+        with self.lock:
+            self.active.discard(profile)
+
+    def run(self):
+        interval = settings.PROFILE_INTERVAL_MS / 1000
+        while True:
+            with self.lock:
+                active = list(self.active)
+                if not active:
+                    self.wake.clear()
+            if not active:
+                # Idle until the next profiled request
+                self.wake.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in active:
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.stacks[collapse(frame)] += 1
+            del frames
+            time.sleep(interval)
+
+
+sampler = Sampler()
+
+
+def view_name(path):
+    try:
+        return resolve(path).view_name or UNMATCHED
+    except Resolver404:
+        return UNMATCHED
+
+
+def selected(path, token):
+    """Whether the request to ``path`` (with header ``token``) is to be profiled."""
+    if settings.PROFILE_TOKEN and token and hmac.compare_digest(token.encode(), settings.PROFILE_TOKEN.encode()):
+        return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    if rate and next(_requests) % rate == 0:
+        return True
+    return bool(settings.PROFILE_URL_NAMES) and view_name(path) in settings.PROFILE_URL_NAMES
+
+
+def begin(path):
+    profile = Profile(path)
+    sampler.start(profile)
+    return profile, _current.set(profile)
+
+
+def finish(profile):
+    """Stop sampling ``profile`` and write its stacks; returns the file or ``None``."""
+    sampler.stop(profile)
+    if not profile.stacks:
+        return None
+    directory = os.path.join(settings.PROFILE_DIR, view_name(profile.path).replace(':', '.'))
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(profile.started))
+    filename = os.path.join(directory, f'{stamp}-{os.getpid()}-{id(profile):x}.folded')
+    with open(filename, 'w', encoding='utf-8') as out:
+        for stack, count in sorted(profile.stacks.items()):
+            out.write(f'{stack} {count}\n')
+    return filename
+
+
+def join_request():
+    """Sample the current thread too if it is serving a profiled request."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add_current_thread()
+
+
+def leave_request():
+    """Stop sampling the current thread for the profiled request it has finished."""
+    profile = _current.get()
+    if profile is not None:
+        profile.remove_current_thread()
+
+
+class _ClosingIterable:
+    """The WSGI response, finishing the profile when the server closes it."""
+
+    def __init__(self, response, profile):
+        self.response = response
+        self.profile = profile
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            finish(self.profile)
+
+
+def profiled_wsgi(application):
+    if not settings.PROFILE_REQUESTS:
+        return application
+
+    def profiled(environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        if not selected(path, environ.get('HTTP_X_PROFILE_TOKEN')):
+            return application(environ, start_response)
+        profile, token = begin(path)
+        profile.add_current_thread()
+        try:
+            response = application(environ, start_response)
+        except BaseException:
+            finish(profile)
+            raise
+        finally:
+            _current.reset(token)
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(response, file_wrapper):
+            # Wrapping it would stop the server sending the file with sendfile()
+            finish(profile)
+            return response
+        return _ClosingIterable(response, profile)
+
+    return profiled
+
+
+def profiled_asgi(application):
+    if not settings.PROFILE_REQUESTS:
+        return application
+
+    async def profiled(scope, receive, send):
+        if scope['type'] != 'http':
+            return await application(scope, receive, send)
+        path = scope['path'].removeprefix(scope.get('root_path', ''))
+        headers = dict(scope.get('headers') or ())
+        token = headers.get(TOKEN_HEADER.lower().encode())
+        if not selected(path, token.decode('latin-1') if token else None):
+            return await application(scope, receive, send)
+        profile, context = begin(path)
+        try:
+            return await application(scope, receive, send)
+        finally:
+            _current.reset(context)
+            finish(profile)
+
+    return profiled
+
+
+def profile_files(views=None, directory=None):
+    """``{url name: [collapsed-stack files]}``, optionally for some URL names only."""
+    directory = str(directory or settings.PROFILE_DIR)
+    if not os.path.isdir(directory):
+        return {}
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if views and name not in views:
+            continue
+        folder = os.path.join(directory, name)
+        if os.path.isdir(folder):
+            files[name] = sorted(
+                os.path.join(folder, entry) for entry in os.listdir(folder) if entry.endswith('.folded')
+            )
+    return files
+
+
+def merge(paths, prefix=None):
+    """Sum the stacks in ``paths``, each rooted at ``prefix`` when given."""
+    stacks = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as source:
+            for line in source:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and count.isdigit():
+                    stacks[f'{prefix};{stack}' if prefix else stack] += int(count)
+    return stacks
+
+
+def self_time(stacks):
+    """Samples per leaf frame, most first."""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rpartition(';')[2]] += count
+    return leaves.most_common()
@@ -0,0 +1,21 @@
+from django.core.signals import request_finished, request_started
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import profiling, slowlog
+
+
+@receiver(connection_created)
+def watch_slow_queries(sender, connection, **kwargs):
+    slowlog.install(connection)
+
+
+@receiver(request_started)
+def join_profiled_request(sender, **kwargs):
+    # Under ASGI this runs on the thread that will serve the request
+    profiling.join_request()
+
+
+@receiver(request_finished)
+def leave_profiled_request(sender, **kwargs):
+    profiling.leave_request()
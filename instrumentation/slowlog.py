@@ -0,0 +1,263 @@
+"""
+Slow-query log.
+
+Every database connection gets an execute wrapper as it is opened (see
+``signals``). When ``SLOW_QUERY_THRESHOLD_MS`` is set, a statement that
+takes that long or longer is written as one JSON line to ``SLOW_QUERY_LOG``
+with:
+
+* a fingerprint of the SQL with literals, placeholders and ``IN`` lists
+  folded, so the same statement with other values ranks as one;
+* its parameters, redacted: numbers, booleans and NULLs are kept (ids),
+  text, bytes and dates are reduced to their type and length;
+* the URL name of the request that ran it and the template line or project
+  frame it came from;
+* the output of ``EXPLAIN QUERY PLAN``, run once per fingerprint on the
+  same connection.
+
+Every worker process appends to the same file, so it is rotated from
+outside (logrotate renaming it to ``<log>.1``, ``<log>.2``, ...); each
+process notices the rename and reopens the file before its next entry.
+``rank()`` (the ``slow_queries`` command) sums the log by fingerprint.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from decimal import Decimal
+from logging.handlers import WatchedFileHandler
+from time import perf_counter
+
+from django.conf import settings
+from django.template.base import Node
+from django.utils import timezone
+
+from . import metrics
+
+PLAN_CACHE_SIZE = 1000
+EXPLAINED = ('select', 'insert', 'update', 'delete', 'with', 'replace')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%s|\?')
+IN_LIST_RE = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+VALUES_RE = re.compile(r'\bVALUES\s*\([^)]*\)(?:\s*,\s*\([^)]*\))*', re.IGNORECASE)
+SPACE_RE = re.compile(r'\s+')
+
+logger = logging.getLogger('instrumentation.slow_queries')
+logger.propagate = False
+errors = logging.getLogger(__name__)
+
+_handler_lock = threading.Lock()
+_handler_path = None
+_explaining = ContextVar('explaining_slow_query', default=False)
+_plans = {}
+_own_files = {os.path.abspath(__file__), os.path.abspath(metrics.__file__)}
+
+
+def normalize(sql):
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    sql = VALUES_RE.sub('VALUES (...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def redact(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return f'<{type(value).__name__}:{len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def redact_params(params, many):
+    if params is None:
+        return None
+    if many:
+        params = list(params)
+        return {'rows': len(params), 'first': redact_params(params[0], False) if params else None}
+    if isinstance(params, dict):
+        return {name: redact(value) for name, value in params.items()}
+    return [redact(value) for value in params]
+
+
+def call_site(frame=None, stop_at=None):
+    """
+    The innermost template line or project frame behind the current query,
+    walking out from ``frame`` (the caller's by default); ``None`` if there
+    is none before a frame of the file ``stop_at``.
+    """
+    base = str(settings.BASE_DIR)
+    stop_at = stop_at and os.path.abspath(stop_at)
+    frame = frame or sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if frame.f_code.co_name == 'render_annotated' and isinstance(node, Node) and node.origin:
+            return f'{node.origin.template_name or node.origin.name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if stop_at and os.path.abspath(filename) == stop_at:
+            return None
+        if (filename.startswith(base) and 'site-packages' not in filename
+                and os.path.abspath(filename) not in _own_files):
+            return f'{os.path.relpath(filename, base)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return None
+
+
+def explain(connection, sql, params, many):
+    """Plan lines for ``sql``, cached per fingerprint; ``None`` when it cannot be explained."""
+    if not sql.lstrip().lower().startswith(EXPLAINED):
+        return None
+    key = (connection.alias, fingerprint(normalize(sql)))
+    if key in _plans:
+        return _plans[key]
+    if many:
+        params = next(iter(params), None)
+    token = _explaining.set(True)
+    try:
+        # A bare backend cursor: the explain is not itself timed or counted
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            plan = [str(row[-1]) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception as error:
+        plan = [f'EXPLAIN failed: {error}']
+    finally:
+        _explaining.reset(token)
+    if len(_plans) >= PLAN_CACHE_SIZE:
+        _plans.clear()
+    _plans[key] = plan
+    return plan
+
+
+def _ensure_handler():
+    global _handler_path
+    path = str(settings.SLOW_QUERY_LOG)
+    if path == _handler_path:
+        return
+    with _handler_lock:
+        if path == _handler_path:
+            return
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = WatchedFileHandler(path, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _handler_path = path
+
+
+def record(connection, sql, params, many, duration_ms, error=None):
+    normalized = normalize(sql)
+    entry = {
+        'time': timezone.now().isoformat(),
+        'duration_ms': round(duration_ms, 3),
+        'fingerprint': fingerprint(normalized),
+        'sql': normalized,
+        'params': redact_params(params, many),
+        'many': many,
+        'alias': connection.alias,
+        'view': metrics.current_view(),
+        'site': call_site(),
+        'error': type(error).__name__ if error is not None else None,
+        # A failed statement may have left the transaction unusable
+        'plan': explain(connection, sql, params, many) if error is None else None,
+    }
+    _ensure_handler()
+    logger.info(json.dumps(entry, default=str))
+
+
+def watch(execute, sql, params, many, context):
+    threshold = settings.SLOW_QUERY_THRESHOLD_MS
+    if threshold is None or _explaining.get():
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    error = None
+    try:
+        return execute(sql, params, many, context)
+    except Exception as raised:
+        error = raised
+        raise
+    finally:
+        duration_ms = (perf_counter() - started) * 1000
+        if duration_ms >= threshold:
+            try:
+                record(context['connection'], sql, params, many, duration_ms, error)
+            except Exception:
+                errors.exception('Could not write a slow-query log entry')
+
+
+def install(connection):
+    """Wrap every statement run on ``connection``; safe to call again."""
+    if watch not in connection.execute_wrappers:
+        # Outermost, and below any execute_wrapper() context pushed later
+        connection.execute_wrappers.insert(0, watch)
+
+
+def log_files(path=None):
+    """The log and its uncompressed rotated copies (``<log>.1``, ...), oldest first."""
+    path = str(path or settings.SLOW_QUERY_LOG)
+    directory, name = os.path.split(path)
+    backups = []
+    if os.path.isdir(directory):
+        for entry in os.listdir(directory):
+            suffix = entry[len(name) + 1:]
+            if entry.startswith(f'{name}.') and suffix.isdigit():
+                backups.append((int(suffix), os.path.join(directory, entry)))
+    return [backup for _, backup in sorted(backups, reverse=True)] + ([path] if os.path.exists(path) else [])
+
+
+def read_entries(paths):
+    for path in paths:
+        with open(path, encoding='utf-8') as source:
+            for line in source:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def rank(entries, view=None, since=None):
+    """
+    One summary per fingerprint (count, total/mean/max ms, views, sites and
+    the latest plan), by cumulative time, highest first.
+    """
+    summaries = {}
+    for entry in entries:
+        if view is not None and entry.get('view') != view:
+            continue
+        if since is not None and datetime.fromisoformat(entry['time']) < since:
+            continue
+        summary = summaries.get(entry['fingerprint'])
+        if summary is None:
+            summary = summaries[entry['fingerprint']] = {
+                'fingerprint': entry['fingerprint'], 'sql': entry['sql'], 'count': 0,
+                'total_ms': 0.0, 'max_ms': 0.0, 'views': Counter(), 'sites': Counter(), 'plan': None,
+            }
+        summary['count'] += 1
+        summary['total_ms'] += entry['duration_ms']
+        summary['max_ms'] = max(summary['max_ms'], entry['duration_ms'])
+        summary['views'][entry.get('view') or '-'] += 1
+        summary['sites'][entry.get('site') or '-'] += 1
+        summary['plan'] = entry.get('plan') or summary['plan']
+    for summary in summaries.values():
+        summary['mean_ms'] = summary['total_ms'] / summary['count']
+    return sorted(summaries.values(), key=lambda summary: summary['total_ms'], reverse=True)
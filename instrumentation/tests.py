@@ -0,0 +1,270 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from wsgiref.util import FileWrapper, setup_testing_defaults
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.template import Context, Template
+from django.test import TestCase
+from django.urls import reverse
+
+from accounts.models import UserProfile, PATIENT, DOCTOR, ADMIN
+from medical_records.models import MedicalRecord
+from medical_records.tests import build_history, create_user
+from . import metrics, profiling, slowlog
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.admin = create_user('admin', ADMIN)
+        build_history(cls.patient, cls.doctor, 3)
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_records_each_request_by_view(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('medical_record_list'))
+        series = metrics.registry.collect()[('medical_record_list', 'GET')]
+        self.assertEqual(series.statuses, {200: 1})
+        self.assertEqual(sum(series.latency), 1)
+        self.assertGreater(series.queries, 0)
+        self.assertGreater(series.db_seconds, 0)
+        self.assertGreater(series.template_seconds, 0)
+        self.assertEqual(series.bytes, len(response.content))
+
+    def test_counts_streamed_bytes_as_they_are_sent(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('medical_record_export'))
+        body = b''.join(response.streaming_content)
+        series = metrics.registry.collect()[('medical_record_export', 'GET')]
+        self.assertEqual(series.bytes, len(body))
+
+    def test_endpoint_is_for_admins_and_the_scrape_token(self):
+        self.client.get('/no-such-page/')
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertRegex(text, r'http_requests_total\{view="<unmatched>",method="GET",pid="\d+",status="404"\} 1')
+
+        self.client.logout()
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_without_a_profile_is_refused(self):
+        self.client.force_login(User.objects.create_superuser('root', password='password'))
+        UserProfile.objects.filter(user__username='root').delete()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    def test_shards_of_exited_threads_are_folded(self):
+        def record():
+            metrics.registry.observe('view', 'GET', 200, 0.01, metrics.RequestStats(), 10)
+
+        threads = [threading.Thread(target=record) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+
+        def shards_of_threads():
+            return [shard for thread, shard in metrics.registry._shards if thread in threads]
+
+        self.assertEqual(len(shards_of_threads()), 3)
+        series = metrics.registry.collect()[('view', 'GET')]
+        self.assertEqual((series.statuses, series.bytes), ({200: 3}, 30))
+        self.assertEqual(shards_of_threads(), [])
+        # Counters never go backwards
+        series = metrics.registry.collect()[('view', 'GET')]
+        self.assertEqual((series.statuses, series.bytes), ({200: 3}, 30))
+
+
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor,
+            diagnosis='Atrial fibrillation', description='Irregular heartbeat',
+        )
+
+    def setUp(self):
+        logs = tempfile.TemporaryDirectory()
+        self.addCleanup(logs.cleanup)
+        self.path = os.path.join(logs.name, 'slow.jsonl')
+        settings = self.settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def entries(self):
+        with open(self.path, encoding='utf-8') as source:
+            return [json.loads(line) for line in source]
+
+    def test_fingerprint_folds_literals_and_lists(self):
+        self.assertEqual(
+            slowlog.normalize("SELECT a FROM t WHERE id IN (%s, %s, %s) AND b = 'x'  AND c > 12 LIMIT 21"),
+            'SELECT a FROM t WHERE id IN (...) AND b = ? AND c > ? LIMIT ?',
+        )
+        self.assertEqual(
+            slowlog.fingerprint(slowlog.normalize('SELECT a FROM t WHERE id IN (%s)')),
+            slowlog.fingerprint(slowlog.normalize('SELECT a FROM t WHERE id IN (%s, %s)')),
+        )
+
+    def test_logs_view_site_plan_and_redacted_parameters(self):
+        self.client.force_login(self.doctor)
+        self.client.post(reverse('medical_record_update', args=[self.record.pk]), {
+            'patient': self.patient.pk, 'diagnosis': 'Atrial flutter', 'description': 'Rate controlled',
+        })
+
+        entries = [entry for entry in self.entries() if entry['view'] == 'medical_record_update']
+        update = next(entry for entry in entries if entry['sql'].startswith('UPDATE "medical_records_medicalrecord"'))
+        self.assertIn('<str:14>', update['params'])
+        self.assertTrue(update['plan'])
+        self.assertTrue(any(entry['site'] for entry in entries))
+        with open(self.path, encoding='utf-8') as source:
+            text = source.read()
+        self.assertNotIn('Atrial', text)
+        self.assertNotIn('Rate controlled', text)
+
+    def test_reopens_the_log_after_external_rotation(self):
+        MedicalRecord.objects.count()
+        os.rename(self.path, f'{self.path}.1')
+        MedicalRecord.objects.count()
+
+        self.assertTrue(self.entries())
+        self.assertEqual(slowlog.log_files(self.path), [f'{self.path}.1', self.path])
+        self.assertEqual(list(slowlog.read_entries(slowlog.log_files(self.path)))[0]['sql'],
+                         'SELECT COUNT(*) AS "__count" FROM "medical_records_medicalrecord"')
+
+    def test_command_ranks_by_cumulative_time(self):
+        with open(self.path, 'w', encoding='utf-8') as out:
+            for sql, duration in [('SELECT 1', 300), ('SELECT 2', 100), ('SELECT 2', 250), ('SELECT 3', 50)]:
+                out.write(json.dumps({
+                    'time': '2026-10-18T10:00:00+00:00', 'duration_ms': duration, 'sql': sql,
+                    'fingerprint': slowlog.fingerprint(sql), 'view': 'search', 'site': None, 'plan': None,
+                }) + '\n')
+        ranked = slowlog.rank(slowlog.read_entries([self.path]))
+        self.assertEqual([(s['sql'], s['count'], s['total_ms']) for s in ranked],
+                         [('SELECT 2', 2, 350), ('SELECT 1', 1, 300), ('SELECT 3', 1, 50)])
+
+        out = io.StringIO()
+        call_command('slow_queries', self.path, '--limit', '1', stdout=out)
+        self.assertIn('SELECT 2', out.getvalue())
+        self.assertNotIn('SELECT 1', out.getvalue())
+
+
+def _spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles.cleanup)
+        self.directory = profiles.name
+        settings = self.settings(
+            PROFILE_REQUESTS=True, PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0,
+            PROFILE_URL_NAMES=['medical_record_list'], PROFILE_TOKEN='profile-secret',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def call(self, application, path, **headers):
+        environ = {'PATH_INFO': path, **headers}
+        setup_testing_defaults(environ)
+        response = application(environ, lambda status, headers: None)
+        body = b''.join(response)
+        if hasattr(response, 'close'):
+            response.close()
+        return body
+
+    def test_profiles_selected_requests_per_url_name(self):
+        def application(environ, start_response):
+            _spin(0.05)
+            start_response('200 OK', [])
+            return [b'ok']
+
+        profiled = profiling.profiled_wsgi(application)
+        self.assertEqual(self.call(profiled, reverse('medical_record_list')), b'ok')
+        self.call(profiled, reverse('search'))
+        files = profiling.profile_files()
+        self.assertEqual(list(files), ['medical_record_list'])
+        stacks = profiling.merge(files['medical_record_list'])
+        self.assertTrue(any(stack.rpartition(';')[2].startswith('_spin (') for stack in stacks))
+
+    def test_file_wrapper_responses_are_passed_through(self):
+        def application(environ, start_response):
+            _spin(0.05)
+            start_response('200 OK', [])
+            return environ['wsgi.file_wrapper'](io.BytesIO(b'file'))
+
+        profiled = profiling.profiled_wsgi(application)
+        environ = {'PATH_INFO': reverse('medical_record_list'), 'wsgi.file_wrapper': FileWrapper}
+        setup_testing_defaults(environ)
+        response = profiled(environ, lambda status, headers: None)
+        self.assertIsInstance(response, FileWrapper)
+        self.assertEqual(b''.join(response), b'file')
+        self.assertEqual(len(profiling.profile_files()['medical_record_list']), 1)
+
+    def test_threads_leave_at_request_finished(self):
+        profile, token = profiling.begin(reverse('search'))
+        # As the test client does, so the test transaction stays open
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+        try:
+            request_started.send(sender=self.__class__)
+            self.assertIn(threading.get_ident(), profile.threads)
+            request_finished.send(sender=self.__class__)
+            self.assertNotIn(threading.get_ident(), profile.threads)
+        finally:
+            profiling._current.reset(token)
+            profiling.finish(profile)
+
+    def test_selection(self):
+        self.assertTrue(profiling.selected(reverse('medical_record_list'), None))
+        self.assertTrue(profiling.selected(reverse('search'), 'profile-secret'))
+        self.assertFalse(profiling.selected(reverse('search'), 'wrong'))
+        with self.settings(PROFILE_SAMPLE_RATE=3):
+            self.assertEqual(sum(profiling.selected(reverse('search'), None) for _ in range(6)), 2)
+        with self.settings(PROFILE_REQUESTS=False):
+            application = object()
+            self.assertIs(profiling.profiled_wsgi(application), application)
+
+    def test_frames_rendering_a_template_are_named(self):
+        stacks = []
+        Template('{{ probe }}').render(Context({'probe': lambda: stacks.append(profiling.collapse(sys._getframe()))}))
+        self.assertIn(';template <unknown source>;', stacks[0])
+
+    def test_merge_command_writes_collapsed_stacks(self):
+        for view, lines in [('search', ['a;b 2', 'a;c 1']), ('medical_record_list', ['a;b 3'])]:
+            os.makedirs(os.path.join(self.directory, view))
+            with open(os.path.join(self.directory, view, 'one.folded'), 'w', encoding='utf-8') as out:
+                out.write('\n'.join(lines) + '\n')
+
+        output = os.path.join(self.directory, 'merged.folded')
+        call_command('merge_profiles', '--output', output, stderr=io.StringIO())
+        with open(output, encoding='utf-8') as source:
+            self.assertEqual(source.read(), 'a;b 5\na;c 1\n')
+
+        out = io.StringIO()
+        call_command('merge_profiles', 'search', '--separate', stdout=out, stderr=io.StringIO())
+        self.assertEqual(out.getvalue(), 'search;a;b 2\nsearch;a;c 1\n')
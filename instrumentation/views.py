@@ -0,0 +1,13 @@
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import metrics as request_metrics
+
+
+def metrics(request):
+    # Answers 403 rather than redirecting to the login page: the caller is
+    # usually a scraper
+    if not request_metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    response = HttpResponse(request_metrics.render(), content_type=request_metrics.CONTENT_TYPE)
+    response['Cache-Control'] = 'no-store'
+    return response
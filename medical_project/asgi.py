@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medical_project.settings')
 
 application = get_asgi_application()
+
+# Imported once Django is set up; returns the application as is unless
+# PROFILE_REQUESTS is on
+from instrumentation.profiling import profiled_asgi  # noqa: E402
+
+application = profiled_asgi(application)
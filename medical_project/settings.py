@@ -47,9 +47,12 @@ INSTALLED_APPS = [
     'medical_records',
     'appointments',
     'prescriptions',
+    'instrumentation',
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'instrumentation.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +66,8 @@ ROOT_URLCONF = 'medical_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timed for MetricsMiddleware
+        'BACKEND': 'instrumentation.metrics.InstrumentedTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -90,6 +94,46 @@ DATABASES = {
     }
 }
 
+# Production SQLite profile (DJANGO_DB_PROFILE=production): WAL so readers
+# never block on the writer, IMMEDIATE transactions so writers queue on the
+# busy timeout instead of failing with "database is locked" mid-transaction,
+# and persistent connections so the pragmas are paid once per connection.
+# The busy timeout is the connection's 'timeout' option; a busy_timeout
+# pragma here would silently override it.
+# Run `manage.py sqlite_maintenance` periodically alongside it.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # KiB, i.e. ~64 MB per connection
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+if os.environ.get('DJANGO_DB_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ''.join(
+                f'PRAGMA {name}={value};' for name, value in SQLITE_PRAGMAS.items()
+            ),
+        },
+    })
+
+# Process-local by default. With several worker processes set CACHE_BACKEND
+# (and CACHE_LOCATION) to a shared backend such as memcached or Redis, so an
+# invalidation in one (catalog version, rosters, dashboards) reaches them
+# all; for DatabaseCache run `manage.py createcachetable` when deploying.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,6 +177,51 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# How report files are sent once access has been checked: 'django' streams
+# them with Range support, 'x-accel-redirect' (nginx) or 'x-sendfile'
+# (Apache/lighttpd) hand the transfer to the front-end server
+REPORT_FILE_DELIVERY = os.environ.get('REPORT_FILE_DELIVERY', 'django')
+# nginx `internal` location aliased to MEDIA_ROOT, used with x-accel-redirect
+REPORT_FILE_ACCEL_PREFIX = '/protected-media/'
+
+# Chunked report uploads: partial files are kept here until complete (must be
+# on the same filesystem as MEDIA_ROOT so finished files can be moved in)
+REPORT_UPLOAD_TEMP_DIR = MEDIA_ROOT / 'partial_uploads'
+REPORT_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+REPORT_UPLOAD_CHUNK_MAX_SIZE = 16 * 1024 ** 2
+
+# Processes used to render avatar and report image derivatives
+DERIVATIVE_WORKERS = 2
+
+# Appointment slots: weekday (0 = Monday) -> working spans, and slot length.
+# APPOINTMENT_DOCTOR_SCHEDULES maps a doctor's user id to its own
+# {'hours': ..., 'slot_minutes': ...} overrides.
+APPOINTMENT_WORKING_HOURS = {weekday: [('09:00', '13:00'), ('14:00', '17:00')] for weekday in range(5)}
+APPOINTMENT_SLOT_MINUTES = 30
+APPOINTMENT_DOCTOR_SCHEDULES = {}
+
+# Bearer token that lets a Prometheus scraper read /metrics without an
+# admin session (unset: admins only)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Off unless SLOW_QUERY_THRESHOLD_MS is set; then statements at least that
+# slow are logged with their plan (see instrumentation.slowlog), 0 logs every
+# statement. Every worker appends to SLOW_QUERY_LOG; rotate it with logrotate.
+SLOW_QUERY_THRESHOLD_MS = os.environ.get('SLOW_QUERY_THRESHOLD_MS')
+SLOW_QUERY_THRESHOLD_MS = float(SLOW_QUERY_THRESHOLD_MS) if SLOW_QUERY_THRESHOLD_MS else None
+SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', BASE_DIR / 'logs' / 'slow_queries.jsonl')
+
+# Sampling profiler for production requests (see instrumentation.profiling).
+# Off unless PROFILE_REQUESTS=1; then 1 in PROFILE_SAMPLE_RATE requests, the
+# URL names in PROFILE_URL_NAMES and requests sending PROFILE_TOKEN in an
+# X-Profile-Token header are profiled.
+PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS') == '1'
+PROFILE_SAMPLE_RATE = int(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_URL_NAMES = [name for name in os.environ.get('PROFILE_URL_NAMES', '').split(',') if name]
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_INTERVAL_MS = 5
+PROFILE_DIR = BASE_DIR / 'logs' / 'profiles'
+
 # Authentication settings
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
@@ -19,7 +19,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
-from accounts import views as accounts_views
+from accounts import directory as accounts_directory, views as accounts_views
+from appointments import api as appointments_api
+from instrumentation import views as instrumentation_views
+from medical_records import api as medical_records_api
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -35,12 +38,23 @@ urlpatterns = [
     path('patient-dashboard/', accounts_views.patient_dashboard, name='patient_dashboard'),
     path('doctor-dashboard/', accounts_views.doctor_dashboard, name='doctor_dashboard'),
     path('admin-dashboard/', accounts_views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/users/', accounts_directory.user_directory, name='user_directory'),
     path('profile/', accounts_views.profile, name='profile'),
     
     # App URLs
     path('medical-records/', include('medical_records.urls')),
+    path('appointments/api/slots/', appointments_api.free_slots, name='appointment_free_slots'),
+    path('appointments/api/book/', appointments_api.book, name='appointment_book'),
+    path('appointments/api/doctors/', appointments_api.doctors, name='appointment_doctors'),
     path('appointments/', include('appointments.urls')),
     path('prescriptions/', include('prescriptions.urls')),
+    
+    # Read-only JSON API for the mobile app
+    path('api/v1/<slug:resource>/', medical_records_api.resource_list, name='api_resource_list'),
+    path('api/v1/<slug:resource>/<int:pk>/', medical_records_api.resource_detail, name='api_resource_detail'),
+
+    # Prometheus scrape target (admins or METRICS_TOKEN)
+    path('metrics', instrumentation_views.metrics, name='metrics'),
 ]
 
 # Serve media files in development
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medical_project.settings')
 
 application = get_wsgi_application()
+
+# Imported once Django is set up; returns the application as is unless
+# PROFILE_REQUESTS is on
+from instrumentation.profiling import profiled_wsgi  # noqa: E402
+
+application = profiled_wsgi(application)
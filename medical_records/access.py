@@ -0,0 +1,48 @@
+"""
+Role-scoped querysets.
+
+Views ask for the rows a user may see and fetch the object through that
+queryset, so a row that is missing and a row that belongs to someone else
+both end in a 404, and the permission test is part of the same query that
+loads the object and its related rows.
+"""
+from django.shortcuts import get_object_or_404
+
+from .models import MedicalRecord, MedicalReport
+
+
+def visible_to(user, queryset, patient_field='patient', doctor_field='doctor'):
+    """
+    Narrow ``queryset`` to what ``user`` may see: patients their own rows,
+    doctors the rows they are responsible for, admins everything.
+    """
+    profile = user.profile
+    if profile.is_admin():
+        return queryset
+    if profile.is_patient():
+        return queryset.filter(**{patient_field: user})
+    if profile.is_doctor():
+        return queryset.filter(**{doctor_field: user})
+    return queryset.none()
+
+
+def records_for(user):
+    return visible_to(user, MedicalRecord.objects.all())
+
+
+def reports_for(user):
+    return visible_to(
+        user,
+        MedicalReport.objects.all(),
+        patient_field='medical_record__patient',
+        doctor_field='medical_record__doctor',
+    )
+
+
+def get_record_or_404(user, record_id, prefetch=()):
+    records = records_for(user).select_related('patient', 'doctor').prefetch_related(*prefetch)
+    return get_object_or_404(records, id=record_id)
+
+
+def get_report_or_404(user, report_id, *related):
+    return get_object_or_404(reports_for(user).select_related(*related), id=report_id)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import MedicalRecord, MedicalReport
+from .models import MedicalRecord, MedicalReport, ReportBlob
 
 class MedicalReportInline(admin.TabularInline):
     model = MedicalReport
@@ -17,3 +17,9 @@ class MedicalReportAdmin(admin.ModelAdmin):
     list_display = ('title', 'medical_record', 'report_type', 'date', 'uploaded_by', 'date_uploaded')
     list_filter = ('report_type', 'date', 'date_uploaded')
     search_fields = ('title', 'medical_record__patient__username', 'report_type')
+
+@admin.register(ReportBlob)
+class ReportBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'content_type', 'size', 'ref_count', 'date_created')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'content_type', 'ref_count')
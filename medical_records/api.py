@@ -0,0 +1,159 @@
+"""
+Read-only JSON API (v1) for the mobile app.
+
+``/api/v1/<resource>/`` lists and ``/api/v1/<resource>/<id>/`` shows
+records, report metadata, prescriptions, reminders and appointments,
+scoped with the same rules as the HTML pages. ``?fields=`` picks the
+fields to return (``id`` is always included) and lists are keyset-paginated
+on the primary key, newest first.
+
+Every row carries ``date_updated``, so validators come from the same query
+that fetches the row: a detail's ETag is built from its id and update time
+and a list's from the ids and update times on the page. A poll whose
+``If-None-Match`` (or ``If-Modified-Since``) still matches gets a 304 before
+anything is serialized.
+"""
+import hashlib
+from collections import namedtuple
+
+from django.apps import apps
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+
+from .access import visible_to
+from .pagination import get_page_size, keyset_paginate
+
+API_VERSION = 1
+
+# fields: output name -> lookup
+Resource = namedtuple('Resource', 'model patient_field doctor_field fields')
+
+
+def _fields(*names, **renamed):
+    return {**{name: name for name in names}, **renamed}
+
+
+RESOURCES = {
+    'records': Resource('medical_records.MedicalRecord', 'patient', 'doctor', _fields(
+        'id', 'diagnosis', 'description', 'date_created', 'date_updated',
+        patient='patient_id', doctor='doctor_id',
+    )),
+    'reports': Resource('medical_records.MedicalReport', 'medical_record__patient', 'medical_record__doctor', _fields(
+        'id', 'title', 'report_type', 'date', 'notes', 'file_size', 'sha256', 'content_type',
+        'date_uploaded', 'date_updated',
+        medical_record='medical_record_id', uploaded_by='uploaded_by_id', filename='original_filename',
+    )),
+    'prescriptions': Resource('prescriptions.Prescription', 'patient', 'doctor', _fields(
+        'id', 'medication_name', 'dosage', 'frequency', 'custom_frequency', 'instructions',
+        'start_date', 'end_date', 'is_active', 'date_prescribed', 'date_created', 'date_updated',
+        medical_record='medical_record_id', patient='patient_id', doctor='doctor_id',
+    )),
+    'reminders': Resource('prescriptions.MedicationReminder', 'prescription__patient', 'prescription__doctor', _fields(
+        'id', 'reminder_time', 'time_zone', 'is_active', 'next_fire_at', 'date_updated',
+        prescription='prescription_id',
+    )),
+    'appointments': Resource('appointments.Appointment', 'patient', 'doctor', _fields(
+        'id', 'specialization', 'appointment_date', 'appointment_time', 'reason', 'status', 'notes',
+        'date_created', 'date_updated',
+        patient='patient_id', doctor='doctor_id',
+    )),
+}
+
+
+def _resource(name):
+    try:
+        return RESOURCES[name]
+    except KeyError:
+        raise Http404('Unknown resource.')
+
+
+def selected_fields(resource, value):
+    """Output names requested by ``?fields=a,b`` (all when empty), ``id`` first."""
+    if not value:
+        return list(resource.fields)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}.')
+    return ['id', *dict.fromkeys(name for name in names if name != 'id')]
+
+
+def _rows(user, resource, names):
+    queryset = apps.get_model(resource.model)._default_manager.all()
+    queryset = visible_to(user, queryset, resource.patient_field, resource.doctor_field)
+    # date_updated is always read: the validators are built from it
+    lookups = dict.fromkeys([*(resource.fields[name] for name in names), 'date_updated'])
+    return queryset.values(*lookups)
+
+
+def _output(resource, names, row):
+    return {name: row[resource.fields[name]] for name in names}
+
+
+def _digest(*parts):
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:20]
+
+
+def _finish(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Private data: the app may keep it but must revalidate every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@login_required
+@require_GET
+def resource_list(request, resource):
+    name = resource
+    resource = _resource(name)
+    try:
+        names = selected_fields(resource, request.GET.get('fields'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    page = keyset_paginate(
+        _rows(request.user, resource, names), request.GET.get('cursor'),
+        get_page_size(request), fields=('id',),
+    )
+    etag = '"v%d-%s-%s"' % (API_VERSION, name, _digest(
+        ','.join(names), page.next_cursor, page.previous_cursor,
+        *(f'{row["id"]}:{row["date_updated"].isoformat()}' for row in page),
+    ))
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse({
+            'version': API_VERSION,
+            'results': [_output(resource, names, row) for row in page],
+            'next': page.next_cursor,
+            'previous': page.previous_cursor,
+        })
+    return _finish(response, etag)
+
+
+@login_required
+@require_GET
+def resource_detail(request, resource, pk):
+    name = resource
+    resource = _resource(name)
+    try:
+        names = selected_fields(resource, request.GET.get('fields'))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    row = _rows(request.user, resource, names).filter(pk=pk).first()
+    if row is None:
+        raise Http404('Not found.')
+    updated = row['date_updated']
+    etag = '"v%d-%s-%d-%s"' % (API_VERSION, name, pk, _digest(','.join(names), updated.isoformat()))
+    last_modified = int(updated.timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({'version': API_VERSION, **_output(resource, names, row)})
+    return _finish(response, etag, last_modified)
@@ -0,0 +1,243 @@
+"""
+In-process load benchmark.
+
+Every GET route in the URL configuration is filled in with ids from the
+current database (see ``synthetic.generate``) and driven through the test
+client as a patient, a doctor and an admin, from several threads at once.
+Each case reports latency percentiles, requests per second, queries per
+request and the status codes seen; results can be saved as JSON and
+compared with an earlier run.
+
+Nothing is mocked: requests go through the middleware, views, templates
+and the configured database, so run it against a copy of a realistic data
+set rather than the production database (it creates sessions).
+"""
+import json
+import logging
+import math
+import re
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver
+
+from accounts.models import ADMIN, DOCTOR, PATIENT
+
+ROLES = (PATIENT, DOCTOR, ADMIN)
+# Routes that change state or need a request body
+SKIPPED_ROUTES = {
+    'logout', 'report_upload_start', 'report_upload_chunk', 'appointment_book',
+}
+SKIPPED_NAMESPACES = {'admin'}
+# Query strings for routes that answer 400 without one
+QUERY_PARAMETERS = {
+    'appointment_free_slots': lambda samples: {'doctor': samples['doctor']},
+    'appointment_doctors': lambda samples: {'specialization': samples['specialization']},
+    'search': lambda samples: {'q': samples['query']},
+}
+REGRESSION_TOLERANCE = 0.2
+PARAMETER_RE = re.compile(r'<(?:\w+:)?(\w+)>')
+
+Case = namedtuple('Case', 'name path')
+Result = namedtuple('Result', 'case role requests p50 p95 p99 rps queries statuses')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of already sorted ``values``."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def _routes(resolver, prefix=''):
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in SKIPPED_NAMESPACES:
+                continue
+            yield from _routes(pattern, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield pattern.name, prefix + str(pattern.pattern), pattern.pattern.converters
+
+
+def sample_ids():
+    """
+    Ids to fill route parameters with: one patient's record and everything
+    hanging off it, and that record's doctor. ``None`` if there is no data.
+    """
+    from appointments.models import Appointment
+    from prescriptions.models import MedicationReminder, Prescription
+    from .models import MedicalReport
+
+    report = MedicalReport.objects.select_related('medical_record').filter(
+        medical_record__doctor__isnull=False,
+    ).order_by('pk').first()
+    if report is None:
+        return None
+    record = report.medical_record
+    prescription = Prescription.objects.filter(medical_record=record).order_by('pk').first()
+    reminder = MedicationReminder.objects.filter(prescription=prescription).order_by('pk').first()
+    appointment = Appointment.objects.filter(patient_id=record.patient_id).order_by('pk').first()
+    admin = User.objects.filter(profile__role=ADMIN).order_by('pk').first()
+    specialization = User.objects.filter(pk=record.doctor_id).values_list(
+        'doctor_profile__specialization', flat=True).first()
+    return {
+        'users': {PATIENT: record.patient_id, DOCTOR: record.doctor_id, ADMIN: admin and admin.pk},
+        'record_id': record.pk,
+        'report_id': report.pk,
+        'patient_id': record.patient_id,
+        'prescription_id': prescription and prescription.pk,
+        'reminder_id': reminder and reminder.pk,
+        'appointment_id': appointment and appointment.pk,
+        'doctor': record.doctor_id,
+        'specialization': specialization or '',
+        # Any word the record's report is indexed under
+        'query': next(iter(record.diagnosis.split() or report.title.split()), 'report'),
+        'resource_ids': {
+            'records': record.pk,
+            'reports': report.pk,
+            'prescriptions': prescription and prescription.pk,
+            'reminders': reminder and reminder.pk,
+            'appointments': appointment and appointment.pk,
+        },
+    }
+
+
+def _fill(route, values):
+    """``route`` with its parameters filled in, or ``None`` if one has no value."""
+    if any(values.get(name) is None for name in PARAMETER_RE.findall(route)):
+        return None
+    return '/' + PARAMETER_RE.sub(lambda match: str(values[match.group(1)]), route)
+
+
+def discover_cases(samples, names=None):
+    """Every GET route filled in from ``samples``, as ``Case`` (name, path with query)."""
+    from .api import RESOURCES
+
+    cases = []
+    for name, route, converters in _routes(get_resolver()):
+        if name in SKIPPED_ROUTES or (names and name not in names):
+            continue
+        # A bare ``pk`` is the id of what the route is named after
+        # (``appointment_update`` -> ``appointment_id``)
+        variants = [({'pk': samples.get(f'{name.split("_")[0]}_id')}, name)]
+        if 'resource' in converters:
+            variants = [
+                ({'resource': resource, 'pk': samples['resource_ids'][resource]}, f'{name}[{resource}]')
+                for resource in RESOURCES
+            ]
+        for extra, label in variants:
+            path = _fill(route, {**samples, **extra})
+            if path is None:
+                continue
+            if name in QUERY_PARAMETERS:
+                path += '?' + urlencode(QUERY_PARAMETERS[name](samples))
+            cases.append(Case(label, path))
+    return cases
+
+
+def _host():
+    hosts = [host.lstrip('.') for host in settings.ALLOWED_HOSTS if host not in ('*', '')]
+    return hosts[0] if hosts else 'localhost'
+
+
+def _worker(path, user, count):
+    """Run ``count`` requests on this thread; returns ``[(seconds, queries, status), ...]``."""
+    client = Client(HTTP_HOST=_host(), raise_request_exception=False)
+    if user is not None:
+        client.force_login(user)
+    timings = []
+    for _ in range(count):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            response.close()
+            elapsed = time.perf_counter() - started
+        timings.append((elapsed, len(queries), response.status_code))
+    return timings
+
+
+def _thread_worker(path, user, count):
+    try:
+        return _worker(path, user, count)
+    finally:
+        # Each pool thread opened its own connections
+        connections.close_all()
+
+
+def run_case(case, role, user, requests=50, concurrency=4, warmup=2):
+    """Drive one case and summarise it as a ``Result``."""
+    if warmup:
+        _worker(case.path, user, warmup)
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    if concurrency == 1:
+        timings = _worker(case.path, user, requests)
+    else:
+        with ThreadPoolExecutor(concurrency) as pool:
+            timings = [t for batch in pool.map(lambda n: _thread_worker(case.path, user, n), shares) for t in batch]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _, _ in timings)
+    return Result(
+        case=case.name, role=role, requests=len(timings),
+        p50=percentile(latencies, 0.50), p95=percentile(latencies, 0.95), p99=percentile(latencies, 0.99),
+        rps=len(timings) / wall if wall else 0.0,
+        queries=sum(queries for _, queries, _ in timings) / len(timings) if timings else 0.0,
+        statuses=dict(Counter(status for _, _, status in timings)),
+    )
+
+
+def run(cases, samples, roles=ROLES, **options):
+    users = User.objects.in_bulk([pk for pk in samples['users'].values() if pk])
+    # Expected 403s and 404s (a patient opening a doctor-only page) would
+    # otherwise log a warning per request
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for case in cases:
+            for role in roles:
+                user = users.get(samples['users'].get(role))
+                if user is None:
+                    continue
+                yield run_case(case, role, user, **options)
+    finally:
+        request_logger.setLevel(level)
+
+
+def result_key(result):
+    return f'{result.role} {result.case}'
+
+
+def save(results, path):
+    with open(path, 'w', encoding='utf-8') as out:
+        json.dump({result_key(result): result._asdict() for result in results}, out, indent=2)
+
+
+def compare(results, baseline_path, tolerance=REGRESSION_TOLERANCE):
+    """
+    ``[(key, message), ...]`` for cases slower than the baseline's p95 by
+    more than ``tolerance`` or running more queries per request.
+    """
+    with open(baseline_path, encoding='utf-8') as source:
+        baseline = json.load(source)
+    regressions = []
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        if result.p95 > before['p95'] * (1 + tolerance):
+            regressions.append((result_key(result), f'p95 {before["p95"]:.1f} -> {result.p95:.1f} ms'))
+        if result.queries > before['queries']:
+            regressions.append((result_key(result), f'queries {before["queries"]:.1f} -> {result.queries:.1f}'))
+    return regressions
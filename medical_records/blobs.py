@@ -0,0 +1,290 @@
+"""
+Content-addressed storage for report files.
+
+Every distinct file is stored once under its SHA-256 as a ``ReportBlob``;
+``MedicalReport`` rows point at a blob and the blob keeps a reference count
+so the bytes are removed when the last report using them goes away.
+
+Large files arrive through ``ReportUpload`` sessions in chunks. The digest is
+updated as each chunk is written, so finishing an upload never re-reads the
+file; if a chunk lands on a worker that has not seen the earlier ones, the
+hash state is rebuilt from the partial file once and cached again. A chunk
+claims its upload before writing, so a retry arriving while the original
+request is still streaming cannot interleave with it.
+
+Sessions that are abandoned part-way, or finished but never attached to a
+report, are removed by ``expire_uploads`` (the ``cleanup_uploads`` command).
+"""
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ReportBlob, ReportUpload
+
+READ_SIZE = 64 * 1024
+HASHER_CACHE_SIZE = 256
+# A claim older than this belongs to a worker that died mid-chunk
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+MAGIC_NUMBERS = (
+    (0, b'%PDF', 'application/pdf'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF8', 'image/gif'),
+    (8, b'WEBP', 'image/webp'),
+    (128, b'DICM', 'application/dicom'),
+)
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadOffsetMismatch(UploadError):
+    def __init__(self, expected):
+        super().__init__(f'Expected upload offset {expected}.')
+        self.expected = expected
+
+
+# upload id -> (offset, hasher); lets consecutive chunks on one worker skip
+# re-hashing what has already been received
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def _cache_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        _hashers.move_to_end(upload_id)
+        while len(_hashers) > HASHER_CACHE_SIZE:
+            _hashers.popitem(last=False)
+
+
+def _take_hasher(upload_id, offset, path):
+    with _hashers_lock:
+        cached = _hashers.pop(upload_id, None)
+    if cached and cached[0] == offset:
+        return cached[1]
+    hasher = hashlib.sha256()
+    if offset:
+        with open(path, 'rb') as f:
+            remaining = offset
+            while remaining:
+                chunk = f.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    return hasher
+
+
+def sniff_content_type(head, filename):
+    for offset, magic, content_type in MAGIC_NUMBERS:
+        if head[offset:offset + len(magic)] == magic:
+            return content_type
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def temp_dir():
+    path = Path(getattr(settings, 'REPORT_UPLOAD_TEMP_DIR', Path(settings.MEDIA_ROOT) / 'partial_uploads'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def partial_path(upload):
+    return temp_dir() / f'{upload.pk}.part'
+
+
+def blob_name(sha256, filename):
+    ext = os.path.splitext(filename)[1].lower()[:10]
+    return f'medical_reports/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}'
+
+
+def _read_head(path):
+    with open(path, 'rb') as f:
+        return f.read(132)
+
+
+def commit_blob(path, sha256, size, filename):
+    """Move a fully written temp file into place, or drop it if already stored."""
+    existing = ReportBlob.objects.filter(sha256=sha256).first()
+    if existing:
+        os.remove(path)
+        return existing
+
+    name = blob_name(sha256, filename)
+    target = Path(settings.MEDIA_ROOT) / name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    content_type = sniff_content_type(_read_head(path), filename)
+    os.replace(path, target)
+    try:
+        with transaction.atomic():
+            return ReportBlob.objects.create(
+                sha256=sha256, file=name, size=size, content_type=content_type,
+            )
+    except IntegrityError:
+        # Another request stored the same content first. With the same
+        # extension we replaced their file with identical bytes; otherwise
+        # ours is at a path no row refers to
+        winner = ReportBlob.objects.get(sha256=sha256)
+        if winner.file.name != name:
+            target.unlink(missing_ok=True)
+        return winner
+
+
+def _claim(upload, offset):
+    """Take the right to write ``upload`` at ``offset``, or raise the offset to resume from."""
+    now = timezone.now()
+    claimed = ReportUpload.objects.filter(
+        Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - CLAIM_TIMEOUT),
+        pk=upload.pk, received=offset, blob__isnull=True,
+    ).update(claimed_at=now)
+    if not claimed:
+        # Another request got there first, or is still writing this offset
+        upload.refresh_from_db(fields=['received'])
+        raise UploadOffsetMismatch(upload.received)
+    return now
+
+
+def append_chunk(upload, stream, offset, length):
+    """
+    Append ``length`` bytes read from ``stream`` at ``offset`` of ``upload``.
+
+    Returns the new offset; completes the upload (setting ``upload.blob``)
+    once every byte has arrived.
+    """
+    if upload.is_complete:
+        raise UploadError('Upload is already complete.')
+    if offset != upload.received:
+        raise UploadOffsetMismatch(upload.received)
+    if length < 0 or offset + length > upload.size:
+        raise UploadError('Chunk runs past the declared upload size.')
+
+    claim = _claim(upload, offset)
+    claimed = ReportUpload.objects.filter(pk=upload.pk, claimed_at=claim)
+    path = partial_path(upload)
+    written = 0
+    try:
+        hasher = _take_hasher(upload.pk, offset, path)
+        with open(path, 'r+b' if path.exists() else 'wb') as f:
+            # Drop any tail left behind by an interrupted earlier attempt
+            f.truncate(offset)
+            f.seek(offset)
+            while written < length:
+                chunk = stream.read(min(READ_SIZE, length - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+    except BaseException:
+        claimed.update(claimed_at=None)
+        raise
+
+    new_offset = offset + written
+    changes = {'received': new_offset, 'claimed_at': None, 'date_updated': timezone.now()}
+    if new_offset == upload.size:
+        # Still claimed, so no other request can complete it twice
+        changes['blob'] = commit_blob(path, hasher.hexdigest(), upload.size, upload.filename)
+    else:
+        _cache_hasher(upload.pk, new_offset, hasher)
+    if not claimed.update(**changes):
+        # The claim timed out and another request took the offset over
+        upload.refresh_from_db(fields=['received'])
+        raise UploadOffsetMismatch(upload.received)
+    upload.received = new_offset
+    upload.blob = changes.get('blob')
+    return new_offset
+
+
+def ingest_file(uploaded_file):
+    """Store a regular (non-chunked) uploaded file, hashing it while copying."""
+    hasher = hashlib.sha256()
+    path = temp_dir() / f'ingest-{os.getpid()}-{threading.get_ident()}-{id(uploaded_file)}.part'
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in uploaded_file.chunks(READ_SIZE):
+            f.write(chunk)
+            hasher.update(chunk)
+            size += len(chunk)
+    return commit_blob(path, hasher.hexdigest(), size, uploaded_file.name)
+
+
+def attach(report, blob, filename):
+    """Point ``report`` at ``blob``; the reference is counted when it is saved."""
+    report.blob = blob
+    report.original_filename = os.path.basename(filename)[:255]
+    # Assign the stored name, replacing any uncommitted upload on the field
+    report.report_file = blob.file.name
+    report.file_size = blob.size
+    report.sha256 = blob.sha256
+    report.content_type = blob.content_type
+
+
+def add_reference(blob_id):
+    ReportBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') + 1)
+
+
+def _delete_file(storage, name, sha256):
+    # Unless the same content was stored again since the row was deleted
+    if not ReportBlob.objects.filter(sha256=sha256).exists():
+        storage.delete(name)
+
+
+def collect(blob_id):
+    """Delete the blob if nothing uses it; the file goes once the deletion commits."""
+    blob = ReportBlob.objects.filter(pk=blob_id, ref_count=0).first()
+    if blob and not blob.reports.exists() and not blob.uploads.exists():
+        storage, name, sha256 = blob.file.storage, blob.file.name, blob.sha256
+        blob.delete()
+        transaction.on_commit(lambda: _delete_file(storage, name, sha256))
+
+
+def release(blob_id):
+    """Drop one reference and delete the blob once nothing uses it."""
+    ReportBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    collect(blob_id)
+
+
+def expire_uploads(older_than):
+    """
+    Remove what uploads untouched since ``older_than`` left behind: sessions
+    abandoned part-way, finished sessions whose report form was never
+    submitted, stray partial files and blobs no report ever took up.
+    Returns how many of each were removed.
+    """
+    removed = {'uploads': 0, 'files': 0, 'blobs': 0}
+    for upload in ReportUpload.objects.filter(date_updated__lt=older_than).iterator():
+        path = partial_path(upload)
+        with transaction.atomic():
+            upload.delete()
+            if upload.blob_id:
+                collect(upload.blob_id)
+        path.unlink(missing_ok=True)
+        removed['uploads'] += 1
+
+    # Partial files with no session: interrupted ingests, crashed deletes
+    live = {str(pk) for pk in ReportUpload.objects.values_list('pk', flat=True)}
+    cutoff = older_than.timestamp()
+    for path in temp_dir().glob('*.part'):
+        if path.stem not in live and path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            removed['files'] += 1
+
+    orphans = ReportBlob.objects.filter(
+        ref_count=0, date_created__lt=older_than, reports__isnull=True, uploads__isnull=True,
+    ).values_list('pk', flat=True)
+    for blob_id in list(orphans):
+        with transaction.atomic():
+            collect(blob_id)
+        removed['blobs'] += 1
+    return removed
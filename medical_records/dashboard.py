@@ -0,0 +1,191 @@
+"""
+Cached per-patient dashboard snapshot.
+
+The patient dashboard shows the latest records, current prescriptions and
+upcoming appointments. Each of those sections is stored as plain data in
+one cache entry per patient, next to the version token it was built from.
+Saving or deleting one of the patient's rows replaces the token of the
+section it belongs to (after commit), so the next hit rebuilds only that
+section with a single query; a section built on an earlier day is rebuilt
+too, since "current" and "upcoming" move with the date.
+
+Every section also shows doctors' names, which live on ``User``: renaming
+a user replaces one token shared by all patients, so each snapshot is
+rebuilt on its next hit.
+
+A hit reads the snapshot and every version token in one ``get_many``.
+Upcoming reminders depend on the clock rather than on writes, so they stay
+a live query (one indexed range scan via the scheduler).
+"""
+import uuid
+
+from django.core.cache import cache
+from django.db.models import DEFERRED, Count, Window
+from django.utils import timezone
+
+SECTIONS = ('records', 'prescriptions', 'appointments')
+SECTION_SIZE = 5
+REMINDER_LIMIT = 5
+SNAPSHOT_TIMEOUT = 7 * 24 * 60 * 60
+NAMES_KEY = 'dashboard:names:version'
+
+
+def _snapshot_key(user_id):
+    return f'dashboard:patient:{user_id}'
+
+
+def _version_key(user_id, section):
+    return f'dashboard:patient:{user_id}:version:{section}'
+
+
+def _doctor_name(first_name, last_name, username):
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def _counted(queryset):
+    # The total rides along on every row, so a section costs one query
+    return queryset.annotate(total=Window(Count('id')))[:SECTION_SIZE]
+
+
+def build_records(user_id, today):
+    from .models import MedicalRecord
+
+    rows = list(_counted(
+        MedicalRecord.objects.filter(patient_id=user_id).order_by('-date_created', '-id')
+    ).values('id', 'diagnosis', 'date_created', 'total',
+             'doctor__first_name', 'doctor__last_name', 'doctor__username'))
+    return {
+        'count': rows[0]['total'] if rows else 0,
+        'items': [
+            {
+                'id': row['id'],
+                'diagnosis': row['diagnosis'],
+                'date_created': row['date_created'],
+                'doctor_name': _doctor_name(row['doctor__first_name'], row['doctor__last_name'], row['doctor__username'])
+                if row['doctor__username'] else '',
+            }
+            for row in rows
+        ],
+    }
+
+
+def build_prescriptions(user_id, today):
+    from prescriptions.models import FREQUENCY_CHOICES, Prescription
+
+    frequencies = dict(FREQUENCY_CHOICES)
+    rows = list(_counted(
+        Prescription.objects.filter(patient_id=user_id).current(today).order_by('-date_created', '-id')
+    ).values('id', 'medication_name', 'dosage', 'frequency', 'start_date', 'end_date', 'total',
+             'doctor__first_name', 'doctor__last_name', 'doctor__username'))
+    return {
+        'count': rows[0]['total'] if rows else 0,
+        'items': [
+            {
+                'id': row['id'],
+                'medication_name': row['medication_name'],
+                'dosage': row['dosage'],
+                'frequency_display': frequencies.get(row['frequency'], row['frequency']),
+                'start_date': row['start_date'],
+                'end_date': row['end_date'],
+                'doctor_name': _doctor_name(row['doctor__first_name'], row['doctor__last_name'], row['doctor__username']),
+            }
+            for row in rows
+        ],
+    }
+
+
+def build_appointments(user_id, today):
+    from appointments.models import Appointment, STATUS_CHOICES
+
+    statuses = dict(STATUS_CHOICES)
+    rows = list(_counted(
+        Appointment.objects.filter(patient_id=user_id, appointment_date__gte=today)
+        .exclude(status__in=('cancelled', 'completed'))
+        .order_by('appointment_date', 'appointment_time')
+    ).values('id', 'appointment_date', 'appointment_time', 'reason', 'status', 'total',
+             'doctor__first_name', 'doctor__last_name', 'doctor__username'))
+    return {
+        'count': rows[0]['total'] if rows else 0,
+        'items': [
+            {
+                'id': row['id'],
+                'appointment_date': row['appointment_date'],
+                'appointment_time': row['appointment_time'],
+                'reason': row['reason'],
+                'status': row['status'],
+                'status_display': statuses.get(row['status'], row['status']),
+                'doctor_name': _doctor_name(row['doctor__first_name'], row['doctor__last_name'], row['doctor__username']),
+            }
+            for row in rows
+        ],
+    }
+
+
+BUILDERS = {
+    'records': build_records,
+    'prescriptions': build_prescriptions,
+    'appointments': build_appointments,
+}
+
+
+def get_snapshot(user_id):
+    """``{section: {'count', 'items'}}`` for a patient, rebuilding stale sections."""
+    today = timezone.localdate()
+    snapshot_key = _snapshot_key(user_id)
+    version_keys = {section: _version_key(user_id, section) for section in SECTIONS}
+    cached = cache.get_many([snapshot_key, NAMES_KEY, *version_keys.values()])
+
+    stored = cached.get(snapshot_key) or {}
+    snapshot = {}
+    new_versions = {}
+    names = cached.get(NAMES_KEY)
+    if names is None:
+        names = new_versions[NAMES_KEY] = uuid.uuid4().hex
+    for section in SECTIONS:
+        version = cached.get(version_keys[section])
+        if version is None:
+            version = new_versions[version_keys[section]] = uuid.uuid4().hex
+        entry = stored.get(section)
+        if (not entry or entry['version'] != version or entry['day'] != today
+                or entry.get('names') != names):
+            entry = {'version': version, 'names': names, 'day': today, 'data': BUILDERS[section](user_id, today)}
+        snapshot[section] = entry
+
+    if new_versions:
+        cache.set_many(new_versions, None)
+    if snapshot != stored:
+        cache.set(snapshot_key, snapshot, SNAPSHOT_TIMEOUT)
+    return {section: entry['data'] for section, entry in snapshot.items()}
+
+
+def invalidate(user_id, *sections):
+    cache.set_many({_version_key(user_id, section): uuid.uuid4().hex for section in sections}, None)
+
+
+def invalidate_names():
+    """Rebuild every patient's snapshot after a user's name changed."""
+    cache.set(NAMES_KEY, uuid.uuid4().hex, None)
+
+
+def name_fields(user):
+    """``user``'s loaded name fields, compared across a save."""
+    return tuple(user.__dict__.get(field, DEFERRED) for field in ('first_name', 'last_name', 'username'))
+
+
+def patient_dashboard_context(user):
+    """
+    What ``accounts/patient_dashboard.html`` shows; the template reads it
+    through the ``patient_dashboard`` tag.
+    """
+    from prescriptions.scheduler import upcoming_reminders
+
+    snapshot = get_snapshot(user.pk)
+    return {
+        'medical_records': snapshot['records']['items'],
+        'medical_records_count': snapshot['records']['count'],
+        'prescriptions': snapshot['prescriptions']['items'],
+        'prescriptions_count': snapshot['prescriptions']['count'],
+        'appointments': snapshot['appointments']['items'],
+        'appointments_count': snapshot['appointments']['count'],
+        'upcoming_reminders': list(upcoming_reminders(patient=user)[:REMINDER_LIMIT]),
+    }
@@ -0,0 +1,177 @@
+"""
+Report file delivery.
+
+``REPORT_FILE_DELIVERY`` selects how the bytes leave the server once a view
+has decided the user may see them:
+
+* ``'django'`` (default) streams from Django, honouring ``Range`` and the
+  ``If-None-Match`` / ``If-Modified-Since`` validators.
+* ``'x-accel-redirect'`` hands the transfer to nginx; the file must be
+  reachable through an ``internal`` location mapped to
+  ``REPORT_FILE_ACCEL_PREFIX``.
+* ``'x-sendfile'`` does the same for Apache mod_xsendfile / lighttpd using
+  the file's absolute path.
+
+With either offload mode the worker is released as soon as the headers are
+built; the front-end server deals with ranges and slow clients. Rendered
+image previews (``serve_report_variant``) go out the same way.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from . import derivatives
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def file_validators(path):
+    """Return ``(etag, last_modified, size)`` for a stored file without opening it."""
+    stat = os.stat(path)
+    etag = f'"{stat.st_size:x}-{int(stat.st_mtime * 1_000_000):x}"'
+    return etag, int(stat.st_mtime), stat.st_size
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header into inclusive ``(start, end)``.
+
+    Returns ``None`` when the header should be ignored (absent, malformed or
+    multi-range) and ``False`` when it is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def _iter_range(file, start, length):
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve_report_file(request, report, as_attachment):
+    field_file = report.report_file
+    filename = report.original_filename or os.path.basename(field_file.name)
+    if report.sha256 and report.file_size is not None:
+        # Recorded at upload time; no need to touch the file system
+        etag = f'"{report.sha256}"'
+        last_modified = int(report.date_uploaded.timestamp())
+        size = report.file_size
+    else:
+        try:
+            etag, last_modified, size = file_validators(field_file.path)
+        except FileNotFoundError:
+            raise Http404('Report file is missing from storage.')
+
+    content_type = report.content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    return _send(request, field_file.storage, field_file.name, filename, content_type,
+                 (etag, last_modified, size), as_attachment)
+
+
+def serve_report_variant(request, report, preset, fmt):
+    """
+    A rendered ``preset`` of an image report; the original stands in until
+    the derivative exists (it is queued on the first request).
+    """
+    if preset not in derivatives.REPORT_PRESETS or fmt not in derivatives.FORMATS:
+        raise Http404('Unknown report variant.')
+    field_file = report.report_file
+    name = derivatives.rendered_name(field_file, preset, fmt)
+    if name is None:
+        return serve_report_file(request, report, as_attachment=False)
+    try:
+        validators = file_validators(field_file.storage.path(name))
+    except FileNotFoundError:
+        return serve_report_file(request, report, as_attachment=False)
+    stem = os.path.splitext(report.original_filename or os.path.basename(field_file.name))[0]
+    return _send(request, field_file.storage, name, f'{stem}-{preset}.{fmt}', f'image/{fmt}',
+                 validators, as_attachment=False)
+
+
+def _send(request, storage, name, filename, content_type, validators, as_attachment):
+    etag, last_modified, size = validators
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    mode = getattr(settings, 'REPORT_FILE_DELIVERY', 'django')
+
+    if mode in ('x-accel-redirect', 'x-sendfile'):
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'REPORT_FILE_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name)
+        else:
+            response['X-Sendfile'] = storage.path(name)
+    else:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is not None and not _if_range_matches(request, etag, last_modified):
+            byte_range = None
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        try:
+            file = storage.open(name, 'rb')
+        except FileNotFoundError:
+            # The validators may have come from the database alone
+            raise Http404('Report file is missing from storage.')
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                _iter_range(file, start, length),
+                status=206,
+                content_type=content_type,
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(length)
+        else:
+            response = FileResponse(file, content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Reports are private to the patient and their doctor
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,144 @@
+"""
+Resized derivatives (avatars, report thumbnails and previews) of uploaded
+images.
+
+Derivatives are rendered with Pillow in a process pool so uploads and page
+renders never wait on image decoding. Each derivative's file name carries a
+signature of the source's name, size and modification time plus the preset,
+so replacing a source file naturally points pages at a fresh derivative;
+until it has been rendered, pages fall back to the original.
+
+Only avatars are public and linked under ``MEDIA_URL``. Report derivatives
+are written next to the report files and sent by ``report_view`` with
+``?variant=<preset>&format=<webp|jpeg>``, after the same access check as the
+report itself.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+# name -> (width, height, mode); 'crop' fills the box, 'fit' stays inside it
+PRESETS = {
+    'avatar': (96, 96, 'crop'),
+    'avatar_large': (256, 256, 'crop'),
+    'thumbnail': (240, 240, 'fit'),
+    'preview': (1024, 1024, 'fit'),
+}
+PUBLIC_PRESETS = {'avatar', 'avatar_large'}
+REPORT_PRESETS = ('thumbnail', 'preview')
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+DERIVED_DIR = 'derived'
+# Under the report files, so they share their (non-public) location
+PRIVATE_DERIVED_DIR = 'medical_reports/derived'
+
+_pool = None
+_pool_lock = threading.Lock()
+# Targets queued in this process; pool callbacks discard from another thread
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'DERIVATIVE_WORKERS', 2))
+        return _pool
+
+
+def render(source_path, target_path, width, height, mode, image_format):
+    """Write one derivative; runs inside a pool worker."""
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        # Let the JPEG decoder downscale while reading instead of decoding
+        # every pixel of a multi-megapixel photo
+        image.draft('RGB', (width * 2, height * 2))
+        image = ImageOps.exif_transpose(image)
+        if mode == 'crop':
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        temp_path = f'{target_path}.{os.getpid()}.tmp'
+        image.save(temp_path, image_format, quality=80)
+        os.replace(temp_path, target_path)
+    return target_path
+
+
+def is_image(field_file):
+    return bool(field_file) and os.path.splitext(field_file.name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def derivative_name(field_file, preset, fmt='webp'):
+    """Storage name of a derivative, or ``None`` if the source is missing."""
+    try:
+        stat = os.stat(field_file.path)
+    except (OSError, ValueError):
+        return None
+    width, height, mode = PRESETS[preset]
+    signature = hashlib.sha1(
+        f'{field_file.name}:{stat.st_size}:{stat.st_mtime_ns}:{width}x{height}:{mode}'.encode()
+    ).hexdigest()[:16]
+    stem = Path(field_file.name).stem[:40]
+    directory = DERIVED_DIR if preset in PUBLIC_PRESETS else PRIVATE_DERIVED_DIR
+    return f'{directory}/{preset}/{signature[:2]}/{stem}-{signature}.{fmt}'
+
+
+def schedule(field_file, presets, formats=('webp', 'jpeg')):
+    """Queue any missing derivatives of ``field_file`` for rendering."""
+    if not is_image(field_file):
+        return
+    for preset in presets:
+        width, height, mode = PRESETS[preset]
+        for fmt in formats:
+            name = derivative_name(field_file, preset, fmt)
+            if name is None:
+                return
+            target = os.path.join(settings.MEDIA_ROOT, name)
+            with _pending_lock:
+                if target in _pending or os.path.exists(target):
+                    continue
+                _pending.add(target)
+            future = _get_pool().submit(render, field_file.path, target, width, height, mode, FORMATS[fmt])
+            future.add_done_callback(lambda f, target=target: _done(target))
+
+
+def _done(target):
+    with _pending_lock:
+        _pending.discard(target)
+
+
+def rendered_name(field_file, preset, fmt='webp'):
+    """Storage name of the derivative once rendered; until then queue it and return ``None``."""
+    name = derivative_name(field_file, preset, fmt) if is_image(field_file) else None
+    if name is None:
+        return None
+    if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+        return name
+    schedule(field_file, [preset], formats=(fmt,))
+    return None
+
+
+def derivative_url(field_file, preset, fmt='webp'):
+    """
+    URL of a rendered avatar derivative, queueing it and returning the
+    original's URL if it is not ready yet.
+    """
+    if preset not in PUBLIC_PRESETS:
+        raise ValueError(f'{preset!r} derivatives are private; request them from report_view with ?variant=')
+    if not field_file:
+        return ''
+    name = rendered_name(field_file, preset, fmt)
+    return settings.MEDIA_URL + name if name else field_file.url
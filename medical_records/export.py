@@ -0,0 +1,183 @@
+"""
+Streaming export of patient history.
+
+Every section (records, report metadata, prescriptions, reminders,
+appointments) is read with ``values_list`` over the joins it needs and
+``.iterator(chunk_size=...)``, so rows go from the database cursor to the
+output one chunk at a time and nothing is cached on a queryset. Output is
+produced as a generator of text chunks for ``StreamingHttpResponse`` or a
+file, in CSV (one table with a ``type`` column and the columns of every
+exported section) or NDJSON (one object per line).
+
+Rows are scoped with the same rules as the record list: patients get their
+own history, doctors the rows they are responsible for, admins everything.
+"""
+import csv
+import json
+from collections import namedtuple
+from datetime import date, datetime, time
+
+from django.apps import apps
+
+from .access import visible_to
+
+CHUNK_SIZE = 2000
+# Output is handed on in pieces of roughly this many characters
+BUFFER_SIZE = 64 * 1024
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# columns: (output name, lookup)
+Section = namedtuple('Section', 'model patient_field doctor_field columns')
+
+SECTIONS = {
+    'records': Section('medical_records.MedicalRecord', 'patient', 'doctor', (
+        ('id', 'id'),
+        ('patient', 'patient__username'),
+        ('doctor', 'doctor__username'),
+        ('diagnosis', 'diagnosis'),
+        ('description', 'description'),
+        ('date_created', 'date_created'),
+        ('date_updated', 'date_updated'),
+    )),
+    'reports': Section('medical_records.MedicalReport', 'medical_record__patient', 'medical_record__doctor', (
+        ('id', 'id'),
+        ('medical_record', 'medical_record_id'),
+        ('patient', 'medical_record__patient__username'),
+        ('title', 'title'),
+        ('report_type', 'report_type'),
+        ('date', 'date'),
+        ('filename', 'original_filename'),
+        ('file_size', 'file_size'),
+        ('sha256', 'sha256'),
+        ('content_type', 'content_type'),
+        ('notes', 'notes'),
+        ('uploaded_by', 'uploaded_by__username'),
+        ('date_uploaded', 'date_uploaded'),
+    )),
+    'prescriptions': Section('prescriptions.Prescription', 'patient', 'doctor', (
+        ('id', 'id'),
+        ('medical_record', 'medical_record_id'),
+        ('patient', 'patient__username'),
+        ('doctor', 'doctor__username'),
+        ('medication_name', 'medication_name'),
+        ('dosage', 'dosage'),
+        ('frequency', 'frequency'),
+        ('custom_frequency', 'custom_frequency'),
+        ('instructions', 'instructions'),
+        ('start_date', 'start_date'),
+        ('end_date', 'end_date'),
+        ('is_active', 'is_active'),
+        ('date_prescribed', 'date_prescribed'),
+    )),
+    'reminders': Section('prescriptions.MedicationReminder', 'prescription__patient', 'prescription__doctor', (
+        ('id', 'id'),
+        ('prescription', 'prescription_id'),
+        ('patient', 'prescription__patient__username'),
+        ('medication_name', 'prescription__medication_name'),
+        ('reminder_time', 'reminder_time'),
+        ('time_zone', 'time_zone'),
+        ('is_active', 'is_active'),
+        ('next_fire_at', 'next_fire_at'),
+    )),
+    'appointments': Section('appointments.Appointment', 'patient', 'doctor', (
+        ('id', 'id'),
+        ('patient', 'patient__username'),
+        ('doctor', 'doctor__username'),
+        ('specialization', 'specialization'),
+        ('appointment_date', 'appointment_date'),
+        ('appointment_time', 'appointment_time'),
+        ('reason', 'reason'),
+        ('status', 'status'),
+        ('notes', 'notes'),
+        ('date_created', 'date_created'),
+    )),
+}
+
+
+def _plain(value):
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    return value
+
+
+def section_rows(name, user=None, patient_id=None, doctor_id=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield one dict per row of section ``name`` that ``user`` may see (every
+    row when ``user`` is None), optionally narrowed to a patient or doctor.
+    """
+    section = SECTIONS[name]
+    queryset = apps.get_model(section.model)._default_manager.all()
+    if user is not None:
+        queryset = visible_to(user, queryset, section.patient_field, section.doctor_field)
+    if patient_id is not None:
+        queryset = queryset.filter(**{f'{section.patient_field}_id': patient_id})
+    if doctor_id is not None:
+        queryset = queryset.filter(**{f'{section.doctor_field}_id': doctor_id})
+
+    names = [column for column, _ in section.columns]
+    rows = queryset.order_by('pk').values_list(*(lookup for _, lookup in section.columns))
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(names, map(_plain, row)))
+
+
+def export_rows(sections, **filters):
+    """Yield ``(section name, row dict)`` for every requested section in turn."""
+    for name in sections:
+        for row in section_rows(name, **filters):
+            yield name, row
+
+
+def csv_columns(sections):
+    columns = ['type']
+    for name in sections:
+        columns.extend(column for column, _ in SECTIONS[name].columns if column not in columns)
+    return columns
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def _buffered(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_csv(sections, **filters):
+    columns = csv_columns(sections)
+    writer = csv.DictWriter(_Echo(), columns, restval='')
+
+    def lines():
+        yield writer.writeheader()
+        for name, row in export_rows(sections, **filters):
+            row['type'] = name
+            yield writer.writerow(row)
+
+    return _buffered(lines())
+
+
+def render_ndjson(sections, **filters):
+    def lines():
+        for name, row in export_rows(sections, **filters):
+            yield json.dumps({'type': name, **row}, default=str) + '\n'
+
+    return _buffered(lines())
+
+
+RENDERERS = {'csv': render_csv, 'ndjson': render_ndjson}
+
+
+def render(fmt, sections, **filters):
+    """Text chunks of the export in ``fmt`` ('csv' or 'ndjson')."""
+    return RENDERERS[fmt](sections, **filters)
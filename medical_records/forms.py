@@ -1,5 +1,6 @@
 from django import forms
-from .models import MedicalRecord, MedicalReport
+from .models import MedicalRecord, MedicalReport, ReportUpload
+from . import blobs
 
 class MedicalRecordForm(forms.ModelForm):
     class Meta:
@@ -27,6 +28,9 @@ class MedicalRecordForm(forms.ModelForm):
         return medical_record
 
 class MedicalReportForm(forms.ModelForm):
+    # Set by the chunked uploader instead of posting the file itself
+    upload_id = forms.UUIDField(required=False, widget=forms.HiddenInput())
+    
     class Meta:
         model = MedicalReport
         fields = ['title', 'report_type', 'date', 'report_file', 'notes']
@@ -39,6 +43,23 @@ class MedicalReportForm(forms.ModelForm):
         self.medical_record = kwargs.pop('medical_record', None)
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        self.fields['report_file'].required = False
+        self.upload = None
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        upload_id = cleaned_data.get('upload_id')
+        if upload_id:
+            self.upload = ReportUpload.objects.select_related('blob').filter(
+                id=upload_id,
+                uploaded_by=self.user,
+                medical_record=self.medical_record,
+            ).first()
+            if not self.upload or not self.upload.is_complete:
+                raise forms.ValidationError('The file upload has not finished yet.')
+        elif not cleaned_data.get('report_file') and not (self.instance.pk and self.instance.report_file):
+            self.add_error('report_file', 'Please choose a file to upload.')
+        return cleaned_data
     
     def save(self, commit=True):
         report = super().save(commit=False)
@@ -46,6 +67,14 @@ class MedicalReportForm(forms.ModelForm):
             report.medical_record = self.medical_record
         if self.user:
             report.uploaded_by = self.user
+        if self.upload:
+            blobs.attach(report, self.upload.blob, self.upload.filename)
+        elif 'report_file' in self.changed_data and self.cleaned_data.get('report_file'):
+            # Regular uploads go through the same content-addressed store
+            uploaded_file = self.cleaned_data['report_file']
+            blobs.attach(report, blobs.ingest_file(uploaded_file), uploaded_file.name)
         if commit:
             report.save()
-        return report 
\ No newline at end of file
+            if self.upload:
+                self.upload.delete()
+        return report
\ No newline at end of file
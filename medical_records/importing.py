@@ -0,0 +1,341 @@
+"""
+Streaming bulk import of historic records, prescriptions and appointments.
+
+Rows flow through generators (read -> build/validate -> batch) into
+``bulk_create``, so memory depends on the batch size and the number of
+users, never on the size of the input. Patient and doctor usernames are
+resolved through a table of every user loaded once up front; per-row
+checks that need the database (the medical record a prescription belongs
+to) run once per batch.
+
+Rows that fail validation, or that the database refuses when their batch
+is retried row by row, are handed to ``on_reject`` instead of stopping the
+import. ``bulk_create`` sends no signals, so the search index and the admin
+counters are rebuilt and the affected patients' dashboards invalidated
+once the import finishes.
+"""
+import csv
+import json
+import time
+from datetime import datetime, time as time_of_day
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
+
+from .models import MedicalRecord
+from . import dashboard, search, stats
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_COMMIT_EVERY = 10_000
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """
+    Yield ``(line number, row)`` from a CSV or JSON Lines text stream; a
+    line that is not a JSON object comes through as its raw text.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = line
+            yield line_no, row if isinstance(row, dict) else line
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class UserLookup:
+    """username -> (id, role) for every user, loaded in one streamed query."""
+
+    def __init__(self):
+        self.users = {
+            username: (pk, role)
+            for username, pk, role in User.objects.values_list('username', 'pk', 'profile__role').iterator(chunk_size=5000)
+        }
+
+    def resolve(self, username, role, required=True):
+        username = (username or '').strip()
+        if not username:
+            if required:
+                raise RowError(f'Missing {role} username.')
+            return None
+        try:
+            pk, actual_role = self.users[username]
+        except KeyError:
+            raise RowError(f'Unknown {role} "{username}".')
+        if actual_role != role:
+            raise RowError(f'"{username}" is not a {role}.')
+        return pk
+
+
+def _text(row, name, required=True):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'Missing {name}.')
+    return value
+
+
+def _parse(row, name, parser, required=True):
+    value = _text(row, name, required)
+    if not value:
+        return None
+    parsed = parser(value)
+    if parsed is None:
+        raise RowError(f'Invalid {name} "{value}".')
+    return parsed
+
+
+def _parse_datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None and parse_date(value):
+        parsed = datetime.combine(parse_date(value), time_of_day())
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _validate(instance, exclude):
+    # Foreign keys were resolved from the lookup table or checked per batch;
+    # validating them here would cost a query per row
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as error:
+        raise RowError('; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items()))
+    return instance
+
+
+class RecordImporter:
+    model = MedicalRecord
+    # auto_now_add fields bulk_create would overwrite; restored afterwards
+    historic_fields = ('date_created',)
+
+    def build(self, row, users):
+        record = MedicalRecord(
+            patient_id=users.resolve(row.get('patient'), 'patient'),
+            doctor_id=users.resolve(row.get('doctor'), 'doctor', required=False),
+            diagnosis=_text(row, 'diagnosis'),
+            description=_text(row, 'description', required=False),
+        )
+        record.date_created = _parse(row, 'date_created', _parse_datetime, required=False)
+        return _validate(record, exclude=['patient', 'doctor', 'date_created', 'date_updated'])
+
+    def check_batch(self, instances):
+        return {}
+
+
+class PrescriptionImporter:
+    historic_fields = ('date_created', 'date_prescribed')
+
+    @property
+    def model(self):
+        from prescriptions.models import Prescription
+        return Prescription
+
+    def build(self, row, users):
+        prescription = self.model(
+            patient_id=users.resolve(row.get('patient'), 'patient'),
+            doctor_id=users.resolve(row.get('doctor'), 'doctor'),
+            medical_record_id=_parse(row, 'medical_record', lambda value: int(value) if value.isdigit() else None),
+            start_date=_parse(row, 'start_date', parse_date),
+            end_date=_parse(row, 'end_date', parse_date, required=False),
+            medication_name=_text(row, 'medication_name'),
+            dosage=_text(row, 'dosage'),
+            frequency=_text(row, 'frequency'),
+            custom_frequency=_text(row, 'custom_frequency', required=False) or None,
+            instructions=_text(row, 'instructions', required=False),
+            is_active=_text(row, 'is_active', required=False).lower() not in ('0', 'false', 'no'),
+        )
+        prescription.date_created = _parse(row, 'date_created', _parse_datetime, required=False)
+        prescription.date_prescribed = _parse(row, 'date_prescribed', parse_date, required=False) or (
+            timezone.localdate(prescription.date_created) if prescription.date_created else None
+        )
+        return _validate(prescription, exclude=[
+            'patient', 'doctor', 'medical_record', 'date_prescribed', 'date_created', 'date_updated',
+        ])
+
+    def check_batch(self, instances):
+        """``{index: error}`` for prescriptions whose record is missing or another patient's."""
+        owners = dict(MedicalRecord.objects.filter(
+            pk__in={instance.medical_record_id for instance in instances}
+        ).values_list('pk', 'patient_id'))
+        errors = {}
+        for index, instance in enumerate(instances):
+            owner = owners.get(instance.medical_record_id)
+            if owner is None:
+                errors[index] = f'Unknown medical record {instance.medical_record_id}.'
+            elif owner != instance.patient_id:
+                errors[index] = f'Medical record {instance.medical_record_id} belongs to another patient.'
+        return errors
+
+
+class AppointmentImporter:
+    historic_fields = ('date_created',)
+
+    @property
+    def model(self):
+        from appointments.models import Appointment
+        return Appointment
+
+    def build(self, row, users):
+        appointment = self.model(
+            patient_id=users.resolve(row.get('patient'), 'patient'),
+            doctor_id=users.resolve(row.get('doctor'), 'doctor'),
+            specialization=_text(row, 'specialization', required=False) or None,
+            appointment_date=_parse(row, 'appointment_date', parse_date),
+            appointment_time=_parse(row, 'appointment_time', parse_time),
+            reason=_text(row, 'reason', required=False),
+            status=_text(row, 'status', required=False) or 'completed',
+            notes=_text(row, 'notes', required=False) or None,
+        )
+        appointment.date_created = _parse(row, 'date_created', _parse_datetime, required=False)
+        return _validate(appointment, exclude=['patient', 'doctor', 'date_created', 'date_updated'])
+
+    def check_batch(self, instances):
+        return {}
+
+
+IMPORTERS = {
+    'records': RecordImporter,
+    'prescriptions': PrescriptionImporter,
+    'appointments': AppointmentImporter,
+}
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = self.imported = self.rejected = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def _historic(importer, instance):
+    """The imported values of the fields ``bulk_create`` will overwrite."""
+    values = {field: getattr(instance, field) for field in importer.historic_fields}
+    return {field: value for field, value in values.items() if value is not None}
+
+
+def _insert(importer, instances, historic):
+    """Insert a batch and put the historic timestamps (read at build time) back."""
+    created = importer.model.objects.bulk_create(instances)
+    restored = []
+    for instance, values in zip(created, historic):
+        if values:
+            for field, value in values.items():
+                setattr(instance, field, value)
+            restored.append(instance)
+    if restored:
+        importer.model.objects.bulk_update(restored, list(importer.historic_fields))
+    return created
+
+
+def _flush(importer, batch, on_reject, stats_):
+    """
+    Insert ``batch`` of ``(line, row, instance, historic values)``; falls
+    back to one row at a time.
+    """
+    errors = importer.check_batch([instance for _, _, instance, _ in batch])
+    for index in sorted(errors):
+        line_no, row, _, _ = batch[index]
+        on_reject(line_no, row, errors[index])
+    batch = [item for index, item in enumerate(batch) if index not in errors]
+    stats_.rejected += len(errors)
+    if not batch:
+        return []
+
+    try:
+        with transaction.atomic():
+            created = _insert(
+                importer, [instance for _, _, instance, _ in batch], [historic for _, _, _, historic in batch],
+            )
+        stats_.imported += len(created)
+        return created
+    except DatabaseError:
+        pass
+
+    # Something in the batch broke a constraint: find it row by row. The
+    # failed bulk_create has already stamped the auto_now fields with "now"
+    created = []
+    for line_no, row, instance, historic in batch:
+        instance.pk = None
+        try:
+            with transaction.atomic():
+                created.extend(_insert(importer, [instance], [historic]))
+            stats_.imported += 1
+        except DatabaseError as error:
+            stats_.rejected += 1
+            on_reject(line_no, row, f'Database refused the row: {error}')
+    return created
+
+
+def import_rows(kind, rows, batch_size=DEFAULT_BATCH_SIZE, commit_every=DEFAULT_COMMIT_EVERY,
+                on_reject=None, on_progress=None, dry_run=False):
+    """
+    Import ``rows`` (``(line number, dict)`` pairs) of ``kind``; returns an
+    ``ImportStats``. Every ``commit_every`` rows are committed together.
+    """
+    importer = IMPORTERS[kind]()
+    users = UserLookup()
+    stats_ = ImportStats()
+    on_reject = on_reject or (lambda line_no, row, error: None)
+    patients = set()
+
+    def built():
+        for line_no, row in rows:
+            stats_.read += 1
+            try:
+                if not isinstance(row, dict):
+                    raise RowError('Not a JSON object.')
+                instance = importer.build(row, users)
+                yield line_no, row, instance, _historic(importer, instance)
+            except RowError as error:
+                stats_.rejected += 1
+                on_reject(line_no, row, str(error))
+
+    batches_per_commit = max(1, commit_every // batch_size)
+    for chunk in batched(batched(built(), batch_size), batches_per_commit):
+        with transaction.atomic():
+            for batch in chunk:
+                for instance in _flush(importer, batch, on_reject, stats_):
+                    patients.add(instance.patient_id)
+            if dry_run:
+                transaction.set_rollback(True)
+        if on_progress:
+            on_progress(stats_)
+
+    if stats_.imported and not dry_run:
+        # Searches see the old index or the new one, never a half-built one
+        with transaction.atomic():
+            search.rebuild()
+        stats.rebuild()
+        for patient_id in patients:
+            # Import kinds are named after the dashboard sections they feed
+            dashboard.invalidate(patient_id, kind)
+    return stats_
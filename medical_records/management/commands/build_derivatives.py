@@ -0,0 +1,36 @@
+import os
+import shutil
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medical_records import derivatives
+from medical_records.models import MedicalReport
+
+AVATAR_PRESETS = ['avatar', 'avatar_large']
+
+
+class Command(BaseCommand):
+    help = 'Render missing avatar and report image derivatives in the process pool'
+
+    def handle(self, *args, **options):
+        for preset in derivatives.REPORT_PRESETS:
+            # Report previews used to be rendered under the public directory
+            shutil.rmtree(os.path.join(settings.MEDIA_ROOT, derivatives.DERIVED_DIR, preset), ignore_errors=True)
+
+        UserProfile = apps.get_model('accounts', 'UserProfile')
+        queued = 0
+        profiles = UserProfile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True)
+        for profile in profiles.only('id', 'profile_picture').iterator(chunk_size=500):
+            derivatives.schedule(profile.profile_picture, AVATAR_PRESETS)
+            queued += 1
+        for report in MedicalReport.objects.only('id', 'report_file').iterator(chunk_size=500):
+            if derivatives.is_image(report.report_file):
+                derivatives.schedule(report.report_file, derivatives.REPORT_PRESETS)
+                queued += 1
+
+        if derivatives._pool is not None:
+            # Wait for the queued renders before the command exits
+            derivatives._pool.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(f'Checked derivatives for {queued} file(s).'))
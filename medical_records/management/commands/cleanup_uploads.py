@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from medical_records import blobs
+
+
+class Command(BaseCommand):
+    help = 'Remove abandoned report uploads, their partial files and blobs no report uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help='Only uploads and files untouched for this long')
+
+    def handle(self, *args, **options):
+        removed = blobs.expire_uploads(timezone.now() - timedelta(hours=options['hours']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {removed["uploads"]} upload(s), {removed["files"]} partial file(s) '
+            f'and {removed["blobs"]} blob(s).'
+        ))
@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from medical_records import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream patient history (records, reports, prescriptions, reminders and '
+        'appointments) as CSV or NDJSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='ndjson')
+        parser.add_argument('--section', action='append', choices=list(export.SECTIONS),
+                            help='Section to export; repeat for several (default: all)')
+        parser.add_argument('--patient', help='Only this patient (username)')
+        parser.add_argument('--doctor', help="Only this doctor's panel (username)")
+        parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE,
+                            help='Rows fetched from the database at a time')
+        parser.add_argument('--output', help='File to write (default: stdout)')
+
+    def user_id(self, username, role):
+        if username is None:
+            return None
+        pk = User.objects.filter(username=username, profile__role=role).values_list('pk', flat=True).first()
+        if pk is None:
+            raise CommandError(f'No {role} named "{username}".')
+        return pk
+
+    def handle(self, *args, **options):
+        chunks = export.render(
+            options['format'], options['section'] or list(export.SECTIONS),
+            patient_id=self.user_id(options['patient'], 'patient'),
+            doctor_id=self.user_id(options['doctor'], 'doctor'),
+            chunk_size=options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from medical_records import synthetic
+
+
+class Command(BaseCommand):
+    help = 'Create a deterministic synthetic data set (users, records, report files, prescriptions, appointments)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synth', help='Username prefix of the generated users')
+        parser.add_argument('--anchor', type=date.fromisoformat,
+                            help='Day the history is dated back from (default: today)')
+        parser.add_argument('--report-size', type=int, default=32 * 1024, help='Approximate report file size in bytes')
+        for name, default in synthetic.DEFAULT_COUNTS.items():
+            parser.add_argument(f'--{name.replace("_", "-")}', type=int, default=default)
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete an existing data set with the same prefix first')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            if not options['replace']:
+                raise CommandError(f'A data set with prefix "{prefix}" exists; pass --replace to recreate it.')
+            self.stdout.write(f'Deleted {synthetic.delete(prefix)} rows.')
+
+        created = synthetic.generate(
+            seed=options['seed'], prefix=prefix, anchor=options['anchor'],
+            report_size=options['report_size'], log=self.stdout.write,
+            **{name: options[name] for name in synthetic.DEFAULT_COUNTS},
+        )
+        for name, count in created.items():
+            self.stdout.write(f'{name:16}{count:>10}')
+        self.stdout.write(self.style.SUCCESS('Synthetic data created.'))
@@ -0,0 +1,63 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medical_records import importing
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream legacy medical records, prescriptions or appointments from a CSV '
+        'or JSON Lines file into the database in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importing.IMPORTERS))
+        parser.add_argument('path', help='CSV or JSON Lines file')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=importing.DEFAULT_BATCH_SIZE,
+                            help='Rows per bulk insert')
+        parser.add_argument('--commit-every', type=int, default=importing.DEFAULT_COMMIT_EVERY,
+                            help='Rows per transaction')
+        parser.add_argument('--rejects',
+                            help='Where to write rejected rows (default: <path>.rejects.jsonl)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Validate and insert, then roll every transaction back')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'No such file: {path}')
+        if options['batch_size'] < 1 or options['commit_every'] < 1:
+            raise CommandError('--batch-size and --commit-every must be positive.')
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+
+        with open(path, newline='', encoding='utf-8') as stream, \
+                open(rejects_path, 'w', encoding='utf-8') as rejects:
+            def on_reject(line_no, row, error):
+                rejects.write(json.dumps({'line': line_no, 'error': error, 'row': row}, default=str) + '\n')
+
+            def on_progress(stats):
+                self.stdout.write(
+                    f'{stats.read:>10} read {stats.imported:>10} imported {stats.rejected:>8} rejected '
+                    f'{stats.rate:>10.0f} rows/s'
+                )
+
+            stats = importing.import_rows(
+                options['kind'], importing.read_rows(stream, fmt),
+                batch_size=options['batch_size'], commit_every=options['commit_every'],
+                on_reject=on_reject, on_progress=on_progress, dry_run=options['dry_run'],
+            )
+
+        if not stats.rejected:
+            os.remove(rejects_path)
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {stats.imported} of {stats.read} rows in {stats.elapsed:.2f}s '
+            f'({stats.rate:.0f} rows/s).'
+        ))
+        if stats.rejected:
+            self.stdout.write(self.style.WARNING(f'{stats.rejected} rows rejected; see {rejects_path}.'))
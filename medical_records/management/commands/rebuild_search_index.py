@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from medical_records import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from records, reports and prescriptions'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} entries in {time.monotonic() - started:.2f}s.'
+        ))
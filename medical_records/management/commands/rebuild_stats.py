@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from medical_records import stats
+
+
+class Command(BaseCommand):
+    help = 'Recount the admin dashboard counters from the source tables'
+
+    def handle(self, *args, **options):
+        for name, value in sorted(stats.rebuild().items()):
+            self.stdout.write(f'{name:32}{value:>12}')
+        self.stdout.write(self.style.SUCCESS('Counters rebuilt.'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from medical_records import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive every GET route through the test client under concurrency and report '
+        'latency percentiles, requests/s and queries per request'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help='Route names to run (default: all)')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per route and role')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--role', action='append', choices=benchmark.ROLES,
+                            help='Role to run as; repeat for several (default: all)')
+        parser.add_argument('--output', help='Save the results as JSON')
+        parser.add_argument('--baseline', help='Compare with results saved by an earlier run')
+        parser.add_argument('--tolerance', type=float, default=benchmark.REGRESSION_TOLERANCE,
+                            help='Allowed p95 slowdown against the baseline (0.2 = 20%%)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive.')
+        samples = benchmark.sample_ids()
+        if samples is None:
+            raise CommandError('No data to benchmark; run generate_synthetic_data first.')
+        cases = benchmark.discover_cases(samples, set(options['routes']))
+
+        self.stdout.write(
+            f'{"role":8} {"route":40} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}  status'
+        )
+        results = []
+        for result in benchmark.run(
+            cases, samples, roles=options['role'] or benchmark.ROLES,
+            requests=options['requests'], concurrency=options['concurrency'], warmup=options['warmup'],
+        ):
+            results.append(result)
+            statuses = ' '.join(f'{status}x{count}' for status, count in sorted(result.statuses.items()))
+            self.stdout.write(
+                f'{result.role:8} {result.case:40} {result.p50:8.1f} {result.p95:8.1f} {result.p99:8.1f} '
+                f'{result.rps:8.1f} {result.queries:8.1f}  {statuses}'
+            )
+
+        if options['output']:
+            benchmark.save(results, options['output'])
+            self.stdout.write(f'Results saved to {options["output"]}.')
+        if options['baseline']:
+            regressions = benchmark.compare(results, options['baseline'], options['tolerance'])
+            for key, message in regressions:
+                self.stdout.write(self.style.WARNING(f'Regression: {key}: {message}'))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
+            elif options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regressions against the baseline.')
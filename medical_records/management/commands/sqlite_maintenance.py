@@ -0,0 +1,86 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+# PRAGMA auto_vacuum values
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+class Command(BaseCommand):
+    help = (
+        'Run ANALYZE, PRAGMA optimize, incremental vacuum and a WAL checkpoint '
+        'on the SQLite database, reporting page statistics before and after'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--vacuum-pages', type=int, default=2000,
+                            help='Free pages to release per run (0 releases all)')
+        parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                            help='Switch auto_vacuum to INCREMENTAL (runs a full VACUUM once)')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Repeat every N seconds instead of running once')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError('sqlite_maintenance only supports SQLite databases.')
+
+        while True:
+            self.run(connection, options)
+            if not options['interval']:
+                break
+            # Release the connection between runs so the schedule does not
+            # hold a read snapshot open and block WAL checkpoints
+            connection.close()
+            time.sleep(options['interval'])
+
+    def pragma(self, connection, statement):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {statement}')
+            return cursor.fetchall()
+
+    def stats(self, connection):
+        page_size = self.pragma(connection, 'page_size')[0][0]
+        path = connection.settings_dict['NAME']
+        wal_path = f'{path}-wal'
+        return {
+            'page_size': page_size,
+            'page_count': self.pragma(connection, 'page_count')[0][0],
+            'freelist_count': self.pragma(connection, 'freelist_count')[0][0],
+            'file_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+            'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        }
+
+    def run(self, connection, options):
+        started = time.monotonic()
+        before = self.stats(connection)
+
+        auto_vacuum = AUTO_VACUUM_MODES.get(self.pragma(connection, 'auto_vacuum')[0][0], 'none')
+        if options['enable_incremental_vacuum'] and auto_vacuum != 'incremental':
+            # The mode only takes effect after a full VACUUM rebuilds the file
+            self.pragma(connection, 'auto_vacuum=INCREMENTAL')
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            auto_vacuum = 'incremental'
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.pragma(connection, 'optimize')
+        if auto_vacuum == 'incremental':
+            pages = options['vacuum_pages']
+            self.pragma(connection, f'incremental_vacuum({pages})' if pages else 'incremental_vacuum')
+        checkpoint = self.pragma(connection, 'wal_checkpoint(TRUNCATE)')[0]
+
+        after = self.stats(connection)
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f'auto_vacuum: {auto_vacuum}')
+        self.stdout.write(f"{'':16}{'before':>14}{'after':>14}")
+        for key in before:
+            self.stdout.write(f'{key:16}{before[key]:>14}{after[key]:>14}')
+        busy, log_frames, checkpointed = checkpoint
+        self.stdout.write(f'wal checkpoint: busy={busy} frames={log_frames} checkpointed={checkpointed}')
+        self.stdout.write(self.style.SUCCESS(f'Maintenance finished in {elapsed:.2f}s.'))
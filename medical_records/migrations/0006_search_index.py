@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 12:05
+
+from django.db import migrations
+
+# rowid = pk * 4 + kind (1 record, 2 report, 3 prescription); see
+# medical_records.search
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+    title, body, scope,
+    tokenize = 'porter unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0, 0.0)');
+"""
+
+POPULATE_INDEX = """
+INSERT INTO search_index (rowid, title, body, scope)
+SELECT id * 4 + 1, diagnosis, description,
+       'record p' || patient_id || COALESCE(' d' || doctor_id, '')
+FROM medical_records_medicalrecord;
+INSERT INTO search_index (rowid, title, body, scope)
+SELECT rp.id * 4 + 2, rp.title, rp.report_type || char(10) || COALESCE(rp.notes, ''),
+       'report p' || r.patient_id || COALESCE(' d' || r.doctor_id, '')
+FROM medical_records_medicalreport rp
+JOIN medical_records_medicalrecord r ON r.id = rp.medical_record_id;
+INSERT INTO search_index (rowid, title, body, scope)
+SELECT id * 4 + 3, medication_name, instructions,
+       'prescription p' || patient_id || ' d' || doctor_id
+FROM prescriptions_prescription;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0005_medicalrecord_indexes'),
+        ('prescriptions', '0005_prescription_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=CREATE_INDEX, reverse_sql='DROP TABLE IF EXISTS search_index;'),
+        migrations.RunSQL(sql=POPULATE_INDEX, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 13:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0007_statcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalreport',
+            name='date_updated',
+            # Replaced with the upload time below
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            'UPDATE medical_records_medicalreport SET date_updated = date_uploaded',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medical_records', '0008_medicalreport_date_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportupload',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
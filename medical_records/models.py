@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from accounts.models import UserProfile
@@ -10,9 +12,51 @@ class MedicalRecord(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Record lists are keyset-paginated on (date_created, id)
+            models.Index(fields=['patient', 'date_created'], name='record_patient_created_idx'),
+            models.Index(fields=['doctor', 'date_created'], name='record_doctor_created_idx'),
+            models.Index(fields=['date_created'], name='record_created_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.patient.username} - {self.diagnosis} - {self.date_created.strftime('%Y-%m-%d')}"
 
+class ReportBlob(models.Model):
+    """A stored report file, kept once per distinct content."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='medical_reports/blobs/', max_length=255)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100)
+    # Number of MedicalReport rows pointing at this blob
+    ref_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} bytes)"
+
+class ReportUpload(models.Model):
+    """An in-progress chunked upload of a report file."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    medical_record = models.ForeignKey('MedicalRecord', on_delete=models.CASCADE, related_name='uploads')
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    # Set while a request is writing a chunk, so only one writes at a time
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    blob = models.ForeignKey(ReportBlob, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+    
+    @property
+    def is_complete(self):
+        return self.blob_id is not None
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
 class MedicalReport(models.Model):
     medical_record = models.ForeignKey(MedicalRecord, on_delete=models.CASCADE, related_name='reports')
     title = models.CharField(max_length=255)
@@ -22,6 +66,21 @@ class MedicalReport(models.Model):
     notes = models.TextField(blank=True, null=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploaded_reports')
     date_uploaded = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+    # Recorded at upload time so pages never need to open the file
+    blob = models.ForeignKey(ReportBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='reports')
+    original_filename = models.CharField(max_length=255, blank=True, default='')
+    file_size = models.BigIntegerField(null=True, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+    content_type = models.CharField(max_length=100, blank=True, default='')
     
     def __str__(self):
         return f"{self.title} - {self.medical_record.patient.username} - {self.date}"
+
+class StatCounter(models.Model):
+    """A site-wide total kept current on every write (see medical_records.stats)."""
+    name = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
@@ -0,0 +1,128 @@
+import base64
+import json
+from datetime import date, datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset plus the cursors around it."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def _serialize(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, [_serialize(v) for v in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field_count):
+    """Return ``(direction, values)`` or ``(None, None)`` for a bad cursor."""
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None, None
+    if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != field_count:
+        return None, None
+    return direction, values
+
+
+def _after(fields, values, descending):
+    # Lexicographic "comes after this key" filter, e.g. for (a, b):
+    # a < x OR (a = x AND b < y) when descending.
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        clause = Q(**{f'{field}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            clause &= Q(**{prev_field: prev_value})
+        condition |= clause
+    return condition
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(request.GET.get('page_size', default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_paginate(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE,
+                    fields=('date_created', 'id'), descending=True):
+    """
+    Fetch a single page of ``queryset`` ordered by ``fields``.
+
+    Unlike OFFSET pagination the cost of a page does not depend on how deep
+    into the result set it is: the cursor carries the key of the row at the
+    page boundary and the next page is a range scan starting from it.
+    """
+    fields = list(fields)
+    direction, values = decode_cursor(cursor, len(fields))
+
+    order = [f'-{f}' if descending else f for f in fields]
+    if direction == 'prev':
+        # Walk backwards from the cursor and flip the rows afterwards.
+        reverse_order = [f[1:] if f.startswith('-') else f'-{f}' for f in order]
+        qs = queryset.filter(_after(fields, values, not descending)).order_by(*reverse_order)
+    elif direction == 'next':
+        qs = queryset.filter(_after(fields, values, descending)).order_by(*order)
+    else:
+        qs = queryset.order_by(*order)
+
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+
+    def key(obj):
+        # Rows from .values() querysets are dicts
+        if isinstance(obj, dict):
+            return [obj[f] for f in fields]
+        return [getattr(obj, f) for f in fields]
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if direction == 'prev':
+            next_cursor = encode_cursor('next', key(rows[-1]))
+            if has_more:
+                previous_cursor = encode_cursor('prev', key(rows[0]))
+        else:
+            if has_more:
+                next_cursor = encode_cursor('next', key(rows[-1]))
+            if direction == 'next':
+                previous_cursor = encode_cursor('prev', key(rows[0]))
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,210 @@
+"""
+Full-text search over medical records, reports and prescriptions.
+
+Everything searchable lives in one SQLite FTS5 table, ``search_index``, kept
+in step with the source rows by the save/delete signals. The rowid encodes
+the kind and primary key of the row it indexes, so a hit can be linked to
+without loading the object.
+
+Besides the searchable ``title`` and ``body`` columns each entry carries a
+``scope`` column of tokens naming its kind, patient (``p<id>``) and doctor
+(``d<id>``). Role scoping is then part of the MATCH expression and FTS5
+intersects it with the search terms inside the index, rather than ranking
+every match and filtering the visible ones afterwards.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+KINDS = {'record': 1, 'report': 2, 'prescription': 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+# rowid = pk * ROWID_STRIDE + kind code
+ROWID_STRIDE = 4
+
+MAX_TERMS = 8
+TERM_RE = re.compile(r'\w+')
+
+# Snippet markers; the snippet is escaped before they become <mark> tags
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_END = '\x03'
+
+SearchHit = namedtuple('SearchHit', 'kind object_id title snippet url')
+
+
+def _rowid(kind, pk):
+    return pk * ROWID_STRIDE + KINDS[kind]
+
+
+def _scope(kind, patient_id, doctor_id):
+    tokens = [kind, f'p{patient_id}']
+    if doctor_id:
+        tokens.append(f'd{doctor_id}')
+    return ' '.join(tokens)
+
+
+def _upsert(rowid, title, body, scope):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'INSERT OR REPLACE INTO search_index (rowid, title, body, scope) VALUES (%s, %s, %s, %s)',
+            [rowid, title, body, scope],
+        )
+
+
+def _current_scope(rowid):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT scope FROM search_index WHERE rowid = %s', [rowid])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def index_record(record):
+    rowid = _rowid('record', record.pk)
+    scope = _scope('record', record.patient_id, record.doctor_id)
+    previous = _current_scope(rowid)
+    _upsert(rowid, record.diagnosis, record.description, scope)
+    if previous is not None and previous != scope:
+        # Reports are visible to whoever can see their record
+        report_ids = list(record.reports.values_list('pk', flat=True))
+        if report_ids:
+            report_scope = _scope('report', record.patient_id, record.doctor_id)
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    'UPDATE search_index SET scope = %s WHERE rowid = %s',
+                    [(report_scope, _rowid('report', pk)) for pk in report_ids],
+                )
+
+
+def index_report(report):
+    record = report.medical_record
+    _upsert(
+        _rowid('report', report.pk),
+        report.title,
+        f'{report.report_type}\n{report.notes or ""}',
+        _scope('report', record.patient_id, record.doctor_id),
+    )
+
+
+def index_prescription(prescription):
+    _upsert(
+        _rowid('prescription', prescription.pk),
+        prescription.medication_name,
+        prescription.instructions,
+        _scope('prescription', prescription.patient_id, prescription.doctor_id),
+    )
+
+
+def unindex(kind, pk):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM search_index WHERE rowid = %s', [_rowid(kind, pk)])
+
+
+REBUILD_SQL = [
+    'DELETE FROM search_index',
+    f"""
+    INSERT INTO search_index (rowid, title, body, scope)
+    SELECT id * {ROWID_STRIDE} + {KINDS['record']}, diagnosis, description,
+           'record p' || patient_id || COALESCE(' d' || doctor_id, '')
+    FROM medical_records_medicalrecord
+    """,
+    f"""
+    INSERT INTO search_index (rowid, title, body, scope)
+    SELECT rp.id * {ROWID_STRIDE} + {KINDS['report']}, rp.title,
+           rp.report_type || char(10) || COALESCE(rp.notes, ''),
+           'report p' || r.patient_id || COALESCE(' d' || r.doctor_id, '')
+    FROM medical_records_medicalreport rp
+    JOIN medical_records_medicalrecord r ON r.id = rp.medical_record_id
+    """,
+    f"""
+    INSERT INTO search_index (rowid, title, body, scope)
+    SELECT id * {ROWID_STRIDE} + {KINDS['prescription']}, medication_name, instructions,
+           'prescription p' || patient_id || ' d' || doctor_id
+    FROM prescriptions_prescription
+    """,
+    "INSERT INTO search_index (search_index) VALUES ('optimize')",
+]
+
+
+def rebuild():
+    """Re-create every index entry from the source tables; returns the entry count."""
+    with connection.cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+        cursor.execute('SELECT COUNT(*) FROM search_index')
+        return cursor.fetchone()[0]
+
+
+def user_scope(user):
+    """
+    The scope token limiting ``user``'s results, ``''`` for unrestricted
+    (admins) or ``None`` if the user may not see anything.
+    """
+    profile = user.profile
+    if profile.is_admin():
+        return ''
+    if profile.is_patient():
+        return f'p{user.pk}'
+    if profile.is_doctor():
+        return f'd{user.pk}'
+    return None
+
+
+def build_match(query, scope='', kinds=None):
+    """
+    Turn free text into an FTS5 MATCH expression, or ``None`` if it has no
+    searchable terms. Every term is quoted so user input can never be read
+    as FTS5 syntax; the last one is prefix-matched.
+    """
+    terms = TERM_RE.findall(query or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    match = '{title body} : (%s)' % ' '.join(quoted)
+    if scope:
+        match += f' AND scope : "{scope}"'
+    if kinds:
+        match += ' AND scope : (%s)' % ' OR '.join(f'"{kind}"' for kind in kinds)
+    return match
+
+
+def _highlight(snippet):
+    return mark_safe(
+        escape(snippet).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+    )
+
+
+def _url(kind, pk):
+    if kind == 'record':
+        return reverse('medical_record_detail', args=[pk])
+    if kind == 'report':
+        return reverse('medical_report_detail', args=[pk])
+    return reverse('prescription_detail', args=[pk])
+
+
+def search(user, query, kinds=None, offset=0, limit=20):
+    """
+    Best-ranked entries visible to ``user`` matching ``query``, as a list of
+    ``SearchHit``. Titles weigh ten times as much as bodies.
+    """
+    scope = user_scope(user)
+    match = build_match(query, scope, kinds) if scope is not None else None
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT rowid, title, snippet(search_index, 1, %s, %s, %s, 16) '
+            'FROM search_index WHERE search_index MATCH %s '
+            'ORDER BY rank LIMIT %s OFFSET %s',
+            [HIGHLIGHT_START, HIGHLIGHT_END, '…', match, limit, offset],
+        )
+        rows = cursor.fetchall()
+    hits = []
+    for rowid, title, snippet in rows:
+        kind = KIND_NAMES[rowid % ROWID_STRIDE]
+        pk = rowid // ROWID_STRIDE
+        hits.append(SearchHit(kind, pk, title, _highlight(snippet), _url(kind, pk)))
+    return hits
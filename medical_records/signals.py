@@ -0,0 +1,150 @@
+from django.db import transaction
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import MedicalRecord, MedicalReport
+from . import blobs, dashboard, derivatives, search, stats
+
+
+@receiver(post_init, sender=MedicalReport)
+def remember_blob(sender, instance, **kwargs):
+    # The blob the stored row points at, so a save that replaces the file
+    # can move the reference without reading the row again
+    instance._stored_blob_id = instance.__dict__.get('blob_id', DEFERRED)
+
+
+@receiver(post_save, sender=MedicalReport)
+def count_blob_reference(sender, instance, created, raw=False, **kwargs):
+    stored = None if created else instance._stored_blob_id
+    if raw or stored is DEFERRED or stored == instance.blob_id:
+        return
+    if instance.blob_id:
+        blobs.add_reference(instance.blob_id)
+    if stored:
+        blobs.release(stored)
+    instance._stored_blob_id = instance.blob_id
+
+
+@receiver(post_delete, sender=MedicalReport)
+def release_blob_reference(sender, instance, **kwargs):
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+
+
+@receiver(post_save, sender=MedicalReport)
+def render_report_previews(sender, instance, raw=False, **kwargs):
+    if raw or not derivatives.is_image(instance.report_file):
+        return
+    transaction.on_commit(
+        lambda: derivatives.schedule(instance.report_file, derivatives.REPORT_PRESETS)
+    )
+
+
+@receiver(post_save, sender=MedicalRecord)
+def index_record(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_record(instance)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+def unindex_record(sender, instance, **kwargs):
+    search.unindex('record', instance.pk)
+
+
+@receiver(post_save, sender=MedicalReport)
+def index_report(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_report(instance)
+
+
+@receiver(post_delete, sender=MedicalReport)
+def unindex_report(sender, instance, **kwargs):
+    search.unindex('report', instance.pk)
+
+
+@receiver(post_save, sender='accounts.UserProfile')
+def render_avatars(sender, instance, raw=False, **kwargs):
+    if raw or not instance.profile_picture:
+        return
+    transaction.on_commit(
+        lambda: derivatives.schedule(instance.profile_picture, ['avatar', 'avatar_large'])
+    )
+
+
+def _refresh_dashboard(patient_id, section):
+    transaction.on_commit(lambda: dashboard.invalidate(patient_id, section))
+
+
+# Reminders are not part of the snapshot; the dashboard reads them live
+@receiver(post_save, sender=MedicalRecord)
+@receiver(post_delete, sender=MedicalRecord)
+def refresh_dashboard_records(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_dashboard(instance.patient_id, 'records')
+
+
+@receiver(post_save, sender='prescriptions.Prescription')
+@receiver(post_delete, sender='prescriptions.Prescription')
+def refresh_dashboard_prescriptions(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_dashboard(instance.patient_id, 'prescriptions')
+
+
+@receiver(post_save, sender='appointments.Appointment')
+@receiver(post_delete, sender='appointments.Appointment')
+def refresh_dashboard_appointments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _refresh_dashboard(instance.patient_id, 'appointments')
+
+
+@receiver(post_init, sender='auth.User')
+def remember_user_name(sender, instance, **kwargs):
+    instance._user_name = dashboard.name_fields(instance)
+
+
+@receiver(post_save, sender='auth.User')
+def refresh_user_names(sender, instance, created, raw=False, **kwargs):
+    # Dashboard snapshots and the booking form's doctor rosters show names;
+    # a login only touches last_login
+    from appointments import catalog
+
+    name = dashboard.name_fields(instance)
+    if not raw and not created and name != instance._user_name:
+        transaction.on_commit(dashboard.invalidate_names)
+        transaction.on_commit(catalog.invalidate)
+    instance._user_name = name
+
+
+@receiver(post_init, sender='accounts.UserProfile')
+@receiver(post_init, sender='prescriptions.Prescription')
+@receiver(post_init, sender='appointments.Appointment')
+def remember_counted_value(sender, instance, **kwargs):
+    stats.remember(instance)
+
+
+@receiver(pre_save, sender='accounts.UserProfile')
+@receiver(pre_save, sender='prescriptions.Prescription')
+@receiver(pre_save, sender='appointments.Appointment')
+def remember_deferred_counted_value(sender, instance, raw=False, **kwargs):
+    if not raw:
+        stats.remember_deferred(instance)
+
+
+@receiver(post_save, sender=MedicalRecord)
+@receiver(post_save, sender=MedicalReport)
+@receiver(post_save, sender='accounts.UserProfile')
+@receiver(post_save, sender='prescriptions.Prescription')
+@receiver(post_save, sender='appointments.Appointment')
+def count_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        stats.saved(instance, created)
+
+
+@receiver(post_delete, sender=MedicalRecord)
+@receiver(post_delete, sender=MedicalReport)
+@receiver(post_delete, sender='accounts.UserProfile')
+@receiver(post_delete, sender='prescriptions.Prescription')
+@receiver(post_delete, sender='appointments.Appointment')
+def count_deleted(sender, instance, **kwargs):
+    stats.deleted(instance)
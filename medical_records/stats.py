@@ -0,0 +1,148 @@
+"""
+Site-wide counters for the admin dashboard.
+
+Totals (users by role, records, reports, active prescriptions, appointments
+by status) live in ``StatCounter`` rows that the model signals adjust by
+one inside the transaction of each write, so the dashboard reads a handful
+of rows however many users there are. The role, status or flag a row was
+counted under is noted as it is loaded, so a save needs no extra read to
+tell which counter to move. Bulk updates and deletes bypass the signals;
+``rebuild()`` (also the ``rebuild_stats`` command) recounts everything from
+the source tables, and runs by itself the first time the counters are read.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import DEFERRED, Count, F
+
+from .models import StatCounter
+
+# model label -> (field whose value picks the counter, counter prefix)
+COUNTED_FIELDS = {
+    'accounts.userprofile': ('role', 'users'),
+    'prescriptions.prescription': ('is_active', 'prescriptions.active'),
+    'appointments.appointment': ('status', 'appointments'),
+}
+COUNTED_MODELS = {
+    'medical_records.medicalrecord': 'records',
+    'medical_records.medicalreport': 'reports',
+}
+
+
+def add(name, delta):
+    # Only seeded counters move; rebuild() creates the full set
+    if name and delta:
+        StatCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+
+def counter_for(instance, value):
+    field, prefix = COUNTED_FIELDS[instance._meta.label_lower]
+    if isinstance(value, bool):
+        return prefix if value else None
+    return f'{prefix}.{value}' if value is not None else None
+
+
+def remember(instance):
+    """Note the counted field's value as ``instance`` is loaded (or built)."""
+    field, _ = COUNTED_FIELDS[instance._meta.label_lower]
+    instance._counted_value = instance.__dict__.get(field, DEFERRED)
+
+
+def remember_deferred(instance):
+    """Before a save, read the stored value if it was deferred and has since been set."""
+    field, _ = COUNTED_FIELDS[instance._meta.label_lower]
+    if (instance._counted_value is DEFERRED and field in instance.__dict__
+            and not instance._state.adding and instance.pk is not None):
+        instance._counted_value = (
+            type(instance)._default_manager.filter(pk=instance.pk).values_list(field, flat=True).first()
+        )
+
+
+def saved(instance, created):
+    label = instance._meta.label_lower
+    if label in COUNTED_MODELS:
+        if created:
+            add(COUNTED_MODELS[label], 1)
+        return
+    field, _ = COUNTED_FIELDS[label]
+    if field not in instance.__dict__:
+        # Still deferred, so the save left it alone
+        return
+    value = instance.__dict__[field]
+    new = counter_for(instance, value)
+    old = None if created else counter_for(instance, instance._counted_value)
+    if old != new:
+        add(old, -1)
+        add(new, 1)
+    instance._counted_value = value
+
+
+def deleted(instance):
+    label = instance._meta.label_lower
+    if label in COUNTED_MODELS:
+        add(COUNTED_MODELS[label], -1)
+    else:
+        field, _ = COUNTED_FIELDS[label]
+        add(counter_for(instance, getattr(instance, field)), -1)
+
+
+def recount():
+    """Every counter's true value, from the source tables."""
+    UserProfile = apps.get_model('accounts', 'UserProfile')
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Prescription = apps.get_model('prescriptions', 'Prescription')
+    MedicalRecord = apps.get_model('medical_records', 'MedicalRecord')
+    MedicalReport = apps.get_model('medical_records', 'MedicalReport')
+
+    values = {}
+    for model, (field, prefix) in ((UserProfile, COUNTED_FIELDS['accounts.userprofile']),
+                                   (Appointment, COUNTED_FIELDS['appointments.appointment'])):
+        choices = model._meta.get_field(field).choices
+        values.update({f'{prefix}.{value}': 0 for value, _ in choices})
+        for value, total in model.objects.order_by().values_list(field).annotate(total=Count('pk')):
+            values[f'{prefix}.{value}'] = total
+    values['prescriptions.active'] = Prescription.objects.filter(is_active=True).count()
+    values['records'] = MedicalRecord.objects.count()
+    values['reports'] = MedicalReport.objects.count()
+    return values
+
+
+def rebuild():
+    with transaction.atomic():
+        values = recount()
+        StatCounter.objects.exclude(name__in=values).delete()
+        StatCounter.objects.bulk_create(
+            [StatCounter(name=name, value=value) for name, value in values.items()],
+            update_conflicts=True, unique_fields=['name'], update_fields=['value'],
+        )
+    return values
+
+
+def get_counters():
+    counters = dict(StatCounter.objects.values_list('name', 'value'))
+    return counters or rebuild()
+
+
+def _grouped(counters, prefix):
+    return {name[len(prefix) + 1:]: value for name, value in counters.items() if name.startswith(f'{prefix}.')}
+
+
+def admin_dashboard_context():
+    """Template context for ``accounts/admin_dashboard.html``; one query."""
+    counters = get_counters()
+    users = _grouped(counters, 'users')
+    appointments = _grouped(counters, 'appointments')
+    Appointment = apps.get_model('appointments', 'Appointment')
+    statuses = Appointment._meta.get_field('status').choices
+    return {
+        'users_count': sum(users.values()),
+        'patients_count': users.get('patient', 0),
+        'doctors_count': users.get('doctor', 0),
+        'admins_count': users.get('admin', 0),
+        'records_count': counters.get('records', 0),
+        'reports_count': counters.get('reports', 0),
+        'active_prescriptions_count': counters.get('prescriptions.active', 0),
+        'appointments_count': sum(appointments.values()),
+        'appointments_by_status': [
+            (status, label, appointments.get(status, 0)) for status, label in statuses
+        ],
+    }
@@ -0,0 +1,344 @@
+"""
+Deterministic synthetic data for load testing.
+
+``generate()`` creates patients, doctors (with specializations), admins,
+records, reports backed by real PDF and PNG files (stored as ``ReportBlob``
+rows, like uploads, with their reference counts set), prescriptions with
+reminders and appointments. Everything is drawn from one ``random.Random``
+seeded by the caller and dated relative to an anchor day, so the same seed,
+anchor and counts always produce the same data set.
+
+Rows are written with ``bulk_create`` a batch of patients at a time, which
+bypasses the model signals: reminder fire times are computed per batch and
+the search index, counters and specialization catalog are rebuilt once at
+the end.
+"""
+import hashlib
+import io
+import random
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import ADMIN, DOCTOR, PATIENT, DoctorProfile, UserProfile
+from .models import MedicalRecord, MedicalReport, ReportBlob
+from . import blobs, search, stats
+
+DEFAULT_COUNTS = {
+    'patients': 200,
+    'doctors': 20,
+    'admins': 2,
+    'records_per_patient': 10,
+    'reports_per_record': 1,
+    'prescriptions_per_record': 1,
+    'reminders_per_prescription': 2,
+    'appointments_per_patient': 5,
+}
+DEFAULT_PASSWORD = 'password'
+PATIENT_BATCH = 50
+HISTORY_DAYS = 10 * 365
+
+FIRST_NAMES = (
+    'Amara', 'Bilal', 'Chen', 'Dana', 'Elif', 'Farah', 'Goran', 'Hana', 'Ivan', 'Jia',
+    'Kofi', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sami', 'Tara',
+)
+LAST_NAMES = (
+    'Ahmed', 'Berg', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen',
+    'Khan', 'Lopez', 'Moreau', 'Novak', 'Okafor', 'Patel', 'Rossi', 'Silva', 'Tanaka', 'Weber',
+)
+SPECIALIZATIONS = (
+    'Cardiology', 'Dermatology', 'Endocrinology', 'Gastroenterology', 'General Practice',
+    'Neurology', 'Oncology', 'Orthopedics', 'Pediatrics', 'Psychiatry', 'Pulmonology', 'Radiology',
+)
+DIAGNOSES = (
+    'Hypertension', 'Type 2 diabetes', 'Asthma', 'Migraine', 'Seasonal allergies', 'Lower back pain',
+    'Hypothyroidism', 'Atrial fibrillation', 'Eczema', 'Gastritis', 'Anxiety disorder', 'Osteoarthritis',
+    'Bronchitis', 'Iron deficiency anemia', 'Urinary tract infection', 'Sinusitis',
+)
+MEDICATIONS = (
+    ('Lisinopril', '10 mg'), ('Metformin', '500 mg'), ('Salbutamol', '100 mcg'), ('Sumatriptan', '50 mg'),
+    ('Cetirizine', '10 mg'), ('Ibuprofen', '400 mg'), ('Levothyroxine', '75 mcg'), ('Apixaban', '5 mg'),
+    ('Hydrocortisone cream', '1%'), ('Omeprazole', '20 mg'), ('Sertraline', '50 mg'), ('Amoxicillin', '500 mg'),
+)
+FREQUENCIES = ('once_daily', 'twice_daily', 'thrice_daily', 'four_times_daily', 'as_needed')
+REPORT_TYPES = (('Blood Test', 'pdf'), ('X-ray', 'png'), ('MRI', 'png'), ('ECG', 'pdf'), ('Lab Panel', 'pdf'))
+REMINDER_TIMES = (time(7), time(8), time(12), time(13), time(18), time(20), time(22))
+
+
+def _pdf(rng, title, size):
+    """A one-page PDF of roughly ``size`` bytes (the excess is an unused binary stream)."""
+    text = title.replace('\\', '').replace('(', '').replace(')', '')
+    content = f'BT /F1 18 Tf 72 720 Td ({text}) Tj ET'.encode()
+    padding = rng.randbytes(max(0, size - 600))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(padding), padding),
+    ]
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b'%010d 00000 n \n' % offset)
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def _png(rng, size):
+    """A greyscale noise image whose PNG is roughly ``size`` bytes."""
+    from PIL import Image
+
+    side = max(16, int(size ** 0.5))
+    image = Image.frombytes('L', (side, side), rng.randbytes(side * side))
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def _name(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _moment(anchor, days_ago, rng):
+    day = anchor - timedelta(days=days_ago)
+    return timezone.make_aware(datetime.combine(day, time(rng.randrange(8, 18), rng.randrange(0, 60))))
+
+
+def _create_users(prefix, role, count, rng, password):
+    users = []
+    for i in range(count):
+        first_name, last_name = _name(rng)
+        username = f'{prefix}-{role}-{i:05d}'
+        users.append(User(
+            username=username, first_name=first_name, last_name=last_name,
+            email=f'{username}@example.com', password=password,
+        ))
+    users = User.objects.bulk_create(users)
+    UserProfile.objects.bulk_create([
+        UserProfile(user=user, role=role, phone_number=f'555-{rng.randrange(10 ** 7):07d}')
+        for user in users
+    ])
+    return users
+
+
+def _appointment_slots(doctor_ids, anchor, per_doctor):
+    """Per doctor, a generator of free (day, time) slots spread around the anchor day."""
+    from appointments.availability import get_schedule, slot_grid
+
+    # Several times the slots needed, starting a while before the anchor, so
+    # bookings can skip slots and still land both in the past and the future
+    days = max(28, per_doctor // 4)
+    first_day = anchor - timedelta(days=days // 2)
+    return {doctor_id: slot_grid(get_schedule(doctor_id), first_day, days * 2) for doctor_id in doctor_ids}
+
+
+def _store_blobs(files):
+    """
+    ``{sha256: ReportBlob}`` for ``files`` (``{sha256: (data, filename,
+    content type)}``), writing only the contents not stored yet.
+    """
+    stored = {blob.sha256: blob for blob in ReportBlob.objects.filter(sha256__in=files)}
+    new = []
+    for sha256, (data, filename, content_type) in files.items():
+        if sha256 in stored:
+            continue
+        name = blobs.blob_name(sha256, filename)
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(data))
+        new.append(ReportBlob(sha256=sha256, file=name, size=len(data), content_type=content_type))
+    stored.update((blob.sha256, blob) for blob in ReportBlob.objects.bulk_create(new))
+    return stored
+
+
+def _count_references(blob_ids):
+    """Set ``ref_count`` from the reports, which ``bulk_create`` did not count."""
+    references = MedicalReport.objects.filter(blob=OuterRef('pk')).order_by().values('blob').annotate(
+        total=Count('pk')).values('total')
+    ReportBlob.objects.filter(pk__in=blob_ids).update(
+        ref_count=Coalesce(Subquery(references, output_field=IntegerField()), 0),
+    )
+
+
+def _set_historic(model, instances, fields):
+    """Put back timestamps that auto_now_add overwrote in bulk_create."""
+    model.objects.bulk_update(instances, fields, batch_size=500)
+
+
+def generate(seed=0, prefix='synth', anchor=None, report_size=32 * 1024, password=DEFAULT_PASSWORD,
+             log=None, **counts):
+    """
+    Create a synthetic data set and return ``{what: count}``.
+
+    ``counts`` overrides ``DEFAULT_COUNTS``; usernames start with ``prefix``.
+    """
+    from appointments import catalog
+    from appointments.models import Appointment
+    from prescriptions.models import MedicationReminder, Prescription
+    from prescriptions.scheduler import reschedule
+
+    counts = {**DEFAULT_COUNTS, **counts}
+    rng = random.Random(seed)
+    anchor = anchor or timezone.localdate()
+    log = log or (lambda message: None)
+    hashed = make_password(password, salt=hashlib.sha256(f'{prefix}:{seed}'.encode()).hexdigest()[:22])
+    created = dict.fromkeys(('users', 'records', 'reports', 'prescriptions', 'reminders', 'appointments'), 0)
+
+    with transaction.atomic():
+        doctors = _create_users(prefix, DOCTOR, counts['doctors'], rng, hashed)
+        specializations = {doctor.pk: rng.choice(SPECIALIZATIONS) for doctor in doctors}
+        DoctorProfile.objects.bulk_create([
+            DoctorProfile(
+                user=doctor,
+                specialization=specializations[doctor.pk],
+                license_number=f'{prefix.upper()}-{i:06d}',
+                years_of_experience=rng.randrange(1, 35),
+                consultation_fee=rng.randrange(40, 250),
+            )
+            for i, doctor in enumerate(doctors)
+        ])
+        admins = _create_users(prefix, ADMIN, counts['admins'], rng, hashed)
+        patients = _create_users(prefix, PATIENT, counts['patients'], rng, hashed)
+        created['users'] = len(doctors) + len(admins) + len(patients)
+    log(f'{created["users"]} users')
+    if not doctors:
+        return created
+
+    slots = _appointment_slots(
+        [doctor.pk for doctor in doctors], anchor,
+        counts['appointments_per_patient'] * max(1, len(patients)) // len(doctors) + 1,
+    )
+    report_number = 0
+    for first in range(0, len(patients), PATIENT_BATCH):
+        batch = patients[first:first + PATIENT_BATCH]
+        with transaction.atomic():
+            records, record_dates = [], []
+            for patient in batch:
+                doctor = rng.choice(doctors)
+                for _ in range(counts['records_per_patient']):
+                    diagnosis = rng.choice(DIAGNOSES)
+                    records.append(MedicalRecord(
+                        patient=patient, doctor=doctor if rng.random() < 0.8 else rng.choice(doctors),
+                        diagnosis=diagnosis,
+                        description=f'{diagnosis} followed up at visit {rng.randrange(1, 20)}; '
+                                    f'{rng.choice(("stable", "improving", "needs review", "referred"))}.',
+                    ))
+                    record_dates.append(_moment(anchor, rng.randrange(HISTORY_DAYS), rng))
+            records = MedicalRecord.objects.bulk_create(records)
+            for record, created_at in zip(records, record_dates):
+                record.date_created = created_at
+            _set_historic(MedicalRecord, records, ['date_created'])
+
+            reports, prescriptions, files = [], [], {}
+            for record in records:
+                for _ in range(counts['reports_per_record']):
+                    report_type, extension = rng.choice(REPORT_TYPES)
+                    title = f'{report_type} - {record.diagnosis}'
+                    data = _pdf(rng, title, report_size) if extension == 'pdf' else _png(rng, report_size)
+                    report_number += 1
+                    filename = f'{report_type.lower().replace(" ", "-")}-{report_number}.{extension}'
+                    sha256 = hashlib.sha256(data).hexdigest()
+                    files[sha256] = (data, filename, 'application/pdf' if extension == 'pdf' else 'image/png')
+                    reports.append(MedicalReport(
+                        medical_record=record, title=title, report_type=report_type,
+                        date=record.date_created.date(), uploaded_by_id=record.doctor_id or record.patient_id,
+                        original_filename=filename, sha256=sha256,
+                    ))
+                for _ in range(counts['prescriptions_per_record']):
+                    medication, dosage = rng.choice(MEDICATIONS)
+                    start_date = record.date_created.date()
+                    ongoing = rng.random() < 0.3
+                    prescriptions.append(Prescription(
+                        patient_id=record.patient_id, doctor_id=record.doctor_id, medical_record=record,
+                        medication_name=medication, dosage=dosage, frequency=rng.choice(FREQUENCIES),
+                        start_date=start_date,
+                        end_date=None if ongoing else start_date + timedelta(days=rng.randrange(5, 90)),
+                        is_active=ongoing or rng.random() < 0.1,
+                        instructions=rng.choice(('Take with food.', 'Take before bed.', 'Avoid alcohol.', 'As directed.')),
+                    ))
+            stored = _store_blobs(files)
+            for report in reports:
+                blob = stored[report.sha256]
+                report.blob = blob
+                report.report_file = blob.file.name
+                report.file_size = blob.size
+                report.content_type = blob.content_type
+            MedicalReport.objects.bulk_create(reports)
+            _count_references([blob.pk for blob in stored.values()])
+            prescriptions = Prescription.objects.bulk_create(prescriptions)
+            for prescription in prescriptions:
+                prescription.date_created = prescription.medical_record.date_created
+            _set_historic(Prescription, prescriptions, ['date_created'])
+
+            reminders = MedicationReminder.objects.bulk_create([
+                MedicationReminder(prescription=prescription, reminder_time=reminder_time, is_active=prescription.is_active)
+                for prescription in prescriptions
+                for reminder_time in sorted(rng.sample(REMINDER_TIMES, min(counts['reminders_per_prescription'], len(REMINDER_TIMES))))
+            ])
+            reschedule(MedicationReminder.objects.filter(pk__in=[reminder.pk for reminder in reminders])
+                       .select_related('prescription'))
+
+            appointments = []
+            for patient in batch:
+                for _ in range(counts['appointments_per_patient']):
+                    doctor = rng.choice(doctors)
+                    # Skip a few slots so bookings spread out instead of filling every slot
+                    slot = next(islice(slots[doctor.pk], rng.randrange(3), None), None)
+                    if slot is None:
+                        continue
+                    past = slot.date() < anchor
+                    appointments.append(Appointment(
+                        patient=patient, doctor=doctor, specialization=specializations[doctor.pk],
+                        appointment_date=slot.date(), appointment_time=slot.time(),
+                        reason=rng.choice(('Follow-up', 'Check-up', 'New symptoms', 'Test results', 'Prescription review')),
+                        status=rng.choice(('completed', 'completed', 'cancelled') if past else ('pending', 'approved')),
+                    ))
+            Appointment.objects.bulk_create(appointments)
+
+        created['records'] += len(records)
+        created['reports'] += len(reports)
+        created['prescriptions'] += len(prescriptions)
+        created['reminders'] += len(reminders)
+        created['appointments'] += len(appointments)
+        log(f'{first + len(batch)}/{len(patients)} patients')
+
+    with transaction.atomic():
+        search.rebuild()
+        stats.rebuild()
+    catalog.invalidate()
+    return created
+
+
+def delete(prefix='synth'):
+    """Remove the users of a synthetic data set (and, by cascade, all their rows) and its files."""
+    from appointments import catalog
+
+    users = User.objects.filter(username__startswith=f'{prefix}-')
+    # Blobs are released by the reports' delete signals; only files of data
+    # sets generated before reports were stored as blobs go here
+    names = list(MedicalReport.objects.filter(medical_record__patient__in=users, blob=None)
+                 .values_list('report_file', flat=True))
+    with transaction.atomic():
+        count, _ = users.delete()
+        search.rebuild()
+        stats.rebuild()
+    for name in names:
+        default_storage.delete(name)
+    catalog.invalidate()
+    return count
@@ -0,0 +1,17 @@
+from django import template
+
+from medical_records import dashboard, stats
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def patient_dashboard(context):
+    """``{% patient_dashboard as dashboard %}`` - the signed-in patient's snapshot."""
+    return dashboard.patient_dashboard_context(context['user'])
+
+
+@register.simple_tag
+def admin_counters():
+    """``{% admin_counters as counters %}`` - the site-wide totals."""
+    return stats.admin_dashboard_context()
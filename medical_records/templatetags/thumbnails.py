@@ -0,0 +1,17 @@
+from django import template
+
+from medical_records.derivatives import derivative_url
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(field_file, preset):
+    """``{{ profile.profile_picture|thumbnail:"avatar" }}`` - WebP variant URL (avatars only)."""
+    return derivative_url(field_file, preset, 'webp')
+
+
+@register.filter
+def thumbnail_jpeg(field_file, preset):
+    """JPEG variant URL, for ``<img>`` fallbacks next to a WebP ``<source>``."""
+    return derivative_url(field_file, preset, 'jpeg')
@@ -1,3 +1,1267 @@
+"""
+These tests, and the prescriptions and appointments tests built on the
+helpers here, need the ``accounts`` app and ``appointments.models``, which
+this tree does not include: ``create_user`` builds profiles through
+``accounts.models`` and ``build_history`` books appointments. Run them in a
+checkout that has both (they are in INSTALLED_APPS and the URLconf).
+"""
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from collections import Counter, defaultdict
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db import connection
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserProfile, DoctorProfile, PATIENT, DOCTOR, ADMIN
+from .models import MedicalRecord, MedicalReport, ReportBlob, ReportUpload
+from .access import records_for, reports_for
+from . import search, stats
+from .api import RESOURCES
+from . import benchmark, blobs, bundles, dashboard, derivatives, export, synthetic
+from instrumentation import slowlog
+
+FULL_SCAN_RE = re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)(?!.*\bUSING\b)')
+
+
+def create_user(username, role, specialization=None):
+    user = User.objects.create_user(username=username, password='password')
+    UserProfile.objects.update_or_create(user=user, defaults={'role': role})
+    if specialization:
+        DoctorProfile.objects.update_or_create(user=user, defaults={
+            'specialization': specialization,
+            'license_number': f'LIC-{username}',
+            'years_of_experience': 5,
+            'consultation_fee': 50,
+        })
+    return user
+
+
+class QueryPlanMixin:
+    """Assertions on SQLite's EXPLAIN QUERY PLAN output."""
+
+    def explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertNoFullScan(self, sql, params=()):
+        plan = self.explain(sql, params)
+        scans = [line for line in plan if FULL_SCAN_RE.search(line)]
+        self.assertFalse(scans, f'Full table scan in plan for:\n{sql}\n' + '\n'.join(plan))
+
+    def assertQuerysetUsesIndex(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        self.assertNoFullScan(sql, params)
+
+    def assertViewUsesIndexes(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in ctx.captured_queries:
+            if query['sql'].lstrip().upper().startswith('SELECT'):
+                self.assertNoFullScan(query['sql'])
+        return response
+
+
+def build_history(patient, doctor, count, start=0):
+    """
+    ``count`` records for ``patient``, each with a report, a prescription with
+    two reminders and an appointment; numbering continues from ``start``.
+    """
+    from appointments.models import Appointment
+    from prescriptions.models import MedicationReminder, Prescription
+
+    today = datetime.date.today()
+    records = MedicalRecord.objects.bulk_create([
+        MedicalRecord(patient=patient, doctor=doctor, diagnosis=f'Diagnosis {i}', description='Description')
+        for i in range(start, start + count)
+    ])
+    MedicalReport.objects.bulk_create([
+        MedicalReport(
+            medical_record=record, title='Blood test', report_type='Blood Test', date=today,
+            report_file='medical_reports/test.pdf', uploaded_by=doctor,
+        )
+        for record in records
+    ])
+    prescriptions = Prescription.objects.bulk_create([
+        Prescription(
+            patient=patient, doctor=doctor, medical_record=record, start_date=today,
+            end_date=None if i % 2 else today - datetime.timedelta(days=1),
+            medication_name=f'Medication {i}', dosage='10mg', frequency='once_daily', instructions='With food',
+        )
+        for i, record in enumerate(records, start)
+    ])
+    MedicationReminder.objects.bulk_create([
+        MedicationReminder(prescription=prescription, reminder_time=datetime.time(hour, 0))
+        for prescription in prescriptions
+        for hour in (8, 20)
+    ])
+    Appointment.objects.bulk_create([
+        Appointment(
+            patient=patient, doctor=doctor, appointment_date=today + datetime.timedelta(days=i - 5),
+            appointment_time=datetime.time(9, 0), reason='Checkup',
+        )
+        for i in range(start, start + count)
+    ])
+    # bulk_create skips the signals that maintain these
+    search.rebuild()
+    stats.rebuild()
+
+
+class QueryRecorder:
+    """Records every query run while active, with the call site that ran it."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # No project frame between the test and the query: middleware or auth
+        site = slowlog.call_site(sys._getframe(1), stop_at=__file__)
+        self.queries.append((sql, site or 'framework'))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def duplicates(self):
+        """Queries run more than once, most repeated first, with where they ran from."""
+        sites = defaultdict(Counter)
+        for sql, site in self.queries:
+            sites[sql][site] += 1
+        lines = []
+        for sql, counter in sorted(sites.items(), key=lambda item: -sum(item[1].values())):
+            total = sum(counter.values())
+            if total < 2:
+                continue
+            lines.append(f'{total}x {sql[:500]}')
+            lines.extend(f'    {count}x at {site}' for site, count in counter.most_common())
+        return '\n'.join(lines) or '(no repeated statements)'
+
+
+class QueryBudgetMixin:
+    """
+    Renders views at two data sizes and checks their query counts stay
+    within a declared budget and do not grow with the data.
+
+    Subclasses set ``budgets`` (route name -> maximum queries, including the
+    session and user lookups), ``statuses`` for routes that do not answer
+    200, and implement ``grow(count, start)`` to add rows and
+    ``request_for(name)`` to return ``(user, url)``.
+    """
+    SIZES = (10, 1000)
+    budgets = {}
+    statuses = {}
+
+    def grow(self, count, start):
+        raise NotImplementedError
+
+    def request_for(self, name):
+        raise NotImplementedError
+
+    def record_view(self, name):
+        user, url = self.request_for(name)
+        self.client.force_login(user)
+        with QueryRecorder() as recorder:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        # A redirect or error page would be counted in place of the view
+        self.assertEqual(response.status_code, self.statuses.get(name, 200), url)
+        return recorder
+
+    def test_query_counts_do_not_grow_with_data(self):
+        recorded = {}
+        rows = 0
+        for size in self.SIZES:
+            self.grow(size - rows, rows)
+            rows = size
+            for name in self.budgets:
+                recorded[name, size] = self.record_view(name)
+
+        small, large = self.SIZES[0], self.SIZES[-1]
+        for name, budget in self.budgets.items():
+            with self.subTest(view=name):
+                before, after = recorded[name, small], recorded[name, large]
+                self.assertLessEqual(
+                    len(after), len(before),
+                    f'{name}: {len(before)} queries with {small} rows, {len(after)} with {large}\n'
+                    + after.duplicates(),
+                )
+                self.assertLessEqual(
+                    len(after), budget,
+                    f'{name}: {len(after)} queries, budget {budget}\n' + after.duplicates(),
+                )
+
+
+class MedicalRecordQueryBudgetTests(QueryBudgetMixin, TestCase):
+    budgets = {
+        'medical_record_list': 4,
+        'medical_record_detail': 6,
+        'medical_record_create': 4,
+        'medical_record_update': 5,
+        'medical_report_create': 4,
+        'medical_report_detail': 4,
+        'search': 4,
+        'medical_record_export': 8,
+        'medical_record_bundle': 5,
+        'patient_report_bundle': 5,
+        'user_directory': 4,
+        'api_resource_list': 4,
+        # accounts views, backed by medical_records.dashboard and .stats
+        'patient_dashboard': 7,
+        'doctor_dashboard': 8,
+        'admin_dashboard': 4,
+        'profile': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.admin = create_user('admin', ADMIN)
+
+    def grow(self, count, start):
+        build_history(self.patient, self.doctor, count, start)
+        # More accounts for the user directory; no passwords, hashing is slow
+        members = User.objects.bulk_create([User(username=f'member{i}') for i in range(start, start + count)])
+        UserProfile.objects.bulk_create([UserProfile(user=member, role=PATIENT) for member in members])
+
+    def request_for(self, name):
+        record = MedicalRecord.objects.filter(patient=self.patient).order_by('pk').first()
+        report = record.reports.first()
+        return {
+            'medical_record_list': (self.patient, reverse('medical_record_list')),
+            'medical_record_detail': (self.doctor, reverse('medical_record_detail', args=[record.pk])),
+            'medical_record_create': (self.doctor, reverse('medical_record_create')),
+            'medical_record_update': (self.doctor, reverse('medical_record_update', args=[record.pk])),
+            'medical_report_create': (self.doctor, reverse('medical_report_create', args=[record.pk])),
+            'medical_report_detail': (self.patient, reverse('medical_report_detail', args=[report.pk])),
+            'search': (self.patient, reverse('search') + '?q=diagnosis'),
+            'medical_record_export': (self.patient, reverse('medical_record_export') + '?format=ndjson'),
+            'medical_record_bundle': (self.patient, reverse('medical_record_bundle', args=[record.pk])),
+            'patient_report_bundle': (self.doctor, reverse('patient_report_bundle', args=[self.patient.pk])),
+            'user_directory': (self.admin, reverse('user_directory')),
+            'api_resource_list': (self.patient, reverse('api_resource_list', args=['prescriptions'])),
+            'patient_dashboard': (self.patient, reverse('patient_dashboard')),
+            'doctor_dashboard': (self.doctor, reverse('doctor_dashboard')),
+            'admin_dashboard': (self.admin, reverse('admin_dashboard')),
+            'profile': (self.patient, reverse('profile')),
+        }[name]
+
+
+class MedicalRecordQueryPlanTests(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.admin = create_user('admin', ADMIN)
+        for i in range(30):
+            record = MedicalRecord.objects.create(
+                patient=cls.patient, doctor=cls.doctor,
+                diagnosis=f'Diagnosis {i}', description='Description',
+            )
+            MedicalReport.objects.create(
+                medical_record=record, title='Blood test', report_type='Blood Test',
+                date=datetime.date(2025, 1, 1), report_file='medical_reports/test.pdf',
+                uploaded_by=cls.doctor,
+            )
+
+    def test_record_list_uses_indexes_for_every_role(self):
+        for user in (self.patient, self.doctor, self.admin):
+            with self.subTest(role=user.profile.role):
+                self.client.force_login(user)
+                response = self.assertViewUsesIndexes(reverse('medical_record_list'))
+                next_cursor = response.context['page'].next_cursor
+                self.assertViewUsesIndexes(reverse('medical_record_list') + f'?cursor={next_cursor}')
+
+    def test_page_links_keep_the_page_size(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('medical_record_list') + '?page_size=7')
+        page = response.context['page']
+        self.assertEqual(len(page), 7)
+        self.assertContains(response, f'?cursor={page.next_cursor}&page_size=7')
+
+    def test_record_detail_uses_indexes(self):
+        record = MedicalRecord.objects.first()
+        self.client.force_login(self.doctor)
+        self.assertViewUsesIndexes(reverse('medical_record_detail', args=[record.id]))
+
+
+class AccessScopeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Neurology')
+        cls.admin = create_user('admin', ADMIN)
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Fracture', description='Description',
+        )
+        cls.other_record = MedicalRecord.objects.create(
+            patient=cls.other_patient, doctor=cls.other_doctor, diagnosis='Migraine', description='Description',
+        )
+        cls.report = MedicalReport.objects.create(
+            medical_record=cls.record, title='X-ray', report_type='X-ray', date=datetime.date(2025, 1, 1),
+            report_file='medical_reports/test.pdf', uploaded_by=cls.doctor,
+        )
+
+    def test_querysets_follow_the_role(self):
+        for user, records in (
+            (self.patient, [self.record]),
+            (self.doctor, [self.record]),
+            (self.other_patient, [self.other_record]),
+            (self.other_doctor, [self.other_record]),
+            (self.admin, [self.record, self.other_record]),
+        ):
+            with self.subTest(user=user.username):
+                self.assertEqual(list(records_for(user).order_by('pk')), records)
+                self.assertEqual(
+                    list(reports_for(user)), [self.report] if self.record in records else [],
+                )
+
+    def test_other_peoples_rows_are_not_found(self):
+        urls = [
+            reverse('medical_record_detail', args=[self.record.pk]),
+            reverse('medical_report_detail', args=[self.report.pk]),
+            reverse('report_download', args=[self.report.pk]),
+            reverse('report_view', args=[self.report.pk]),
+            reverse('medical_report_create', args=[self.record.pk]),
+        ]
+        for user in (self.other_patient, self.other_doctor):
+            self.client.force_login(user)
+            for url in urls:
+                with self.subTest(user=user.username, url=url):
+                    self.assertEqual(self.client.get(url).status_code, 404)
+            response = self.client.post(
+                reverse('report_upload_start', args=[self.record.pk]), {'filename': 'scan.pdf', 'size': 10},
+            )
+            self.assertEqual(response.status_code, 404)
+        self.client.force_login(self.other_doctor)
+        self.assertEqual(self.client.get(reverse('medical_record_update', args=[self.record.pk])).status_code, 404)
+
+        for user in (self.patient, self.doctor, self.admin):
+            self.client.force_login(user)
+            for url in urls[:2]:
+                with self.subTest(user=user.username, url=url):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_patients_cannot_edit_records(self):
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(reverse('medical_record_update', args=[self.record.pk])).status_code, 403)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from prescriptions.models import Prescription
+
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Endocrinology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Cardiology')
+        cls.admin = create_user('admin', ADMIN)
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor,
+            diagnosis='Type 2 diabetes', description='Elevated <b>glucose</b> levels',
+        )
+        cls.other_record = MedicalRecord.objects.create(
+            patient=cls.other_patient, doctor=cls.other_doctor,
+            diagnosis='Hypertension', description='Diabetic history in the family',
+        )
+        cls.prescription = Prescription.objects.create(
+            patient=cls.patient, doctor=cls.doctor, medical_record=cls.record, start_date=datetime.date(2025, 1, 1),
+            medication_name='Metformin', dosage='500mg', frequency='twice_daily', instructions='With meals for diabetes',
+        )
+        cls.report = MedicalReport.objects.create(
+            medical_record=cls.record, title='HbA1c panel', report_type='Blood Test', date=datetime.date(2025, 1, 1),
+            report_file='medical_reports/test.pdf', uploaded_by=cls.doctor, notes='Diabetes control',
+        )
+
+    def hits(self, user, query, **kwargs):
+        return sorted((hit.kind, hit.object_id) for hit in search.search(user, query, **kwargs))
+
+    def test_results_are_scoped_to_the_user(self):
+        mine = [('prescription', self.prescription.pk), ('record', self.record.pk), ('report', self.report.pk)]
+        self.assertEqual(self.hits(self.patient, 'diabet'), mine)
+        self.assertEqual(self.hits(self.doctor, 'diabet'), mine)
+        self.assertEqual(self.hits(self.other_patient, 'diabet'), [('record', self.other_record.pk)])
+        self.assertEqual(self.hits(self.other_doctor, 'metformin'), [])
+        self.assertEqual(len(self.hits(self.admin, 'diabet')), 4)
+        self.assertEqual(self.hits(self.patient, 'diabetes', kinds=['report']), [('report', self.report.pk)])
+
+    def test_scope_tokens_and_syntax_are_not_searchable(self):
+        for query in (f'p{self.patient.pk}', f'd{self.doctor.pk}', 'record', 'prescription'):
+            with self.subTest(query=query):
+                self.assertEqual(self.hits(self.admin, query), [])
+        self.assertEqual(search.build_match('" OR * NEAR('), '{title body} : ("OR" "NEAR"*)')
+        self.assertEqual(self.hits(self.admin, '" OR * NEAR('), [])
+        self.assertEqual(search.search(self.patient, '   '), [])
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(search.search(self.patient, 'diabetes')[0].kind, 'record')
+
+    def test_index_follows_edits_and_deletes(self):
+        self.record.doctor = self.other_doctor
+        self.record.save()
+        self.assertEqual(self.hits(self.other_doctor, 'hba1c'), [('report', self.report.pk)])
+        self.assertEqual(self.hits(self.doctor, 'hba1c'), [])
+        self.report.delete()
+        self.assertEqual(self.hits(self.admin, 'hba1c'), [])
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(self.hits(self.other_doctor, 'diabetes'), sorted([
+            ('record', self.other_record.pk), ('record', self.record.pk),
+        ]))
+
+    def test_view_escapes_and_pages(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('search'), {'q': 'glucose'})
+        self.assertContains(response, '<mark>glucose</mark>')
+        self.assertContains(response, '&lt;b&gt;')
+        response = self.client.get(reverse('search'), {'q': 'diabetes', 'page_size': 1})
+        self.assertEqual(len(response.context['hits']), 1)
+        self.assertTrue(response.context['has_next'])
+        self.assertContains(response, '&page_size=1&page=2')
+
+
+class ReportDeliveryTests(TestCase):
+    BODY = bytes(range(100))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Fracture', description='Description',
+        )
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.report = MedicalReport.objects.create(
+            medical_record=self.record, title='X-ray', report_type='X-ray', date=datetime.date(2025, 1, 1),
+            report_file=ContentFile(self.BODY, name='scan.bin'), uploaded_by=self.doctor,
+        )
+        self.url = reverse('report_view', args=[self.report.pk])
+        self.client.force_login(self.patient)
+
+    def test_serves_the_whole_file_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.BODY)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        download = self.client.get(reverse('report_download', args=[self.report.pk]))
+        self.assertTrue(download['Content-Disposition'].startswith('attachment'))
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), self.BODY[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+        self.assertEqual(b''.join(response.streaming_content), self.BODY[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+        # Multi-range and stale If-Range requests get the whole file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+        MedicalReport.objects.filter(pk=self.report.pk).update(sha256='ab' * 32, file_size=len(self.BODY))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], f'"{"ab" * 32}"')
+
+    def test_a_missing_file_is_not_found(self):
+        MedicalReport.objects.filter(pk=self.report.pk).update(sha256='ab' * 32, file_size=len(self.BODY))
+        os.remove(self.report.report_file.path)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=10-19').status_code, 404)
+
+    def test_offloads_to_the_front_end_server(self):
+        with self.settings(REPORT_FILE_DELIVERY='x-accel-redirect', REPORT_FILE_ACCEL_PREFIX='/protected/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.report.report_file.name}')
+        self.assertEqual(response.content, b'')
+
+        with self.settings(REPORT_FILE_DELIVERY='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.report.report_file.path)
+        self.assertEqual(response.content, b'')
+
+        # Validators are still checked before handing off
+        with self.settings(REPORT_FILE_DELIVERY='x-sendfile'):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ReportPreviewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other = create_user('other', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Fracture', description='Description',
+        )
+
+    def setUp(self):
+        from PIL import Image
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        image = io.BytesIO()
+        Image.new('RGB', (2000, 1500), 'white').save(image, 'PNG')
+        self.report = MedicalReport.objects.create(
+            medical_record=self.record, title='X-ray', report_type='X-ray', date=datetime.date(2025, 1, 1),
+            report_file=ContentFile(image.getvalue(), name='xray.png'), uploaded_by=self.doctor,
+        )
+        self.url = reverse('report_view', args=[self.report.pk])
+
+    def wait_for_renders(self):
+        if derivatives._pool is not None:
+            derivatives._pool.shutdown(wait=True)
+            derivatives._pool = None
+
+    def test_previews_are_served_only_through_the_report_view(self):
+        self.client.force_login(self.patient)
+        page = self.client.get(reverse('medical_report_detail', args=[self.report.pk]))
+        self.assertContains(page, f'{self.url}?variant=preview&amp;format=webp')
+        self.assertNotContains(page, settings.MEDIA_URL)
+
+        # The original stands in until the preview has been rendered
+        response = self.client.get(self.url, {'variant': 'preview', 'format': 'jpeg'})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.wait_for_renders()
+        response = self.client.get(self.url, {'variant': 'preview', 'format': 'jpeg'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(self.url, {'variant': 'preview', 'format': 'jpeg'},
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        name = derivatives.rendered_name(self.report.report_file, 'preview', 'jpeg')
+        self.assertTrue(name.startswith(derivatives.PRIVATE_DERIVED_DIR + '/'))
+
+        self.assertEqual(self.client.get(self.url, {'variant': 'avatar'}).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'variant': 'preview', 'format': 'gif'}).status_code, 404)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(self.url, {'variant': 'preview'}).status_code, 404)
+
+    def test_only_avatars_have_public_urls(self):
+        with self.assertRaises(ValueError):
+            derivatives.derivative_url(self.report.report_file, 'preview')
+        self.assertEqual(derivatives.derivative_url(self.report.report_file, 'avatar'), self.report.report_file.url)
+        self.wait_for_renders()
+        url = derivatives.derivative_url(self.report.report_file, 'avatar')
+        self.assertTrue(url.startswith(f'{settings.MEDIA_URL}{derivatives.DERIVED_DIR}/avatar/'))
+
+    def test_schedules_each_derivative_once(self):
+        with mock.patch.object(derivatives, '_get_pool') as pool:
+            derivatives.schedule(self.report.report_file, ['thumbnail'], formats=('webp',))
+            derivatives.schedule(self.report.report_file, ['thumbnail'], formats=('webp',))
+        self.assertEqual(pool.return_value.submit.call_count, 1)
+        self.assertEqual(len(derivatives._pending), 1)
+        done, = pool.return_value.submit.return_value.add_done_callback.call_args.args
+        done(None)
+        self.assertEqual(derivatives._pending, set())
+
+
+class ReportUploadTests(TestCase):
+    DATA = b'%PDF-1.4 ' + bytes(range(256)) * 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Fracture', description='Description',
+        )
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        settings = self.settings(MEDIA_ROOT=media.name, REPORT_UPLOAD_TEMP_DIR=os.path.join(media.name, 'partial'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.doctor)
+
+    def start(self, data):
+        response = self.client.post(
+            reverse('report_upload_start', args=[self.record.pk]), {'filename': 'scan.pdf', 'size': len(data)},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def send(self, url, data, offset):
+        return self.client.patch(url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def submit(self, **data):
+        return self.client.post(reverse('medical_report_create', args=[self.record.pk]), {
+            'title': 'Scan', 'report_type': 'X-ray', 'date': '2025-01-01', **data,
+        })
+
+    def test_chunked_upload_is_stored_once_per_content(self):
+        session = self.start(self.DATA)
+        self.assertEqual(self.send(session['url'], self.DATA[:100000], 0).json()['offset'], 100000)
+        response = self.send(session['url'], self.DATA[:10], 5)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 100000)
+        # A chunk on a worker without the cached digest rebuilds it from the file
+        blobs._hashers.clear()
+        response = self.send(session['url'], self.DATA[100000:], 100000)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(self.DATA).hexdigest())
+
+        self.assertEqual(self.submit(upload_id=session['upload_id']).status_code, 302)
+        self.assertEqual(self.submit(report_file=SimpleUploadedFile('again.pdf', self.DATA)).status_code, 302)
+        blob = ReportBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.content_type, 'application/pdf')
+        self.assertFalse(ReportUpload.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MedicalReport.objects.get(original_filename='again.pdf').delete()
+            self.assertEqual(ReportBlob.objects.get().ref_count, 1)
+            MedicalReport.objects.get().delete()
+        self.assertFalse(ReportBlob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media, blob.file.name)))
+
+    def test_replacing_the_file_moves_the_reference(self):
+        self.submit(report_file=SimpleUploadedFile('first.pdf', self.DATA))
+        report = MedicalReport.objects.get()
+        first = report.blob
+        second = blobs.ingest_file(SimpleUploadedFile('second.pdf', self.DATA[::-1]))
+        blobs.attach(report, second, 'second.pdf')
+        with self.captureOnCommitCallbacks(execute=True):
+            report.save()
+        self.assertEqual(ReportBlob.objects.get(pk=second.pk).ref_count, 1)
+        self.assertFalse(ReportBlob.objects.filter(pk=first.pk).exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media, first.file.name)))
+
+        # Saving again without a change leaves the count alone
+        MedicalReport.objects.get().save()
+        self.assertEqual(ReportBlob.objects.get(pk=second.pk).ref_count, 1)
+
+    def test_losing_the_race_to_store_a_blob_removes_its_file(self):
+        winner = blobs.ingest_file(SimpleUploadedFile('scan.pdf', self.DATA))
+        path = os.path.join(self.media, 'late.part')
+        with open(path, 'wb') as out:
+            out.write(self.DATA)
+        sha256 = hashlib.sha256(self.DATA).hexdigest()
+        # The other request commits between our lookup and our insert
+        with mock.patch.object(ReportBlob.objects, 'filter', return_value=ReportBlob.objects.none()):
+            blob = blobs.commit_blob(path, sha256, len(self.DATA), 'scan.bin')
+        self.assertEqual(blob, winner)
+        self.assertTrue(os.path.exists(os.path.join(self.media, winner.file.name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media, blobs.blob_name(sha256, 'scan.bin'))))
+
+    def test_a_chunk_waits_for_the_claim_on_its_upload(self):
+        session = self.start(self.DATA)
+        ReportUpload.objects.update(claimed_at=timezone.now())
+        response = self.send(session['url'], self.DATA, 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 0)
+        self.assertFalse(os.path.exists(blobs.partial_path(ReportUpload.objects.get())))
+
+        # A claim left by a worker that died is taken over
+        ReportUpload.objects.update(claimed_at=timezone.now() - blobs.CLAIM_TIMEOUT * 2)
+        response = self.send(session['url'], self.DATA, 0)
+        self.assertTrue(response.json()['complete'])
+        self.assertIsNone(ReportUpload.objects.get().claimed_at)
+
+    def test_cleanup_removes_abandoned_uploads(self):
+        partial = self.start(self.DATA)
+        self.send(partial['url'], self.DATA[:1000], 0)
+        finished = self.start(self.DATA)
+        self.send(finished['url'], self.DATA, 0)
+        blob = ReportBlob.objects.get()
+        stray = blobs.temp_dir() / 'ingest-1-2-3.part'
+        stray.write_bytes(b'left over')
+        old = time.time() - 2 * 86400
+        os.utime(stray, (old, old))
+        ReportUpload.objects.update(date_updated=timezone.now() - datetime.timedelta(days=2))
+        fresh = self.start(self.DATA)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('cleanup_uploads', stdout=io.StringIO())
+        self.assertEqual([str(pk) for pk in ReportUpload.objects.values_list('pk', flat=True)], [fresh['upload_id']])
+        self.assertFalse(ReportBlob.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media, blob.file.name)))
+        self.assertEqual(list(blobs.temp_dir().iterdir()), [])
+
+    def test_form_shows_upload_errors(self):
+        response = self.submit(upload_id=self.start(self.DATA)['upload_id'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The file upload has not finished yet.')
+        self.assertNotContains(response, 'Upload id')
+
+
+class PatientDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.patient = create_user('patient', PATIENT)
+        self.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        build_history(self.patient, self.doctor, 3)
+
+    def render(self):
+        template = Template('{% load dashboards %}{% patient_dashboard as dashboard %}'
+                            '{{ dashboard.medical_records_count }}|'
+                            '{% for record in dashboard.medical_records %}{{ record.doctor_name }};{% endfor %}')
+        return template.render(Context({'user': self.patient}))
+
+    def test_template_tag_supplies_the_snapshot(self):
+        self.assertEqual(self.render(), '3|doctor;doctor;doctor;')
+        # Only the live reminders
+        with self.assertNumQueries(1):
+            self.render()
+
+    def test_saving_a_record_rebuilds_its_section(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            MedicalRecord.objects.create(patient=self.patient, doctor=self.doctor, diagnosis='Flu', description='-')
+        self.assertTrue(self.render().startswith('4|'))
+
+    def test_renaming_a_doctor_rebuilds_the_snapshot(self):
+        self.render()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.first_name = 'Ada'
+            self.doctor.save()
+        self.assertEqual(self.render(), '3|Ada;Ada;Ada;')
+
+    def test_logging_in_keeps_the_snapshot(self):
+        self.render()
+        names = cache.get(dashboard.NAMES_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(self.doctor)
+        self.assertEqual(cache.get(dashboard.NAMES_KEY), names)
+
+
+class AdminCounterTests(TestCase):
+
+    def setUp(self):
+        self.patient = create_user('patient', PATIENT)
+        self.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        build_history(self.patient, self.doctor, 4)
+        stats.rebuild()
+
+    def assertCountersTrue(self):
+        self.assertEqual(stats.get_counters(), stats.recount())
+
+    def test_changes_move_counters_without_reading_the_row(self):
+        from appointments.models import Appointment
+        from prescriptions.models import Prescription
+
+        profile = UserProfile.objects.get(user=self.patient)
+        appointment = Appointment.objects.filter(status='pending').first()
+        prescription = Prescription.objects.filter(is_active=True).first()
+        with CaptureQueriesContext(connection) as ctx:
+            profile.role = DOCTOR
+            profile.save()
+            appointment.status = 'approved'
+            appointment.save()
+            prescription.is_active = False
+            prescription.save()
+        # (Deactivating a prescription reschedules its reminders, which reads those)
+        tables = ('"accounts_userprofile"', '"appointments_appointment"', '"prescriptions_prescription"')
+        self.assertFalse([query['sql'] for query in ctx.captured_queries
+                          if query['sql'].lstrip().upper().startswith('SELECT')
+                          and query['sql'].split(' FROM ')[1].startswith(tables)])
+        self.assertCountersTrue()
+
+    def test_deferred_and_created_rows(self):
+        from appointments.models import Appointment
+
+        appointment = Appointment.objects.only('pk').filter(status='pending').first()
+        appointment.status = 'cancelled'
+        appointment.save()
+        # Saving again from the same instance moves nothing
+        appointment.save()
+        Appointment.objects.only('pk', 'reason').first().save()
+        create_user('admin', ADMIN)
+        MedicalRecord.objects.filter(patient=self.patient).first().delete()
+        self.assertCountersTrue()
+
+    def test_template_tag_reads_the_counters(self):
+        template = Template('{% load dashboards %}{% admin_counters as counters %}'
+                            '{{ counters.users_count }}/{{ counters.records_count }}')
+        with self.assertNumQueries(1):
+            self.assertEqual(template.render(Context()), '2/4')
+
+
+class UserDirectoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', ADMIN)
+        cls.patients = [create_user(f'patient{i}', PATIENT) for i in range(5)]
+        cls.doctors = [create_user(f'doctor{i}', DOCTOR, 'Cardiology') for i in range(2)]
+
+    def get(self, **params):
+        return self.client.get(reverse('user_directory'), params)
+
+    def test_filters_by_role(self):
+        self.client.force_login(self.admin)
+        response = self.get(role=DOCTOR)
+        self.assertEqual(list(response.context['members']), self.doctors[::-1])
+
+    def test_pages_on_the_primary_key(self):
+        self.client.force_login(self.admin)
+        seen = []
+        params = {'role': PATIENT, 'page_size': 2}
+        while True:
+            response = self.get(**params)
+            page = response.context['page']
+            seen.extend(page)
+            if not page.has_next:
+                break
+            self.assertContains(response, f'cursor={page.next_cursor}&page_size=2')
+            params['cursor'] = page.next_cursor
+        self.assertEqual(seen, self.patients[::-1])
+
+    def test_searches_by_prefix(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(list(self.get(q='doctor1').context['members']), [self.doctors[1]])
+
+    def test_admins_only(self):
+        self.client.force_login(self.doctors[0])
+        self.assertEqual(self.get().status_code, 403)
+
+
+class ImportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as out:
+            out.writelines(f'{line}\n' for line in lines)
+        return path
+
+    def rejects(self, path):
+        with open(f'{path}.rejects.jsonl', encoding='utf-8') as rejects:
+            return [json.loads(line) for line in rejects]
+
+    def test_rejected_rows_are_written_out(self):
+        path = self.write('records.csv', [
+            'patient,doctor,diagnosis,description,date_created',
+            'patient,doctor,Flu,Rest,2019-01-02',
+            'nobody,doctor,Flu,Rest,',
+            'doctor,doctor,Flu,Rest,',
+            'patient,,,Rest,',
+            'patient,doctor,Cold,Rest,not a date',
+        ])
+        call_command('import_history', 'records', path, stdout=io.StringIO())
+        self.assertEqual(list(MedicalRecord.objects.values_list('diagnosis', flat=True)), ['Flu'])
+        self.assertEqual([(reject['line'], reject['error']) for reject in self.rejects(path)], [
+            (3, 'Unknown patient "nobody".'),
+            (4, '"doctor" is not a patient.'),
+            (5, 'Missing diagnosis.'),
+            (6, 'Invalid date_created "not a date".'),
+        ])
+        self.assertEqual(len(search.search(self.patient, 'Flu')), 1)
+
+    def test_historic_timestamps_are_restored(self):
+        from prescriptions.models import Prescription
+
+        record = MedicalRecord.objects.create(patient=self.patient, doctor=self.doctor, diagnosis='Flu', description='-')
+        row = {'patient': 'patient', 'doctor': 'doctor', 'medical_record': record.pk, 'start_date': '2019-03-01',
+               'medication_name': 'Oseltamivir', 'dosage': '75mg', 'frequency': 'twice_daily', 'instructions': 'After meals'}
+        path = self.write('prescriptions.jsonl', [
+            json.dumps({**row, 'date_created': '2019-03-01T10:00:00', 'date_prescribed': '2019-02-28'}),
+            json.dumps({**row, 'date_created': '2019-04-01'}),
+            json.dumps(row),
+        ])
+        call_command('import_history', 'prescriptions', path, stdout=io.StringIO())
+        imported = Prescription.objects.order_by('pk')
+        self.assertEqual([prescription.date_prescribed for prescription in imported], [
+            datetime.date(2019, 2, 28), datetime.date(2019, 4, 1), timezone.localdate(),
+        ])
+        self.assertEqual(imported[0].date_created, timezone.make_aware(datetime.datetime(2019, 3, 1, 10)))
+
+    def test_a_refused_batch_is_retried_row_by_row(self):
+        from appointments.models import Appointment
+
+        row = {
+            'patient': 'patient', 'doctor': 'doctor', 'appointment_date': '2021-05-05', 'reason': 'Checkup',
+            'date_created': '2021-01-01T10:00:00',
+        }
+        path = self.write('appointments.jsonl', [
+            json.dumps({**row, 'appointment_time': '09:00'}),
+            json.dumps({**row, 'appointment_time': '09:00'}),
+            json.dumps({**row, 'appointment_time': '10:00'}),
+        ])
+        call_command('import_history', 'appointments', path, stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Appointment.objects.values_list('appointment_time', flat=True)),
+            [datetime.time(9), datetime.time(10)],
+        )
+        self.assertEqual(
+            {timezone.localtime(created) for created in Appointment.objects.values_list('date_created', flat=True)},
+            {timezone.make_aware(datetime.datetime(2021, 1, 1, 10))},
+        )
+        [reject] = self.rejects(path)
+        self.assertEqual(reject['line'], 2)
+        self.assertTrue(reject['error'].startswith('Database refused the row'))
+
+    def test_dry_run_rolls_back(self):
+        path = self.write('records.csv', ['patient,diagnosis', 'patient,Flu'])
+        call_command('import_history', 'records', path, '--dry-run', stdout=io.StringIO())
+        self.assertFalse(MedicalRecord.objects.exists())
+
+
+class ExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Neurology')
+        cls.admin = create_user('admin', ADMIN)
+        build_history(cls.patient, cls.doctor, 2)
+        build_history(cls.other_patient, cls.other_doctor, 1, start=2)
+
+    def export(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get(reverse('medical_record_export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def ndjson(self, user, **params):
+        return [json.loads(line) for line in self.export(user, format='ndjson', **params).splitlines()]
+
+    def test_ndjson_sections_in_order(self):
+        rows = self.ndjson(self.patient)
+        types = [row['type'] for row in rows]
+        self.assertEqual(Counter(types), {
+            'records': 2, 'reports': 2, 'prescriptions': 2, 'reminders': 4, 'appointments': 2,
+        })
+        self.assertEqual(types, sorted(types, key=list(export.SECTIONS).index))
+        self.assertEqual({row['patient'] for row in rows}, {'patient'})
+
+    def test_csv_round_trips_awkward_text(self):
+        MedicalRecord.objects.filter(patient=self.patient).update(description='Comma, "quote"\nnewline')
+        rows = list(csv.DictReader(io.StringIO(self.export(self.patient, format='csv', section='records'))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(list(rows[0]), export.csv_columns(['records']))
+        self.assertEqual({row['description'] for row in rows}, {'Comma, "quote"\nnewline'})
+
+    def test_rows_are_scoped_to_the_user(self):
+        for user, patients in (
+            (self.patient, {'patient'}),
+            (self.doctor, {'patient'}),
+            (self.other_doctor, {'other-patient'}),
+            (self.admin, {'patient', 'other-patient'}),
+        ):
+            with self.subTest(user=user.username):
+                self.assertEqual({row['patient'] for row in self.ndjson(user, section='records')}, patients)
+        # A patient filter narrows what the user may see, never widens it
+        self.assertEqual(self.ndjson(self.patient, patient=self.other_patient.pk), [])
+        self.assertEqual(len(self.ndjson(self.admin, section='records', patient=self.other_patient.pk)), 1)
+
+    def test_response_headers_and_bad_parameters(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('medical_record_export'), {'format': 'csv'})
+        self.assertTrue(response['Content-Disposition'].startswith('attachment;'))
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+        self.assertEqual(self.client.get(reverse('medical_record_export'), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('medical_record_export'), {'patient': 'x'}).status_code, 400)
+
+    def test_command_exports_a_doctors_panel(self):
+        out = io.StringIO()
+        call_command('export_history', '--doctor', 'other-doctor', '--section', 'records', stdout=out)
+        self.assertEqual([json.loads(line)['diagnosis'] for line in out.getvalue().splitlines()], ['Diagnosis 2'])
+
+
+class ReportBundleTests(TestCase):
+    PDF = b'%PDF-1.4 ' + bytes(range(256)) * 64
+    CSV = b'test,value\n' * 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Neurology')
+        cls.admin = create_user('admin', ADMIN)
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Fracture', description='Description',
+        )
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for title, name, body in (('X-ray', 'scan.pdf', self.PDF), ('Blood test', 'labs.csv', self.CSV)):
+            MedicalReport.objects.create(
+                medical_record=self.record, title=title, report_type=title, date=datetime.date(2025, 1, 1),
+                report_file=ContentFile(body, name=name), original_filename=name, uploaded_by=self.doctor,
+            )
+        MedicalReport.objects.create(
+            medical_record=self.record, title='Lost', report_type='X-ray', date=datetime.date(2025, 1, 2),
+            report_file='medical_reports/missing.pdf', uploaded_by=self.doctor,
+        )
+
+    def bundle(self, user, url):
+        self.client.force_login(user)
+        response = self.client.get(url)
+        if response.status_code != 200:
+            return response, None
+        return response, zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def test_archive_and_manifest(self):
+        response, archive = self.bundle(self.patient, reverse('medical_record_bundle', args=[self.record.pk]))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIsNone(archive.testzip())
+        manifest = json.loads(archive.read(bundles.MANIFEST_NAME))
+        self.assertEqual(manifest['medical_record'], self.record.pk)
+        self.assertEqual([entry['title'] for entry in manifest['missing']], ['Lost'])
+        files = {entry['original_filename']: entry for entry in manifest['files']}
+        self.assertEqual(set(files), {'scan.pdf', 'labs.csv'})
+        for name, body, compression in (('scan.pdf', self.PDF, zipfile.ZIP_STORED),
+                                        ('labs.csv', self.CSV, zipfile.ZIP_DEFLATED)):
+            entry = files[name]
+            self.assertEqual(archive.read(entry['path']), body)
+            self.assertEqual(archive.getinfo(entry['path']).compress_type, compression)
+            self.assertEqual(entry['sha256'], hashlib.sha256(body).hexdigest())
+            self.assertEqual(entry['size'], len(body))
+
+    def test_record_bundle_follows_the_role(self):
+        url = reverse('medical_record_bundle', args=[self.record.pk])
+        for user, status in ((self.patient, 200), (self.doctor, 200), (self.admin, 200),
+                             (self.other_patient, 404), (self.other_doctor, 404)):
+            with self.subTest(user=user.username):
+                self.assertEqual(self.bundle(user, url)[0].status_code, status)
+
+    def test_patient_bundle_follows_the_role(self):
+        url = reverse('patient_report_bundle', args=[self.patient.pk])
+        for user, status in ((self.patient, 200), (self.doctor, 200), (self.admin, 200),
+                             (self.other_patient, 404), (self.other_doctor, 404)):
+            with self.subTest(user=user.username):
+                response, archive = self.bundle(user, url)
+                self.assertEqual(response.status_code, status)
+                if archive is not None:
+                    self.assertEqual(len(json.loads(archive.read(bundles.MANIFEST_NAME))['files']), 2)
+
+
+class ApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        build_history(cls.patient, cls.doctor, 30)
+        build_history(cls.other_patient, cls.doctor, 1, start=30)
+
+    def setUp(self):
+        self.client.force_login(self.patient)
+
+    def list_url(self, resource):
+        return reverse('api_resource_list', args=[resource])
+
+    def test_fields_are_selected(self):
+        response = self.client.get(self.list_url('records'), {'fields': 'diagnosis,patient'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'diagnosis', 'patient'])
+        self.assertEqual(set(self.client.get(self.list_url('records')).json()['results'][0]),
+                         set(RESOURCES['records'].fields))
+        self.assertEqual(self.client.get(self.list_url('records'), {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(self.list_url('users')).status_code, 404)
+
+    def test_cursor_walks_every_visible_row(self):
+        ids, params = [], {'fields': 'id', 'page_size': 7}
+        while True:
+            body = self.client.get(self.list_url('records'), params).json()
+            ids.extend(row['id'] for row in body['results'])
+            if not body['next']:
+                break
+            params['cursor'] = body['next']
+        self.assertEqual(ids, list(
+            MedicalRecord.objects.filter(patient=self.patient).order_by('-pk').values_list('pk', flat=True)
+        ))
+
+    def test_list_revalidates_until_a_row_changes(self):
+        url = self.list_url('records')
+        response = self.client.get(url)
+        # Session, user and profile, then the page itself
+        with self.assertNumQueries(4):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        record = MedicalRecord.objects.filter(patient=self.patient).latest('pk')
+        record.diagnosis = 'Changed'
+        record.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_detail_validators(self):
+        record = MedicalRecord.objects.filter(patient=self.patient).first()
+        url = reverse('api_resource_detail', args=['records', record.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.json()['patient'], self.patient.pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_fired_reminders_change_their_etag(self):
+        from prescriptions.models import MedicationReminder
+
+        reminder = MedicationReminder.objects.filter(prescription__patient=self.patient).first()
+        MedicationReminder.objects.filter(pk=reminder.pk).update(
+            next_fire_at=timezone.now() - datetime.timedelta(minutes=1),
+            date_updated=timezone.now() - datetime.timedelta(days=1),
+        )
+        url = reverse('api_resource_detail', args=['reminders', reminder.pk])
+        response = self.client.get(url)
+        call_command('run_reminders', '--once', stdout=io.StringIO())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_rows_of_other_patients_are_not_found(self):
+        other = MedicalRecord.objects.get(patient=self.other_patient)
+        self.assertEqual(self.client.get(reverse('api_resource_detail', args=['records', other.pk])).status_code, 404)
+        reminders = self.client.get(self.list_url('reminders'), {'page_size': 100}).json()['results']
+        self.assertEqual(len(reminders), 60)
+        self.client.force_login(self.other_patient)
+        self.assertEqual(len(self.client.get(self.list_url('reminders')).json()['results']), 2)
+
+
+class SyntheticDataTests(TestCase):
+    COUNTS = {
+        'patients': 4, 'doctors': 2, 'admins': 1, 'records_per_patient': 2,
+        'reports_per_record': 1, 'prescriptions_per_record': 1,
+        'reminders_per_prescription': 2, 'appointments_per_patient': 2,
+    }
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = self.settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def generate(self, prefix):
+        return synthetic.generate(
+            seed=7, prefix=prefix, anchor=datetime.date(2026, 3, 2), report_size=2048, **self.COUNTS,
+        )
+
+    def data_set(self, prefix):
+        records = MedicalRecord.objects.filter(patient__username__startswith=f'{prefix}-').order_by('pk')
+        reports = MedicalReport.objects.filter(medical_record__in=records).order_by('pk')
+        return (
+            list(records.values_list('patient__username', 'diagnosis', 'date_created')),
+            list(reports.values_list('title', 'sha256', 'file_size')),
+        )
+
+    def test_same_seed_gives_the_same_data(self):
+        created = self.generate('a')
+        self.assertEqual(created['records'], 8)
+        self.assertEqual(created['reminders'], 16)
+        self.generate('b')
+        first, second = self.data_set('a'), self.data_set('b')
+        self.assertEqual(
+            [(username[2:], *rest) for username, *rest in first[0]],
+            [(username[2:], *rest) for username, *rest in second[0]],
+        )
+        self.assertEqual(first[1], second[1])
+
+    def test_reports_are_stored_as_blobs(self):
+        self.generate('a')
+        self.generate('b')
+        reports = MedicalReport.objects.all()
+        self.assertEqual(reports.count(), 16)
+        self.assertFalse(reports.filter(blob=None).exists())
+        # The same seed gives the same files, each stored once
+        blob_list = list(ReportBlob.objects.all())
+        self.assertEqual(len(blob_list), 8)
+        for blob in blob_list:
+            self.assertEqual(blob.ref_count, 2)
+            with blob.file.open('rb') as stored:
+                self.assertEqual(hashlib.sha256(stored.read()).hexdigest(), blob.sha256)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            synthetic.delete('a')
+        self.assertEqual(set(ReportBlob.objects.values_list('ref_count', flat=True)), {1})
+        with self.captureOnCommitCallbacks(execute=True):
+            synthetic.delete('b')
+        self.assertFalse(ReportBlob.objects.exists())
+        self.assertFalse(any(os.path.exists(os.path.join(settings.MEDIA_ROOT, blob.file.name)) for blob in blob_list))
+
+    def test_sample_ids_fall_back_on_an_empty_diagnosis(self):
+        self.generate('synth')
+        MedicalRecord.objects.update(diagnosis='')
+        samples = benchmark.sample_ids()
+        report = MedicalReport.objects.get(pk=samples['report_id'])
+        self.assertEqual(samples['query'], report.title.split()[0])
 
-# Create your tests here.
+    def test_benchmark_drives_routes_as_every_role(self):
+        self.generate('synth')
+        samples = benchmark.sample_ids()
+        cases = benchmark.discover_cases(samples, {
+            'medical_record_list', 'medical_record_detail', 'report_download', 'api_resource_detail',
+        })
+        # api_resource_detail expands to one case per resource
+        self.assertEqual(len(cases), 3 + len(RESOURCES))
+        for result in benchmark.run(cases, samples, requests=3, concurrency=1, warmup=0):
+            with self.subTest(case=result.case, role=result.role):
+                self.assertEqual(result.requests, 3)
+                self.assertFalse([status for status in result.statuses if status >= 500])
+                self.assertGreater(result.queries, 0)
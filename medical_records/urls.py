@@ -3,10 +3,16 @@ from . import views
 
 urlpatterns = [
     path('', views.medical_record_list, name='medical_record_list'),
+    path('search/', views.search_view, name='search'),
+    path('export/', views.medical_record_export, name='medical_record_export'),
     path('create/', views.medical_record_create, name='medical_record_create'),
     path('<int:record_id>/', views.medical_record_detail, name='medical_record_detail'),
     path('<int:record_id>/update/', views.medical_record_update, name='medical_record_update'),
+    path('<int:record_id>/bundle/', views.medical_record_bundle, name='medical_record_bundle'),
+    path('patient/<int:patient_id>/bundle/', views.patient_report_bundle, name='patient_report_bundle'),
     path('<int:record_id>/report/create/', views.medical_report_create, name='medical_report_create'),
+    path('<int:record_id>/report/upload/', views.report_upload_start, name='report_upload_start'),
+    path('report/upload/<uuid:upload_id>/', views.report_upload_chunk, name='report_upload_chunk'),
     path('report/<int:report_id>/', views.medical_report_detail, name='medical_report_detail'),
     path('report/<int:report_id>/download/', views.report_download, name='report_download'),
     path('report/<int:report_id>/view/', views.report_view, name='report_view'),
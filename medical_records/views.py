@@ -1,41 +1,58 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponseForbidden, FileResponse
+from django.conf import settings
+from django.http import Http404, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_POST
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 
-from .models import MedicalRecord, MedicalReport
+from .models import MedicalReport, ReportUpload
 from .forms import MedicalRecordForm, MedicalReportForm
+from .pagination import keyset_paginate, get_page_size
+from .delivery import serve_report_file, serve_report_variant
+from .blobs import UploadError, UploadOffsetMismatch, append_chunk
+from .access import records_for, reports_for, get_record_or_404, get_report_or_404
+from . import bundles, export, search
 from accounts.models import PATIENT, DOCTOR, ADMIN
 
+# Ranked results are paged by offset; past this depth refine the query instead
+MAX_SEARCH_PAGES = 50
+
 @login_required
 def medical_record_list(request):
-    user_profile = request.user.profile
+    # Patients see their own records, doctors the ones they created and
+    # admins everything
+    records = records_for(request.user)
     
-    if user_profile.is_patient():
-        # Patients can only see their own records
-        records = MedicalRecord.objects.filter(patient=request.user)
-    elif user_profile.is_doctor():
-        # Doctors can see records they created
-        records = MedicalRecord.objects.filter(doctor=request.user)
-    elif user_profile.is_admin():
-        # Admins can see all records
-        records = MedicalRecord.objects.all()
-    else:
-        return HttpResponseForbidden()
+    # Join patient/doctor and count reports with a correlated subquery (a
+    # GROUP BY would aggregate every visible row before LIMIT applies), so a
+    # page costs a single query no matter how many rows the user can see
+    report_counts = MedicalReport.objects.filter(
+        medical_record=OuterRef('pk')
+    ).order_by().values('medical_record').annotate(c=Count('id')).values('c')
+    records = records.select_related('patient', 'doctor').annotate(
+        report_count=Coalesce(Subquery(report_counts, output_field=IntegerField()), 0)
+    )
+    page = keyset_paginate(records, request.GET.get('cursor'), get_page_size(request))
     
-    return render(request, 'medical_records/record_list.html', {'records': records})
+    return render(request, 'medical_records/record_list.html', {
+        'records': page,
+        'page': page,
+    })
 
 @login_required
 def medical_record_detail(request, record_id):
-    record = get_object_or_404(MedicalRecord, id=record_id)
-    user_profile = request.user.profile
-    
-    # Check permissions
-    if user_profile.is_patient() and record.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and record.doctor != request.user:
-        return HttpResponseForbidden()
-    
+    record = get_record_or_404(
+        request.user, record_id,
+        prefetch=[
+            Prefetch('reports', queryset=MedicalReport.objects.select_related('uploaded_by')),
+            'prescriptions',
+        ],
+    )
     reports = record.reports.all()
     
     return render(request, 'medical_records/record_detail.html', {
@@ -71,14 +88,10 @@ def medical_record_create(request):
 
 @login_required
 def medical_record_update(request, record_id):
-    record = get_object_or_404(MedicalRecord, id=record_id)
-    user_profile = request.user.profile
-    
-    # Check permissions
-    if user_profile.is_doctor() and record.doctor != request.user:
-        return HttpResponseForbidden()
-    elif not (user_profile.is_doctor() or user_profile.is_admin()):
+    # Only doctors who own the record and admins can update it
+    if not (request.user.profile.is_doctor() or request.user.profile.is_admin()):
         return HttpResponseForbidden()
+    record = get_record_or_404(request.user, record_id)
     
     if request.method == 'POST':
         form = MedicalRecordForm(request.POST, instance=record)
@@ -96,14 +109,7 @@ def medical_record_update(request, record_id):
 
 @login_required
 def medical_report_create(request, record_id):
-    record = get_object_or_404(MedicalRecord, id=record_id)
-    user_profile = request.user.profile
-    
-    # Check permissions
-    if user_profile.is_patient() and record.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and record.doctor != request.user:
-        return HttpResponseForbidden()
+    record = get_record_or_404(request.user, record_id)
     
     if request.method == 'POST':
         form = MedicalReportForm(request.POST, request.FILES, medical_record=record, user=request.user)
@@ -119,41 +125,169 @@ def medical_report_create(request, record_id):
         'record': record
     })
 
+@login_required
+@require_POST
+def report_upload_start(request, record_id):
+    # Same rules as uploading through the report form
+    record = get_record_or_404(request.user, record_id)
+    
+    filename = request.POST.get('filename', '').strip()
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = -1
+    if not filename or size <= 0:
+        return JsonResponse({'error': 'filename and a positive size are required.'}, status=400)
+    if size > settings.REPORT_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': 'File is too large.'}, status=413)
+    
+    upload = ReportUpload.objects.create(
+        medical_record=record,
+        uploaded_by=request.user,
+        filename=filename[:255],
+        size=size,
+    )
+    return JsonResponse({
+        'upload_id': str(upload.id),
+        'offset': 0,
+        'url': reverse('report_upload_chunk', args=[upload.id]),
+    }, status=201)
+
+@login_required
+def report_upload_chunk(request, upload_id):
+    upload = get_object_or_404(ReportUpload, id=upload_id, uploaded_by=request.user)
+    
+    if request.method in ('GET', 'HEAD'):
+        # Lets a client resume after a dropped connection
+        return JsonResponse({'offset': upload.received, 'size': upload.size, 'complete': upload.is_complete})
+    if request.method != 'PATCH':
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'PATCH'])
+    
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Upload-Offset and Content-Length headers are required.'}, status=400)
+    if length > settings.REPORT_UPLOAD_CHUNK_MAX_SIZE:
+        return JsonResponse({'error': 'Chunk is too large.'}, status=413)
+    
+    try:
+        # Read straight from the request stream; the chunk is never buffered
+        offset = append_chunk(upload, request, offset, length)
+    except UploadOffsetMismatch as e:
+        return JsonResponse({'error': str(e), 'offset': e.expected}, status=409)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    data = {'offset': offset, 'size': upload.size, 'complete': upload.is_complete}
+    if upload.is_complete:
+        data['sha256'] = upload.blob.sha256
+    return JsonResponse(data)
+
 @login_required
 def medical_report_detail(request, report_id):
-    report = get_object_or_404(MedicalReport, id=report_id)
-    user_profile = request.user.profile
-    # Check permissions
-    if user_profile.is_patient() and report.medical_record.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and report.medical_record.doctor != request.user:
-        return HttpResponseForbidden()
+    report = get_report_or_404(
+        request.user, report_id,
+        'medical_record__patient', 'medical_record__doctor', 'uploaded_by',
+    )
     return render(request, 'medical_records/report_detail.html', {'report': report})
 
 @login_required
 def report_download(request, report_id):
-    report = get_object_or_404(MedicalReport, id=report_id)
-    user_profile = request.user.profile
-    # Check permissions
-    if user_profile.is_patient() and report.medical_record.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and report.medical_record.doctor != request.user:
-        return HttpResponseForbidden()
+    report = get_report_or_404(request.user, report_id)
     if not report.report_file:
         return HttpResponseForbidden()
-    response = FileResponse(report.report_file.open('rb'), as_attachment=True, filename=report.report_file.name.split('/')[-1])
-    return response
+    return serve_report_file(request, report, as_attachment=True)
 
 @login_required
 def report_view(request, report_id):
-    report = get_object_or_404(MedicalReport, id=report_id)
-    user_profile = request.user.profile
-    # Check permissions
-    if user_profile.is_patient() and report.medical_record.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and report.medical_record.doctor != request.user:
-        return HttpResponseForbidden()
+    report = get_report_or_404(request.user, report_id)
     if not report.report_file:
         return HttpResponseForbidden()
-    response = FileResponse(report.report_file.open('rb'), as_attachment=False, filename=report.report_file.name.split('/')[-1])
+    variant = request.GET.get('variant')
+    if variant:
+        # Image previews go through the same access check as the report
+        return serve_report_variant(request, report, variant, request.GET.get('format', 'webp'))
+    return serve_report_file(request, report, as_attachment=False)
+
+def _bundle_response(reports, filename, description):
+    response = StreamingHttpResponse(
+        bundles.stream_bundle(reports.iterator(chunk_size=500), description),
+        content_type='application/zip',
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = 'private, no-store'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def medical_record_bundle(request, record_id):
+    record = get_record_or_404(request.user, record_id)
+    reports = MedicalReport.objects.filter(medical_record=record).order_by('date', 'pk')
+    return _bundle_response(
+        reports, f'record-{record.pk}-reports.zip',
+        {'medical_record': record.pk, 'patient': record.patient.username, 'diagnosis': record.diagnosis},
+    )
+
+@login_required
+def patient_report_bundle(request, patient_id):
+    reports = reports_for(request.user).filter(medical_record__patient_id=patient_id)
+    if not reports.exists():
+        raise Http404('No reports found for this patient.')
+    reports = reports.order_by('medical_record_id', 'date', 'pk')
+    return _bundle_response(reports, f'patient-{patient_id}-reports.zip', {'patient_id': patient_id})
+
+@login_required
+def search_view(request):
+    query = request.GET.get('q', '').strip()
+    kinds = [kind for kind in request.GET.getlist('type') if kind in search.KINDS]
+    page_size = get_page_size(request)
+    try:
+        page_number = max(1, min(int(request.GET.get('page', 1)), MAX_SEARCH_PAGES))
+    except ValueError:
+        page_number = 1
+    
+    # Fetch one extra hit to learn whether there is a next page without
+    # counting every match
+    hits = search.search(
+        request.user, query, kinds,
+        offset=(page_number - 1) * page_size, limit=page_size + 1,
+    )
+    has_next = len(hits) > page_size and page_number < MAX_SEARCH_PAGES
+    
+    return render(request, 'medical_records/search.html', {
+        'query': query,
+        'kinds': kinds,
+        'hits': hits[:page_size],
+        'page_number': page_number,
+        'has_previous': page_number > 1,
+        'has_next': has_next,
+        'previous_page': page_number - 1,
+        'next_page': page_number + 1,
+    })
+
+@login_required
+def medical_record_export(request):
+    fmt = request.GET.get('format', 'csv')
+    sections = [name for name in request.GET.getlist('section') if name in export.SECTIONS] or list(export.SECTIONS)
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest('Unknown export format.')
+    try:
+        patient_id = int(request.GET['patient']) if request.GET.get('patient') else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid patient.')
+    
+    # Rows are read and written while the response is being sent, so the
+    # first bytes leave immediately and memory stays flat however long the
+    # history is
+    content_type, extension = export.FORMATS[fmt]
+    response = StreamingHttpResponse(
+        export.render(fmt, sections, user=request.user, patient_id=patient_id),
+        content_type=content_type,
+    )
+    filename = f'medical-history-{timezone.localdate().isoformat()}.{extension}'
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = 'private, no-store'
+    # Keep nginx from buffering the whole export before relaying it
+    response['X-Accel-Buffering'] = 'no'
     return response
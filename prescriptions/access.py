@@ -0,0 +1,31 @@
+"""
+Role-scoped querysets for prescriptions and reminders; see
+``medical_records.access``.
+"""
+from django.shortcuts import get_object_or_404
+
+from medical_records.access import visible_to
+from .models import MedicationReminder, Prescription
+
+
+def prescriptions_for(user):
+    return visible_to(user, Prescription.objects.all())
+
+
+def reminders_for(user):
+    return visible_to(
+        user,
+        MedicationReminder.objects.all(),
+        patient_field='prescription__patient',
+        doctor_field='prescription__doctor',
+    )
+
+
+def get_prescription_or_404(user, prescription_id, *related, prefetch=()):
+    prescriptions = prescriptions_for(user).select_related('patient', 'doctor', *related).prefetch_related(*prefetch)
+    return get_object_or_404(prescriptions, id=prescription_id)
+
+
+def get_reminder_or_404(user, reminder_id):
+    reminders = reminders_for(user).select_related('prescription__patient', 'prescription__doctor')
+    return get_object_or_404(reminders, id=reminder_id)
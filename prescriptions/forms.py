@@ -1,5 +1,6 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.utils import timezone
 from .models import Prescription, MedicationReminder, FREQUENCY_CHOICES
 
 class PrescriptionForm(forms.ModelForm):
@@ -41,7 +42,9 @@ class PrescriptionForm(forms.ModelForm):
             patient_id = self.instance.patient_id
             
         if patient_id:
-            self.fields['medical_record'].queryset = self.fields['medical_record'].queryset.filter(patient_id=patient_id)
+            # Each choice's label reads the record's patient
+            self.fields['medical_record'].queryset = self.fields['medical_record'].queryset.filter(
+                patient_id=patient_id).select_related('patient')
         else:
             self.fields['medical_record'].queryset = self.fields['medical_record'].queryset.none()
         
@@ -80,6 +83,8 @@ class MedicationReminderForm(forms.ModelForm):
         reminder = super().save(commit=False)
         if self.prescription:
             reminder.prescription = self.prescription
+        if not reminder.time_zone:
+            reminder.time_zone = timezone.get_current_timezone_name()
         if commit:
             reminder.save()
         return reminder 
\ No newline at end of file
@@ -0,0 +1,102 @@
+import heapq
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from prescriptions.models import MedicationReminder
+from prescriptions.scheduler import compute_next_fire, due_reminders, reminder_due
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Fire medication reminders as they come due, in batches, from a heap of upcoming fire times'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Maximum reminders fired per transaction')
+        parser.add_argument('--lookahead', type=int, default=300,
+                            help='Seconds of upcoming reminders to keep loaded in the heap')
+        parser.add_argument('--poll', type=float, default=5,
+                            help='Longest sleep, in seconds, before looking for created or edited reminders')
+        parser.add_argument('--once', action='store_true',
+                            help='Fire everything currently due and exit (for cron)')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        lookahead = timedelta(seconds=options['lookahead'])
+        poll = options['poll']
+        heap = []
+        # (fire_at, pk) entries in the heap
+        queued = set()
+        loaded_until = checked_at = None
+        fired = 0
+
+        while True:
+            now = timezone.now()
+            if loaded_until is None or now >= loaded_until:
+                loaded_until = now + lookahead
+                self.load(heap, queued, due_reminders(loaded_until))
+            else:
+                # Reminders created or edited inside the loaded window; a
+                # poll of slack covers transactions that committed late
+                self.load(heap, queued, due_reminders(loaded_until).filter(date_updated__gte=checked_at))
+            checked_at = now - timedelta(seconds=poll)
+
+            while heap and heap[0][0] <= now:
+                batch = []
+                while heap and heap[0][0] <= now and len(batch) < self.batch_size:
+                    fire_at, pk = heapq.heappop(heap)
+                    queued.discard((fire_at, pk))
+                    batch.append((fire_at, pk))
+                fired += self.fire(batch, heap, queued, loaded_until)
+
+            if options['once']:
+                break
+            wake_at = min(heap[0][0], loaded_until) if heap else loaded_until
+            time.sleep(min(max((wake_at - timezone.now()).total_seconds(), 0.5), poll))
+
+        self.stdout.write(self.style.SUCCESS(f'Fired {fired} reminder(s).'))
+
+    def load(self, heap, queued, reminders):
+        # Range scan over the next_fire_at index; overdue rows come first
+        rows = reminders.values_list('next_fire_at', 'pk')
+        for entry in rows.iterator(chunk_size=self.batch_size):
+            if entry in queued:
+                continue
+            heapq.heappush(heap, entry)
+            queued.add(entry)
+
+    def fire(self, batch, heap, queued, loaded_until):
+        # An edited reminder can be queued under its old time as well
+        expected = {}
+        for fire_at, pk in batch:
+            expected.setdefault(pk, set()).add(fire_at)
+        fired = []
+        now = timezone.now()
+        with transaction.atomic():
+            reminders = MedicationReminder.objects.select_related('prescription').filter(pk__in=expected)
+            for reminder in reminders:
+                # Skip entries made stale by an edit since they were queued
+                if reminder.next_fire_at not in expected[reminder.pk]:
+                    continue
+                reminder_due.send(sender=MedicationReminder, reminder=reminder, fire_at=reminder.next_fire_at)
+                # Schedule from now rather than from the missed slot so a
+                # runner that was down does not replay every skipped day
+                reminder.next_fire_at = compute_next_fire(reminder, after=now)
+                # bulk_update skips auto_now; API clients revalidate on it
+                reminder.date_updated = now
+                fired.append(reminder)
+            MedicationReminder.objects.bulk_update(fired, ['next_fire_at', 'date_updated'])
+
+        for reminder in fired:
+            entry = (reminder.next_fire_at, reminder.pk)
+            if reminder.next_fire_at and reminder.next_fire_at <= loaded_until and entry not in queued:
+                heapq.heappush(heap, entry)
+                queued.add(entry)
+        logger.info('Fired %d medication reminder(s)', len(fired))
+        return len(fired)
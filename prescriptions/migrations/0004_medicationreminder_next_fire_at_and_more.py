@@ -0,0 +1,75 @@
+# Generated by Django 5.2 on 2026-10-18 09:12
+
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def compute_next_fire(reminder, now):
+    # A copy of prescriptions.scheduler.compute_next_fire as of this
+    # migration, so later changes to the scheduler do not change what it does
+    prescription = reminder.prescription
+    if not (reminder.is_active and prescription.is_active):
+        return None
+    try:
+        zone = ZoneInfo(reminder.time_zone or settings.TIME_ZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = ZoneInfo(settings.TIME_ZONE)
+    day = now.astimezone(zone).date()
+    if prescription.start_date and day < prescription.start_date:
+        day = prescription.start_date
+    for offset in (0, 1):
+        candidate_day = day + timedelta(days=offset)
+        if prescription.end_date and candidate_day > prescription.end_date:
+            return None
+        fire_at = datetime.combine(candidate_day, reminder.reminder_time, tzinfo=zone)
+        if fire_at > now:
+            return fire_at.astimezone(ZoneInfo('UTC'))
+    return None
+
+
+def populate_next_fire_at(apps, schema_editor):
+    now = timezone.now()
+    MedicationReminder = apps.get_model('prescriptions', 'MedicationReminder')
+    reminders = MedicationReminder.objects.select_related('prescription').filter(is_active=True)
+    batch = []
+    for reminder in reminders.iterator(chunk_size=2000):
+        reminder.next_fire_at = compute_next_fire(reminder, now)
+        batch.append(reminder)
+        if len(batch) >= 2000:
+            MedicationReminder.objects.bulk_update(batch, ['next_fire_at'])
+            batch = []
+    if batch:
+        MedicationReminder.objects.bulk_update(batch, ['next_fire_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0003_alter_medicationreminder_id_alter_prescription_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationreminder',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicationreminder',
+            name='time_zone',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='medicationreminder',
+            index=models.Index(fields=['next_fire_at'], name='reminder_next_fire_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicationreminder',
+            index=models.Index(fields=['prescription', 'next_fire_at'], name='reminder_rx_next_fire_idx'),
+        ),
+        migrations.RunPython(populate_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0004_medicationreminder_next_fire_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['patient', 'date_created'], name='rx_patient_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['doctor', 'date_created'], name='rx_doctor_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['date_created'], name='rx_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 13:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prescriptions', '0005_prescription_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationreminder',
+            name='date_updated',
+            # Replaced with the prescription's last update below
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            'UPDATE prescriptions_medicationreminder SET date_updated = ('
+            'SELECT date_updated FROM prescriptions_prescription '
+            'WHERE prescriptions_prescription.id = prescriptions_medicationreminder.prescription_id)',
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from medical_records.models import MedicalRecord
 
 FREQUENCY_CHOICES = (
@@ -11,6 +12,20 @@ FREQUENCY_CHOICES = (
     ('custom', 'Custom')
 )
 
+class PrescriptionQuerySet(models.QuerySet):
+    @staticmethod
+    def current_q(today=None):
+        # A prescription is current while it is flagged active and has not
+        # run past its end date
+        today = today or timezone.localdate()
+        return models.Q(is_active=True) & (models.Q(end_date__isnull=True) | models.Q(end_date__gte=today))
+
+    def current(self, today=None):
+        return self.filter(self.current_q(today))
+
+    def past(self, today=None):
+        return self.exclude(self.current_q(today))
+
 class Prescription(models.Model):
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='patient_prescriptions', limit_choices_to={'profile__role': 'patient'})
     doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='doctor_prescriptions', limit_choices_to={'profile__role': 'doctor'})
@@ -30,6 +45,17 @@ class Prescription(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     date_updated = models.DateTimeField(auto_now=True)
     
+    objects = PrescriptionQuerySet.as_manager()
+    
+    class Meta:
+        indexes = [
+            # Partial on is_active: SQLite compares booleans as a bare column
+            # (WHERE "is_active"), which only a partial index can match
+            models.Index(fields=['patient', 'date_created'], name='rx_patient_active_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['doctor', 'date_created'], name='rx_doctor_active_idx', condition=models.Q(is_active=True)),
+            models.Index(fields=['date_created'], name='rx_created_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.patient.username} - {self.medication_name} - {self.date_prescribed}"
     
@@ -47,6 +73,17 @@ class MedicationReminder(models.Model):
     prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='reminders')
     reminder_time = models.TimeField()
     is_active = models.BooleanField(default=True)
+    # IANA zone the reminder time is expressed in; blank means TIME_ZONE
+    time_zone = models.CharField(max_length=64, blank=True, default='')
+    # Maintained by prescriptions.scheduler; NULL once the reminder can no longer fire
+    next_fire_at = models.DateTimeField(null=True, blank=True, editable=False)
+    date_updated = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_fire_at'], name='reminder_next_fire_idx'),
+            models.Index(fields=['prescription', 'next_fire_at'], name='reminder_rx_next_fire_idx'),
+        ]
     
     def __str__(self):
         return f"{self.prescription.medication_name} - {self.reminder_time}"
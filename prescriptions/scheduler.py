@@ -0,0 +1,121 @@
+"""
+Next-fire-time bookkeeping for medication reminders.
+
+Every reminder stores the UTC instant it should next go off in
+``MedicationReminder.next_fire_at`` (NULL when it can never fire again), so
+"what is due before T" is a range scan over an index instead of evaluating
+every reminder's schedule on each request.
+"""
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import MedicationReminder, Prescription
+
+# Sent by the runner once per reminder that has come due, with
+# ``reminder`` and ``fire_at`` keyword arguments
+reminder_due = Signal()
+
+
+def reminder_zone(reminder):
+    try:
+        return ZoneInfo(reminder.time_zone or settings.TIME_ZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(settings.TIME_ZONE)
+
+
+def compute_next_fire(reminder, prescription=None, after=None):
+    """
+    Return the first instant strictly after ``after`` at which ``reminder``
+    should fire, or ``None`` if it is inactive or its prescription has ended.
+    """
+    prescription = prescription or reminder.prescription
+    if not (reminder.is_active and prescription.is_active):
+        return None
+
+    after = after or timezone.now()
+    zone = reminder_zone(reminder)
+    day = after.astimezone(zone).date()
+    if prescription.start_date and day < prescription.start_date:
+        day = prescription.start_date
+
+    # At most two candidates: the reminder time on ``day`` or, if that has
+    # already passed, the same time on the following day
+    for offset in (0, 1):
+        candidate_day = day + timedelta(days=offset)
+        if prescription.end_date and candidate_day > prescription.end_date:
+            return None
+        fire_at = datetime.combine(candidate_day, reminder.reminder_time, tzinfo=zone)
+        if fire_at > after:
+            return fire_at.astimezone(ZoneInfo('UTC'))
+    return None
+
+
+def reschedule(reminders, after=None):
+    """Recompute ``next_fire_at`` for ``reminders`` and save the ones that moved."""
+    changed = []
+    now = timezone.now()
+    for reminder in reminders:
+        next_fire_at = compute_next_fire(reminder, after=after)
+        if next_fire_at != reminder.next_fire_at:
+            reminder.next_fire_at = next_fire_at
+            # bulk_update skips auto_now; API clients revalidate on this
+            reminder.date_updated = now
+            changed.append(reminder)
+    if changed:
+        MedicationReminder.objects.bulk_update(changed, ['next_fire_at', 'date_updated'], batch_size=500)
+    return changed
+
+
+def reschedule_prescription(prescription):
+    reminders = list(prescription.reminders.all())
+    for reminder in reminders:
+        # Reuse the instance we already hold instead of reloading it per row
+        reminder.prescription = prescription
+    return reschedule(reminders)
+
+
+def due_reminders(until, since=None, patient=None):
+    """
+    Reminders whose next fire time is at or before ``until``.
+
+    Without ``patient`` this walks the ``next_fire_at`` index; with one it
+    walks the patient's prescriptions and then the
+    ``(prescription, next_fire_at)`` index.
+    """
+    reminders = MedicationReminder.objects.filter(next_fire_at__lte=until)
+    if since is not None:
+        reminders = reminders.filter(next_fire_at__gt=since)
+    if patient is not None:
+        reminders = reminders.filter(
+            prescription__in=Prescription.objects.filter(patient=patient).values('pk')
+        )
+    return reminders.select_related('prescription').order_by('next_fire_at', 'pk')
+
+
+def upcoming_reminders(patient=None, minutes=24 * 60, now=None):
+    """
+    Reminders going off in the next ``minutes``, soonest first, each with its
+    fire time in ``upcoming_at``.
+
+    ``next_fire_at`` only moves past a fire time when ``run_reminders``
+    fires it, so a reminder whose stored time has already gone by (the
+    runner is behind or not running) is placed from its ``reminder_time``
+    instead of being dropped.
+    """
+    now = now or timezone.now()
+    until = now + timedelta(minutes=minutes)
+    upcoming = []
+    for reminder in due_reminders(until, patient=patient):
+        fire_at = reminder.next_fire_at
+        if fire_at <= now:
+            fire_at = compute_next_fire(reminder, after=now)
+            if fire_at is None or fire_at > until:
+                continue
+        reminder.upcoming_at = fire_at
+        upcoming.append(reminder)
+    upcoming.sort(key=lambda reminder: (reminder.upcoming_at, reminder.pk))
+    return upcoming
@@ -0,0 +1,33 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import MedicationReminder, Prescription
+from . import scheduler
+from medical_records import search
+
+
+@receiver(pre_save, sender=MedicationReminder)
+def schedule_reminder(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    instance.next_fire_at = scheduler.compute_next_fire(instance)
+
+
+@receiver(post_save, sender=Prescription)
+def reschedule_prescription_reminders(sender, instance, created, raw=False, **kwargs):
+    # A new prescription has no reminders yet; later edits may move its
+    # dates or deactivate it, which shifts every reminder under it
+    if raw or created:
+        return
+    scheduler.reschedule_prescription(instance)
+
+
+@receiver(post_save, sender=Prescription)
+def index_prescription(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_prescription(instance)
+
+
+@receiver(post_delete, sender=Prescription)
+def unindex_prescription(sender, instance, **kwargs):
+    search.unindex('prescription', instance.pk)
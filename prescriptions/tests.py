@@ -1,3 +1,260 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+# Needs accounts and appointments.models; see medical_records.tests
+from accounts.models import PATIENT, DOCTOR, ADMIN
+from appointments.models import Appointment
+from medical_records.models import MedicalRecord
+from medical_records.tests import QueryBudgetMixin, QueryPlanMixin, build_history, create_user
+from .models import Prescription, MedicationReminder
+from .access import prescriptions_for, reminders_for
+from .scheduler import compute_next_fire, due_reminders, reminder_due, upcoming_reminders
+
+
+class PrescriptionQueryPlanTests(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.admin = create_user('admin', ADMIN)
+        record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Hypertension', description='Description',
+        )
+        today = timezone.localdate()
+        for i in range(30):
+            prescription = Prescription.objects.create(
+                patient=cls.patient, doctor=cls.doctor, medical_record=record,
+                start_date=today - datetime.timedelta(days=60),
+                end_date=today - datetime.timedelta(days=1) if i % 3 == 0 else None,
+                medication_name=f'Medication {i}', dosage='10mg', frequency='once_daily',
+                instructions='With food', is_active=i % 5 != 0,
+            )
+            MedicationReminder.objects.create(prescription=prescription, reminder_time=datetime.time(8, 0))
+        for i in range(10):
+            Appointment.objects.create(
+                patient=cls.patient, doctor=cls.doctor,
+                appointment_date=today + datetime.timedelta(days=i), appointment_time=datetime.time(9, 0),
+                reason='Checkup',
+            )
+
+    def test_prescription_list_uses_indexes_for_every_role(self):
+        for user in (self.patient, self.doctor, self.admin):
+            with self.subTest(role=user.profile.role):
+                self.client.force_login(user)
+                self.assertViewUsesIndexes(reverse('prescription_list'))
+
+    def test_reminder_queries_use_indexes(self):
+        now = timezone.now()
+        self.assertQuerysetUsesIndex(due_reminders(now))
+        self.assertQuerysetUsesIndex(due_reminders(now + datetime.timedelta(days=1), patient=self.patient))
+
+    def test_appointment_queries_use_indexes(self):
+        today = timezone.localdate()
+        self.assertQuerysetUsesIndex(
+            Appointment.objects.filter(doctor=self.doctor, appointment_date=today).exclude(status='cancelled')
+        )
+        self.assertQuerysetUsesIndex(Appointment.objects.filter(patient=self.patient)[:20])
+        self.assertQuerysetUsesIndex(Appointment.objects.all()[:20])
+        self.assertQuerysetUsesIndex(Appointment.objects.filter(status='pending', appointment_date__gte=today))
+
+
+class PrescriptionAccessTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.other_patient = create_user('other-patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.other_doctor = create_user('other-doctor', DOCTOR, 'Neurology')
+        cls.admin = create_user('admin', ADMIN)
+        record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Hypertension', description='Description',
+        )
+        cls.prescription = Prescription.objects.create(
+            patient=cls.patient, doctor=cls.doctor, medical_record=record, start_date=timezone.localdate(),
+            medication_name='Lisinopril', dosage='10mg', frequency='once_daily', instructions='With food',
+        )
+        cls.reminder = MedicationReminder.objects.create(prescription=cls.prescription, reminder_time=datetime.time(8, 0))
+
+    def test_querysets_follow_the_role(self):
+        for user, visible in (
+            (self.patient, True), (self.doctor, True), (self.admin, True),
+            (self.other_patient, False), (self.other_doctor, False),
+        ):
+            with self.subTest(user=user.username):
+                self.assertEqual(list(prescriptions_for(user)), [self.prescription] if visible else [])
+                self.assertEqual(list(reminders_for(user)), [self.reminder] if visible else [])
+
+    def test_other_peoples_rows_are_not_found(self):
+        urls = [
+            reverse('prescription_detail', args=[self.prescription.pk]),
+            reverse('reminder_create', args=[self.prescription.pk]),
+            reverse('reminder_update', args=[self.reminder.pk]),
+        ]
+        for user in (self.other_patient, self.other_doctor):
+            self.client.force_login(user)
+            for url in urls:
+                with self.subTest(user=user.username, url=url):
+                    self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.other_doctor)
+        self.assertEqual(self.client.get(reverse('prescription_update', args=[self.prescription.pk])).status_code, 404)
+        self.client.force_login(self.patient)
+        self.assertEqual(self.client.get(reverse('prescription_update', args=[self.prescription.pk])).status_code, 403)
+
+        for user in (self.patient, self.doctor, self.admin):
+            self.client.force_login(user)
+            with self.subTest(user=user.username):
+                self.assertEqual(self.client.get(urls[0]).status_code, 200)
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class ReminderScheduleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+        cls.record = MedicalRecord.objects.create(
+            patient=cls.patient, doctor=cls.doctor, diagnosis='Hypertension', description='Description',
+        )
+
+    def prescription(self, **fields):
+        fields = {'start_date': datetime.date(2026, 1, 1), **fields}
+        return Prescription(
+            patient=self.patient, doctor=self.doctor, medical_record=self.record, medication_name='Lisinopril',
+            dosage='10mg', frequency='once_daily', instructions='With food', **fields,
+        )
+
+    def reminder(self, prescription=None, **fields):
+        fields = {'reminder_time': datetime.time(8, 0), **fields}
+        return MedicationReminder(prescription=prescription or self.prescription(), **fields)
+
+    def test_fires_at_the_reminder_time_in_its_zone(self):
+        reminder = self.reminder(time_zone='America/New_York')
+        # 08:00 in New York is 13:00 UTC in winter and 12:00 UTC in summer
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 1, 15, 12, 0)), utc(2026, 1, 15, 13, 0))
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 1, 15, 13, 0)), utc(2026, 1, 16, 13, 0))
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 7, 15, 11, 0)), utc(2026, 7, 15, 12, 0))
+
+    def test_unknown_zone_falls_back_to_time_zone(self):
+        reminder = self.reminder(time_zone='Nowhere/Special')
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 1, 15, 6, 0)), utc(2026, 1, 15, 8, 0))
+
+    def test_respects_start_and_end_dates(self):
+        reminder = self.reminder(self.prescription(start_date=datetime.date(2026, 2, 1)))
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 1, 15, 6, 0)), utc(2026, 2, 1, 8, 0))
+
+        reminder = self.reminder(self.prescription(end_date=datetime.date(2026, 1, 15)))
+        self.assertEqual(compute_next_fire(reminder, after=utc(2026, 1, 15, 6, 0)), utc(2026, 1, 15, 8, 0))
+        self.assertIsNone(compute_next_fire(reminder, after=utc(2026, 1, 15, 9, 0)))
+
+    def test_inactive_reminders_never_fire(self):
+        after = utc(2026, 1, 15, 6, 0)
+        self.assertIsNone(compute_next_fire(self.reminder(is_active=False), after=after))
+        self.assertIsNone(compute_next_fire(self.reminder(self.prescription(is_active=False)), after=after))
+
+    def create_reminder(self, now, **fields):
+        prescription = self.prescription(start_date=timezone.localdate() - datetime.timedelta(days=7))
+        prescription.save()
+        reminder_time = (now + datetime.timedelta(hours=1)).time().replace(second=0, microsecond=0)
+        return MedicationReminder.objects.create(prescription=prescription, reminder_time=reminder_time, **fields)
+
+    def test_upcoming_includes_reminders_the_runner_has_not_advanced(self):
+        now = timezone.now()
+        reminder = self.create_reminder(now)
+        MedicationReminder.objects.filter(pk=reminder.pk).update(next_fire_at=now - datetime.timedelta(days=2))
+
+        upcoming = upcoming_reminders(self.patient, now=now)
+        self.assertEqual([r.pk for r in upcoming], [reminder.pk])
+        self.assertEqual(upcoming[0].upcoming_at, compute_next_fire(upcoming[0], after=now))
+        self.assertGreater(upcoming[0].upcoming_at, now)
+        self.assertEqual(upcoming_reminders(self.patient, minutes=30, now=now), [])
+
+    def test_run_reminders_fires_due_reminders_once_and_reschedules(self):
+        now = timezone.now()
+        due = self.create_reminder(now)
+        MedicationReminder.objects.filter(pk=due.pk).update(next_fire_at=now - datetime.timedelta(minutes=5))
+        later = self.create_reminder(now)
+        fired = []
+
+        def receiver(sender, reminder, fire_at, **kwargs):
+            fired.append((reminder.pk, fire_at))
+
+        reminder_due.connect(receiver)
+        self.addCleanup(reminder_due.disconnect, receiver)
+        updated = MedicationReminder.objects.get(pk=due.pk).date_updated
+        call_command('run_reminders', '--once', stdout=StringIO())
+        call_command('run_reminders', '--once', stdout=StringIO())
+
+        self.assertEqual(fired, [(due.pk, now - datetime.timedelta(minutes=5))])
+        due.refresh_from_db()
+        self.assertGreater(due.date_updated, updated)
+        self.assertGreater(due.next_fire_at, now)
+        self.assertEqual(due.next_fire_at.time(), due.reminder_time)
+        later_fire_at = later.next_fire_at
+        later.refresh_from_db()
+        self.assertEqual(later.next_fire_at, later_fire_at)
+
+    def test_run_reminders_sees_reminders_created_inside_the_loaded_window(self):
+        now = timezone.now()
+        created, fired, sleeps = [], [], []
+
+        def receiver(sender, reminder, fire_at, **kwargs):
+            fired.append(reminder.pk)
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) > 1:
+                raise InterruptedError
+            reminder = self.create_reminder(now)
+            # Due before the five-minute window loaded without it ends
+            MedicationReminder.objects.filter(pk=reminder.pk).update(
+                next_fire_at=timezone.now(), date_updated=timezone.now(),
+            )
+            created.append(reminder.pk)
+
+        reminder_due.connect(receiver)
+        self.addCleanup(reminder_due.disconnect, receiver)
+        with mock.patch('time.sleep', sleep), self.assertRaises(InterruptedError):
+            call_command('run_reminders', '--poll', '2', stdout=StringIO())
+
+        self.assertEqual(sleeps[0], 2)
+        self.assertEqual(fired, created)
+
+
+class PrescriptionQueryBudgetTests(QueryBudgetMixin, TestCase):
+    budgets = {
+        'prescription_list': 7,
+        'prescription_detail': 5,
+        'prescription_create': 4,
+        'prescription_update': 6,
+        'reminder_create': 4,
+        'reminder_update': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = create_user('patient', PATIENT)
+        cls.doctor = create_user('doctor', DOCTOR, 'Cardiology')
+
+    def grow(self, count, start):
+        build_history(self.patient, self.doctor, count, start)
 
-# Create your tests here.
+    def request_for(self, name):
+        prescription = Prescription.objects.filter(patient=self.patient).order_by('pk').first()
+        reminder = prescription.reminders.first()
+        return {
+            'prescription_list': (self.patient, reverse('prescription_list')),
+            'prescription_detail': (self.patient, reverse('prescription_detail', args=[prescription.pk])),
+            'prescription_create': (self.doctor, reverse('prescription_create') + f'?medical_record_id={prescription.medical_record_id}'),
+            'prescription_update': (self.doctor, reverse('prescription_update', args=[prescription.pk])),
+            'reminder_create': (self.patient, reverse('reminder_create', args=[prescription.pk])),
+            'reminder_update': (self.patient, reverse('reminder_update', args=[reminder.pk])),
+        }[name]
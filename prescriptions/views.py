@@ -2,30 +2,50 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponseForbidden
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 
-from .models import Prescription, MedicationReminder
 from .forms import PrescriptionForm, MedicationReminderForm
+from .scheduler import upcoming_reminders as upcoming_reminders_for
+from .access import prescriptions_for, get_prescription_or_404, get_reminder_or_404
 from accounts.models import PATIENT, DOCTOR, ADMIN
+from medical_records.pagination import keyset_paginate, get_page_size
+from medical_records.access import get_record_or_404
+
+UPCOMING_REMINDER_LIMIT = 5
 
 @login_required
 def prescription_list(request):
     user_profile = request.user.profile
     
+    # Patients see their own prescriptions, doctors the ones they wrote and
+    # admins everything
+    prescriptions = prescriptions_for(request.user).select_related('patient', 'doctor')
+    page_size = get_page_size(request)
+    today = timezone.localdate()
+    
+    # Each section is paged on its own cursor, so current and past are two
+    # range scans (one query each) rather than one pass over every
+    # prescription; reminders for both pages are then fetched together, so
+    # the query count does not depend on how many prescriptions the user has
+    active_cursor = request.GET.get('active_cursor', '')
+    inactive_cursor = request.GET.get('inactive_cursor', '')
+    active_page = keyset_paginate(prescriptions.current(today), active_cursor, page_size)
+    inactive_page = keyset_paginate(prescriptions.past(today), inactive_cursor, page_size)
+    prefetch_related_objects(active_page.object_list + inactive_page.object_list, 'reminders')
+    
     if user_profile.is_patient():
-        # Patients can only see their own prescriptions
-        prescriptions = Prescription.objects.filter(patient=request.user)
-    elif user_profile.is_doctor():
-        # Doctors can see prescriptions they wrote
-        prescriptions = Prescription.objects.filter(doctor=request.user)
-    elif user_profile.is_admin():
-        # Admins can see all prescriptions
-        prescriptions = Prescription.objects.all()
+        upcoming_reminders = list(upcoming_reminders_for(request.user)[:UPCOMING_REMINDER_LIMIT])
     else:
-        return HttpResponseForbidden()
+        upcoming_reminders = []
     
     context = {
-        'prescriptions': prescriptions,
-        'active_prescriptions': prescriptions.filter(is_active=True),
+        'active_prescriptions': active_page,
+        'inactive_prescriptions': inactive_page,
+        'active_cursor': active_cursor,
+        'inactive_cursor': inactive_cursor,
+        'current_tab': 'inactive' if request.GET.get('tab') == 'inactive' else 'active',
+        'upcoming_reminders': upcoming_reminders,
         'is_patient': user_profile.is_patient(),
     }
     
@@ -44,8 +64,7 @@ def prescription_create(request):
     medical_record = None
     patient = None
     if 'medical_record_id' in request.GET:
-        from medical_records.models import MedicalRecord
-        medical_record = get_object_or_404(MedicalRecord, id=request.GET['medical_record_id'])
+        medical_record = get_record_or_404(request.user, request.GET['medical_record_id'])
         patient = medical_record.patient
     elif 'patient_id' in request.GET:
         from django.contrib.auth.models import User
@@ -106,15 +125,11 @@ def prescription_create(request):
 
 @login_required
 def prescription_detail(request, prescription_id):
-    prescription = get_object_or_404(Prescription, id=prescription_id)
-    user_profile = request.user.profile
-    
-    # Check permissions
-    if user_profile.is_patient() and prescription.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and prescription.doctor != request.user:
-        return HttpResponseForbidden()
-    
+    prescription = get_prescription_or_404(
+        request.user, prescription_id,
+        'medical_record__patient', 'medical_record__doctor',
+        prefetch=['reminders'],
+    )
     reminders = prescription.reminders.all()
     
     return render(request, 'prescriptions/prescription_detail.html', {
@@ -124,14 +139,12 @@ def prescription_detail(request, prescription_id):
 
 @login_required
 def prescription_update(request, prescription_id):
-    prescription = get_object_or_404(Prescription, id=prescription_id)
     user_profile = request.user.profile
     
-    # Check permissions (only doctors who created the prescription and admins can update)
-    if user_profile.is_doctor() and prescription.doctor != request.user:
-        return HttpResponseForbidden()
-    elif not (user_profile.is_doctor() or user_profile.is_admin()):
+    # Only doctors who created the prescription and admins can update it
+    if not (user_profile.is_doctor() or user_profile.is_admin()):
         return HttpResponseForbidden()
+    prescription = get_prescription_or_404(request.user, prescription_id)
     
     if request.method == 'POST':
         form = PrescriptionForm(request.POST, instance=prescription, doctor=request.user if user_profile.is_doctor() else None)
@@ -149,14 +162,8 @@ def prescription_update(request, prescription_id):
 
 @login_required
 def reminder_create(request, prescription_id):
-    prescription = get_object_or_404(Prescription, id=prescription_id)
-    user_profile = request.user.profile
-    
-    # Check permissions (patients can create reminders for their prescriptions)
-    if user_profile.is_patient() and prescription.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and prescription.doctor != request.user:
-        return HttpResponseForbidden()
+    # Patients can create reminders for their own prescriptions
+    prescription = get_prescription_or_404(request.user, prescription_id)
     
     if request.method == 'POST':
         form = MedicationReminderForm(request.POST, prescription=prescription)
@@ -174,15 +181,8 @@ def reminder_create(request, prescription_id):
 
 @login_required
 def reminder_update(request, reminder_id):
-    reminder = get_object_or_404(MedicationReminder, id=reminder_id)
+    reminder = get_reminder_or_404(request.user, reminder_id)
     prescription = reminder.prescription
-    user_profile = request.user.profile
-    
-    # Check permissions
-    if user_profile.is_patient() and prescription.patient != request.user:
-        return HttpResponseForbidden()
-    elif user_profile.is_doctor() and prescription.doctor != request.user:
-        return HttpResponseForbidden()
     
     if request.method == 'POST':
         form = MedicationReminderForm(request.POST, instance=reminder, prescription=prescription)